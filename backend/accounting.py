@@ -0,0 +1,338 @@
+"""
+Stage 3 Usage Accounting
+
+Every upstream Stage 3 call (streamed or full diagnosis, direct AI) is
+recorded with its model, the user who started it, prompt / cached /
+completion tokens, time to first token, total duration, retries, whether it
+was hedged, and whether it stopped at max_tokens.
+
+Calls are aggregated in memory by (UTC day, user, model, kind) and flushed to
+SQLite at STAGE3_USAGE_DB_PATH every STAGE3_USAGE_FLUSH_INTERVAL seconds
+(and on shutdown), where the admin API reads them per day and per user.
+Only calls that reach the provider are recorded: diagnoses replayed from
+the cache or shared through single-flight cost nothing and are attributed
+to the request that made the call.
+
+Cost is estimated from token counts and the STAGE3_PRICE_* settings (USD
+per million tokens); cached prompt tokens are billed at the cached rate.
+Calls cancelled because every client waiting for them disconnected are
+counted as cancelled rather than as errors. The provider reports no usage
+for a stream closed early, so their tokens and cost are not known.
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+
+
+ANONYMOUS = "anonymous"
+
+# Summed on flush; *_max columns keep the larger value instead
+COUNTERS = (
+    "calls", "errors", "cancelled", "prompt_tokens", "cached_tokens", "completion_tokens",
+    "cost_usd", "ttft_total", "ttft_count", "duration_total", "retries", "hedged", "max_tokens_hit",
+)
+MAXIMA = ("ttft_max", "duration_max", "completion_max")
+
+
+@dataclass
+class Stage3Call:
+    """One upstream Stage 3 call being timed. Filled in as the call progresses."""
+    kind: str                  # diagnosis, diagnosis_stream, direct, direct_stream
+    model: str
+    user: str = ANONYMOUS
+    max_tokens: Optional[int] = None
+    started: float = field(default_factory=time.monotonic)
+    ttft: Optional[float] = None
+    retries: int = 0
+    hedged: bool = False
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    finish_reason: Optional[str] = None
+
+    def first_token(self):
+        """Mark the arrival of the first content token."""
+        if self.ttft is None:
+            self.ttft = time.monotonic() - self.started
+
+    def retried(self, notice=None):
+        """Count a retry (usable as Upstream.call's on_retry)."""
+        self.retries += 1
+
+    def add_usage(self, usage):
+        """Take token counts from a provider usage block (None is ignored)."""
+        if usage is None:
+            return
+        self.prompt_tokens = usage.prompt_tokens or 0
+        self.completion_tokens = usage.completion_tokens or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.cached_tokens = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+
+
+class UsageLedger:
+    """In-memory Stage 3 usage aggregates with periodic flush to SQLite."""
+
+    def __init__(
+        self,
+        db_path: Path,
+        price_input: float = 1.0,
+        price_output: float = 5.0,
+        price_cached: float = 0.1,
+        flush_interval: float = 60.0,
+    ):
+        self.db_path = db_path
+        self.price_input = price_input
+        self.price_output = price_output
+        self.price_cached = price_cached
+        self.flush_interval = flush_interval
+
+        self._pending: dict[tuple, dict] = {}   # (day, user, model, kind) -> aggregate
+        self._lock = threading.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+
+        # Since startup (exposed on /health), overall and per call kind
+        self.totals = _empty()
+        self.kind_totals: dict[str, dict] = {}
+        self.flushes = 0
+        self.flush_errors = 0
+
+        self._init_db()
+
+    def start(self, kind: str, model: str, user: Optional[str] = None, max_tokens: Optional[int] = None) -> Stage3Call:
+        """Begin timing a call."""
+        return Stage3Call(kind=kind, model=model, user=user or ANONYMOUS, max_tokens=max_tokens)
+
+    def cost(self, call: Stage3Call) -> float:
+        """Estimated USD cost of a call."""
+        uncached = max(0, call.prompt_tokens - call.cached_tokens)
+        return (uncached * self.price_input
+                + call.cached_tokens * self.price_cached
+                + call.completion_tokens * self.price_output) / 1_000_000
+
+    def finish(self, call: Stage3Call, error: bool = False, cancelled: bool = False):
+        """Record a finished (or failed, or cancelled) call."""
+        duration = time.monotonic() - call.started
+        max_tokens_hit = call.finish_reason == "length" or (
+            call.max_tokens is not None and call.completion_tokens >= call.max_tokens
+        )
+        row = {
+            "calls": 1,
+            "errors": int(error),
+            "cancelled": int(cancelled),
+            "prompt_tokens": call.prompt_tokens,
+            "cached_tokens": call.cached_tokens,
+            "completion_tokens": call.completion_tokens,
+            "cost_usd": self.cost(call),
+            "ttft_total": call.ttft or 0.0,
+            "ttft_count": int(call.ttft is not None),
+            "duration_total": duration,
+            "retries": call.retries,
+            "hedged": int(call.hedged),
+            "max_tokens_hit": int(max_tokens_hit),
+            "ttft_max": call.ttft or 0.0,
+            "duration_max": duration,
+            "completion_max": call.completion_tokens,
+        }
+        key = (utc_today().isoformat(), call.user, call.model, call.kind)
+        with self._lock:
+            _merge(self._pending.setdefault(key, _empty()), row)
+            _merge(self.totals, row)
+            _merge(self.kind_totals.setdefault(call.kind, _empty()), row)
+
+    # -------------------------------------------------------------------------
+    # Flushing
+    # -------------------------------------------------------------------------
+
+    def start_flusher(self):
+        """Flush pending aggregates every flush_interval seconds in the background."""
+        self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def close(self):
+        """Stop the background flusher and write what's pending."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    async def flush(self):
+        """Write pending aggregates to SQLite (off the event loop)."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            await asyncio.to_thread(self._write, pending)
+            self.flushes += 1
+        except sqlite3.Error as e:
+            # Keep the numbers for the next attempt
+            self.flush_errors += 1
+            print(f"Warning: Stage 3 usage flush failed: {e}")
+            with self._lock:
+                for key, row in pending.items():
+                    _merge(self._pending.setdefault(key, _empty()), row)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    # -------------------------------------------------------------------------
+    # Monitoring
+    # -------------------------------------------------------------------------
+
+    def stats(self) -> dict:
+        """Totals since startup for /health, overall and per call kind."""
+        with self._lock:
+            totals = dict(self.totals)
+            kinds = {kind: dict(row) for kind, row in self.kind_totals.items()}
+            pending = len(self._pending)
+        return {
+            **_summarise(totals),
+            "kinds": {kind: _summarise(row) for kind, row in sorted(kinds.items())},
+            "pending_rows": pending,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+        }
+
+    # -------------------------------------------------------------------------
+    # Database
+    # -------------------------------------------------------------------------
+
+    def _init_db(self):
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.db_path))
+        columns = ", ".join(f"{name} {_column_type(name)} NOT NULL DEFAULT 0" for name in COUNTERS + MAXIMA)
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS stage3_usage (
+                day TEXT NOT NULL,
+                user TEXT NOT NULL,
+                model TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                {columns},
+                PRIMARY KEY (day, user, model, kind)
+            )
+        """)
+        # Columns added since the table was first created
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(stage3_usage)")}
+        for name in COUNTERS + MAXIMA:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE stage3_usage ADD COLUMN {name} {_column_type(name)} NOT NULL DEFAULT 0")
+        conn.commit()
+        conn.close()
+
+    def _write(self, pending: dict[tuple, dict]):
+        names = COUNTERS + MAXIMA
+        updates = ", ".join(
+            [f"{n} = {n} + excluded.{n}" for n in COUNTERS] + [f"{n} = MAX({n}, excluded.{n})" for n in MAXIMA]
+        )
+        conn = sqlite3.connect(str(self.db_path))
+        try:
+            conn.executemany(
+                f"""INSERT INTO stage3_usage (day, user, model, kind, {', '.join(names)})
+                    VALUES (?, ?, ?, ?, {', '.join('?' for _ in names)})
+                    ON CONFLICT (day, user, model, kind) DO UPDATE SET {updates}""",
+                [(*key, *(row[n] for n in names)) for key, row in pending.items()]
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+
+# =============================================================================
+# Queries (admin API)
+# =============================================================================
+
+def utc_today() -> date:
+    """The current UTC date: the day calls are recorded under and queried by."""
+    return datetime.now(timezone.utc).date()
+
+
+def usage_by_day(db_path: Path, days: int = 30) -> list[dict]:
+    """Flushed usage per day (newest first), with a breakdown by call kind."""
+    since = utc_today() - timedelta(days=max(0, days - 1))
+    rows = _query(db_path, "day, kind", "day >= ?", (since.isoformat(),))
+    by_day: dict[str, dict] = {}
+    for row in rows:
+        day = by_day.setdefault(row["day"], {"day": row["day"], "totals": _empty(), "kinds": {}})
+        _merge(day["totals"], row)
+        day["kinds"][row["kind"]] = _summarise(row)
+    return [
+        {"day": d["day"], **_summarise(d["totals"]), "kinds": d["kinds"]}
+        for d in sorted(by_day.values(), key=lambda d: d["day"], reverse=True)
+    ]
+
+
+def usage_by_user(db_path: Path, day: Optional[str] = None) -> list[dict]:
+    """Flushed usage per user, for one day or all time (highest cost first)."""
+    if day:
+        rows = _query(db_path, "user", "day = ?", (day,))
+    else:
+        rows = _query(db_path, "user", "1 = 1", ())
+    users = [{"user": row["user"], **_summarise(row)} for row in rows]
+    return sorted(users, key=lambda u: u["cost_usd"], reverse=True)
+
+
+def _query(db_path: Path, group_by: str, where: str, params: tuple) -> list[dict]:
+    if not db_path.exists():
+        return []
+    aggregates = ", ".join([f"SUM({n}) AS {n}" for n in COUNTERS] + [f"MAX({n}) AS {n}" for n in MAXIMA])
+    conn = sqlite3.connect(str(db_path))
+    conn.row_factory = sqlite3.Row
+    try:
+        cursor = conn.execute(
+            f"SELECT {group_by}, {aggregates} FROM stage3_usage WHERE {where} GROUP BY {group_by}",
+            params
+        )
+        return [dict(row) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+# =============================================================================
+# Aggregates
+# =============================================================================
+
+def _column_type(name: str) -> str:
+    return "REAL" if name in ("cost_usd", "ttft_total", "duration_total", "ttft_max", "duration_max") else "INTEGER"
+
+
+def _empty() -> dict:
+    return {name: 0 for name in COUNTERS + MAXIMA}
+
+
+def _merge(into: dict, row: dict):
+    for name in COUNTERS:
+        into[name] += row[name]
+    for name in MAXIMA:
+        into[name] = max(into[name], row[name])
+
+
+def _summarise(row: dict) -> dict:
+    """Readable view of an aggregate: totals, means and maxima."""
+    calls = row["calls"]
+    return {
+        "calls": calls,
+        "errors": row["errors"],
+        "cancelled": row["cancelled"],
+        "prompt_tokens": row["prompt_tokens"],
+        "cached_tokens": row["cached_tokens"],
+        "completion_tokens": row["completion_tokens"],
+        "cost_usd": round(row["cost_usd"], 6),
+        "mean_ttft_seconds": round(row["ttft_total"] / row["ttft_count"], 3) if row["ttft_count"] else None,
+        "max_ttft_seconds": round(row["ttft_max"], 3) if row["ttft_count"] else None,
+        "mean_duration_seconds": round(row["duration_total"] / calls, 3) if calls else None,
+        "max_duration_seconds": round(row["duration_max"], 3),
+        "retries": row["retries"],
+        "hedged": row["hedged"],
+        "max_tokens_hit": row["max_tokens_hit"],
+        "max_completion_tokens": row["completion_max"],
+    }
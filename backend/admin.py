@@ -6,6 +6,7 @@ This module handles:
 - User listing and management
 - Waitlist management
 - Usage statistics
+- Stage 3 token, cost and latency accounting
 
 Only loaded when ENABLE_AUTH=1 in config.
 """
@@ -20,10 +21,11 @@ from pydantic import BaseModel, Field
 
 import sys
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from config import ADMIN_PASSWORD, MAX_ANALYSES_PER_USER, MAX_NEW_USERS_PER_DAY
+from config import ADMIN_PASSWORD, MAX_ANALYSES_PER_USER, MAX_NEW_USERS_PER_DAY, STAGE3_USAGE_DB_PATH
 
 # Import database functions from auth module
 from backend.auth import get_db_connection
+from backend.accounting import usage_by_day, usage_by_user
 
 
 # =============================================================================
@@ -186,6 +188,29 @@ async def admin_stats(admin_password: str):
     }
 
 
+@router.get("/stage3/daily")
+async def stage3_daily(admin_password: str, days: int = 30):
+    """
+    Stage 3 tokens, cost and latency per day, broken down by call kind (admin only).
+    Figures lag live traffic by up to STAGE3_USAGE_FLUSH_INTERVAL.
+    """
+    if not verify_admin(admin_password):
+        raise HTTPException(status_code=401, detail="Invalid admin password")
+
+    daily = usage_by_day(STAGE3_USAGE_DB_PATH, days)
+    return {"days": daily, "total_cost_usd": round(sum(d["cost_usd"] for d in daily), 6)}
+
+
+@router.get("/stage3/users")
+async def stage3_users(admin_password: str, day: Optional[date] = None):
+    """Stage 3 tokens, cost and latency per user, for one day or all time (admin only)."""
+    if not verify_admin(admin_password):
+        raise HTTPException(status_code=401, detail="Invalid admin password")
+
+    users = usage_by_user(STAGE3_USAGE_DB_PATH, day.isoformat() if day else None)
+    return {"day": day, "users": users, "total": len(users)}
+
+
 @router.get("", include_in_schema=False)
 async def serve_admin():
     """Serve the admin page."""
@@ -341,14 +341,14 @@ def require_auth(request: Request) -> dict:
     return user
 
 
-def increment_usage(email: str) -> int:
-    """Increment usage count for a user. Returns new remaining count."""
+def increment_usage(email: str, count: int = 1) -> int:
+    """Increment usage count for a user by count analyses. Returns new remaining count."""
     conn = get_db_connection()
     cursor = conn.cursor()
 
     cursor.execute(
-        "UPDATE users SET usage_count = usage_count + 1 WHERE email = ?",
-        (email,)
+        "UPDATE users SET usage_count = usage_count + ? WHERE email = ?",
+        (count, email)
     )
 
     cursor.execute("SELECT usage_count FROM users WHERE email = ?", (email,))
@@ -0,0 +1,267 @@
+"""
+Micro-batching Scheduler for Stage 1
+
+Concurrent /analyse calls each need one DeBERTa forward pass. Run one at a
+time, 30 simultaneous requests become 30 serial passes. This module gathers
+requests that arrive within a short window into a single padded batch, runs
+one forward pass, and hands each caller back its own result.
+
+Window is controlled by two settings (see config.py):
+- STAGE1_MAX_BATCH_SIZE: dispatch as soon as this many concepts are waiting
+- STAGE1_MAX_WAIT_MS: dispatch after this long even if the batch is not full
+
+Under light load a request waits at most STAGE1_MAX_WAIT_MS. Under heavy
+load batches fill up and throughput grows with concurrency.
+
+Forward passes are blocking CPU work, so batches run in a dedicated thread
+pool (STAGE1_WORKERS threads) rather than on the asyncio event loop. SSE
+streams and /health stay responsive while the model is busy. The waiting
+queue is bounded (STAGE1_QUEUE_SIZE): when it is full, submit() raises
+SchedulerBusy immediately instead of letting latency grow without limit.
+Cohort items from submit_many() count against the same limit until their
+chunk reaches a worker. A cohort is admitted only if all of its items fit
+under STAGE1_QUEUE_SIZE alongside what is already waiting, so the limit
+is never exceeded; a cohort larger than the limit is always rejected.
+A caller that gives up (e.g. its client disconnected) cancels its future;
+its item is dropped when the batch is dispatched and never reaches the
+model. A cancelled cohort stops before its next chunk; a chunk already on
+a worker keeps its slot (and counts as busy) until the thread finishes.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+class SchedulerBusy(Exception):
+    """Raised when the Stage 1 queue is full and the request is rejected."""
+    pass
+
+
+class MicroBatcher:
+    """Collects submitted items into batches and runs them through batch_fn."""
+
+    def __init__(
+        self,
+        batch_fn: Callable[[list], list],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 10.0,
+        workers: int = 1,
+        max_queue_size: int = 64,
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.workers = max(1, workers)
+        self.max_queue_size = max(1, max_queue_size)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._running: set[asyncio.Task] = set()
+        self._cohort_waiting = 0  # submit_many items not yet on a worker
+
+        # Counters (exposed on /health)
+        self.batches_run = 0
+        self.items_run = 0
+        self.largest_batch = 0
+        self.rejected = 0
+        self.abandoned = 0
+        self.busy_workers = 0
+
+    async def start(self):
+        """Start the collector task. Must be called from a running event loop."""
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix="stage1"
+        )
+        self._slots = asyncio.Semaphore(self.workers)
+        self._task = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        """Stop the collector task and fail anything still waiting."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+        if self._queue:
+            while not self._queue.empty():
+                _, future = self._queue.get_nowait()
+                if not future.done():
+                    future.set_exception(RuntimeError("Scheduler stopped"))
+
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Queue one item and wait for its result.
+        Raises SchedulerBusy if the queue is already full.
+        """
+        if self._task is None:
+            raise RuntimeError("Scheduler not started")
+
+        if self._waiting() >= self.max_queue_size:
+            self.rejected += 1
+            raise SchedulerBusy(f"Stage 1 queue full ({self._waiting()} waiting)")
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    async def submit_many(self, items: list) -> list:
+        """
+        Run a caller-supplied batch (e.g. a whole cohort) on the worker pool.
+
+        Items are already batched, so they skip the collection window and go
+        straight to a worker in chunks of max_batch_size. Each chunk waits
+        for a free worker like any other batch, so single requests keep
+        interleaving with a large cohort. Items count as waiting until
+        their chunk reaches a worker. Raises SchedulerBusy if the items
+        don't fit under max_queue_size alongside those already waiting.
+        """
+        if self._task is None:
+            raise RuntimeError("Scheduler not started")
+        if self._waiting() + len(items) > self.max_queue_size:
+            self.rejected += 1
+            raise SchedulerBusy(f"Stage 1 queue full ({self._waiting()} waiting)")
+
+        loop = asyncio.get_running_loop()
+        results = []
+        waiting = len(items)
+        self._cohort_waiting += waiting
+
+        try:
+            for start in range(0, len(items), self.max_batch_size):
+                chunk = items[start:start + self.max_batch_size]
+                await self._slots.acquire()
+                waiting -= len(chunk)
+                self._cohort_waiting -= len(chunk)
+                self.busy_workers += 1
+
+                # The worker thread can't be interrupted: if the caller is
+                # cancelled, the slot stays taken until the chunk finishes
+                running = loop.run_in_executor(self._executor, self.batch_fn, chunk)
+                running.add_done_callback(self._chunk_done)
+                results.extend(await asyncio.shield(running))
+
+                self.batches_run += 1
+                self.items_run += len(chunk)
+                self.largest_batch = max(self.largest_batch, len(chunk))
+        finally:
+            # Failed or cancelled: the rest of the cohort is no longer waiting
+            self._cohort_waiting -= waiting
+
+        return results
+
+    def _chunk_done(self, running: asyncio.Future):
+        """Free the worker slot of a submit_many chunk once its thread is done."""
+        self.busy_workers -= 1
+        self._slots.release()
+        if not running.cancelled():
+            running.exception()  # retrieved here if the caller was cancelled
+
+    def stats(self) -> dict:
+        """Batching counters for monitoring."""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "workers": self.workers,
+            "busy_workers": self.busy_workers,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "cohort_waiting": self._cohort_waiting,
+            "max_queue_size": self.max_queue_size,
+            "rejected": self.rejected,
+            "abandoned": self.abandoned,
+            "batches_run": self.batches_run,
+            "items_run": self.items_run,
+            "largest_batch": self.largest_batch,
+            "mean_batch_size": round(self.items_run / self.batches_run, 2) if self.batches_run else 0.0,
+        }
+
+    def _waiting(self) -> int:
+        """Concepts waiting for a worker: queued single items plus cohort items."""
+        return self._queue.qsize() + self._cohort_waiting
+
+    async def _collect(self):
+        """Gather items until the batch is full or the wait window closes."""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self._queue.get()]
+
+            # Wait for a free worker before opening the window: while all
+            # workers are busy, arrivals pile up in the queue and join this
+            # batch. The slot is only taken once there is work, so an idle
+            # collector never blocks submit_many.
+            try:
+                await self._slots.acquire()
+            except asyncio.CancelledError:
+                batch[0][1].cancel()
+                raise
+
+            try:
+                deadline = loop.time() + self.max_wait
+
+                while len(batch) < self.max_batch_size:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                self._slots.release()
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError("Scheduler stopped"))
+                raise
+
+            task = asyncio.create_task(self._dispatch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _dispatch(self, batch: list):
+        """Run one batch on the worker pool and resolve each caller's future."""
+        try:
+            # Callers that gave up (e.g. client disconnected) don't need a result
+            waiting = [(item, future) for item, future in batch if not future.done()]
+            self.abandoned += len(batch) - len(waiting)
+            batch = waiting
+            if not batch:
+                return
+
+            loop = asyncio.get_running_loop()
+            self.busy_workers += 1
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self.batch_fn, [item for item, _ in batch]
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            finally:
+                self.busy_workers -= 1
+        finally:
+            self._slots.release()
+
+        self.batches_run += 1
+        self.items_run += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,438 @@
+"""
+Offline Bulk Scoring
+
+Scores large archives of concepts (research, threshold tuning) without going
+through HTTP. Reuses the Stage 1 engines and the Stage 2 rules exactly as
+the server runs them.
+
+    python -m backend.bulk_score concepts.jsonl scores.jsonl
+    python -m backend.bulk_score concepts.csv scores.jsonl --workers 4 --threads 2
+
+Input:  JSONL with a "concept" field per line, or CSV with a "concept"
+        column. An optional "id" field/column is carried through.
+Output: JSONL, one line per input record, in input order:
+        {"index": 0, "id": ..., "scores": {...}, "severity_levels": {...},
+         "summary": {...}}
+        Records that can't be scored get {"index": ..., "error": "..."}.
+
+Design:
+- The input is streamed and split into batches. Batches are sharded across
+  --workers processes, each loading its own engine with its own torch
+  thread budget (--threads), so workers don't oversubscribe cores.
+- At most 2 batches per worker are in flight, and results are written in
+  input order through a small reorder buffer. A batch stays in flight
+  until it is written, so a slow batch holds up feeding rather than
+  letting later results pile up behind it. Memory stays constant however
+  large the input file is.
+- After every batch written, a checkpoint (<output>.ckpt) records how many
+  records and bytes are safely in the output. Re-running the same command
+  resumes from there; --restart ignores the checkpoint. A checkpoint whose
+  output file is missing or shorter than it records is refused rather
+  than resumed, and the output is never touched if the input is missing.
+- A worker process that dies outright (OOM killer, segfault) or an input
+  that can't be read fails the run instead of leaving it waiting.
+
+Tests: python -m pytest backend/bulk_score.py
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Iterator
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+from stage2_rules import evaluate_concepts
+
+from config import MODEL_PATH, STAGE1_ENGINE, STAGE1_QUANTIZE, STAGE1_LENGTH_BUCKETS
+
+
+# How often the driver checks that workers and the feeder are still alive
+RESULT_POLL_SECONDS = 1.0
+
+
+# =============================================================================
+# Input
+# =============================================================================
+
+def read_records(path: Path) -> Iterator[dict]:
+    """Stream {"index", "id", "concept"} records from a JSONL or CSV file."""
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.suffix.lower() == ".csv":
+            for index, row in enumerate(csv.DictReader(f)):
+                yield _record(index, row)
+        else:
+            index = 0
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield {"index": index, "error": f"Invalid JSON: {e}"}
+                else:
+                    yield _record(index, row)
+                index += 1
+
+
+def _record(index: int, row: dict) -> dict:
+    """Validate one input row."""
+    concept = row.get("concept") if isinstance(row, dict) else None
+    record = {"index": index}
+    if isinstance(row, dict) and row.get("id") is not None:
+        record["id"] = row["id"]
+    if not isinstance(concept, str) or not concept.strip():
+        record["error"] = "Missing or empty \"concept\""
+    else:
+        record["concept"] = concept
+    return record
+
+
+def batched(records: Iterator[dict], size: int) -> Iterator[list[dict]]:
+    """Group a record stream into lists of up to size records."""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# =============================================================================
+# Checkpoints
+# =============================================================================
+
+def read_checkpoint(path: Path) -> dict:
+    """Return {"records", "offset"} from a checkpoint file, or zeros."""
+    if not path.exists():
+        return {"records": 0, "offset": 0}
+    return json.loads(path.read_text())
+
+
+def resume_point(checkpoint_path: Path, output_path: Path, restart: bool = False) -> dict:
+    """
+    Return the checkpoint to resume from, checked against the output file.
+
+    The checkpoint is only trusted if the output still holds every byte it
+    vouches for. A missing or shorter output would otherwise be padded with
+    NUL bytes up to the offset while the records before it are skipped.
+
+    Raises:
+        ValueError: The output doesn't match the checkpoint
+    """
+    if restart:
+        return {"records": 0, "offset": 0}
+
+    checkpoint = read_checkpoint(checkpoint_path)
+    if not checkpoint["offset"]:
+        return checkpoint
+
+    if not output_path.exists():
+        raise ValueError(
+            f"{checkpoint_path} records {checkpoint['records']} records but {output_path} "
+            f"is missing; pass --restart to score from the beginning"
+        )
+    size = output_path.stat().st_size
+    if size < checkpoint["offset"]:
+        raise ValueError(
+            f"{output_path} is {size} bytes but {checkpoint_path} records {checkpoint['offset']}; "
+            f"pass --restart to score from the beginning"
+        )
+    return checkpoint
+
+
+def write_checkpoint(path: Path, records: int, offset: int):
+    """Atomically record progress."""
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps({"records": records, "offset": offset}))
+    os.replace(tmp, path)
+
+
+# =============================================================================
+# Workers
+# =============================================================================
+
+def worker_main(engine_options: dict, tasks, results):
+    """Worker process: load an engine, score batches until told to stop."""
+    from backend.engines import load_engine
+
+    try:
+        engine = load_engine(**engine_options)
+    except Exception:
+        results.put(("failed", traceback.format_exc()))
+        return
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        batch_no, records = task
+
+        try:
+            results.put(("batch", batch_no, score_records(engine, records)))
+        except Exception:
+            results.put(("failed", traceback.format_exc()))
+            return
+
+    results.put(("done", None))
+
+
+def score_records(engine, records: list[dict]) -> list[dict]:
+    """Run Stage 1 and Stage 2 for a batch, passing error records through."""
+    valid = [r for r in records if "error" not in r]
+    scores = engine.predict([r["concept"] for r in valid]) if valid else []
+    evaluations = iter(evaluate_concepts(scores))
+
+    output = []
+    for record in records:
+        result = {"index": record["index"]}
+        if "id" in record:
+            result["id"] = record["id"]
+
+        if "error" in record:
+            result["error"] = record["error"]
+        else:
+            evaluation = next(evaluations)
+            result["scores"] = evaluation["confidence_scores"]
+            result["severity_levels"] = evaluation["severity_levels"]
+            result["summary"] = evaluation["summary"]
+        output.append(result)
+
+    return output
+
+
+# =============================================================================
+# Driver
+# =============================================================================
+
+def run(
+    input_path: Path,
+    output_path: Path,
+    workers: int,
+    threads: int,
+    batch_size: int,
+    engine: str,
+    quantize: bool,
+    model_path: Path,
+    restart: bool = False,
+) -> int:
+    """Score input_path into output_path. Returns the number of records written this run."""
+    from backend.cache import model_revision
+    from backend.engines import create_engine
+
+    # A mistyped input path must not cost an existing results file
+    if not input_path.is_file():
+        raise ValueError(f"Input {input_path} not found")
+
+    checkpoint_path = output_path.with_name(output_path.name + ".ckpt")
+    checkpoint = resume_point(checkpoint_path, output_path, restart)
+
+    # Drop anything written after the last checkpoint (a crash mid-batch)
+    mode = "r+b" if checkpoint["offset"] else "wb"
+    out = open(output_path, mode)
+    out.seek(checkpoint["offset"])
+    out.truncate()
+
+    if checkpoint["records"]:
+        print(f"Resuming after {checkpoint['records']} records")
+
+    engine_options = {
+        "name": engine,
+        "model_path": model_path,
+        "quantize": quantize,
+        "revision": model_revision(model_path),
+        "length_buckets": STAGE1_LENGTH_BUCKETS,
+        "threads": threads,
+    }
+
+    # One-off preparation (e.g. ONNX export) before workers race to do it
+    create_engine(**engine_options).prepare()
+
+    ctx = mp.get_context("spawn")
+    tasks = ctx.Queue(maxsize=workers * 2)
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=worker_main, args=(engine_options, tasks, results), daemon=True)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    # Batches fed but not yet written (queued, scoring, results or reorder buffer)
+    in_flight = threading.Semaphore(workers * 2)
+
+    # Feed batches from a thread so the main thread can write results meanwhile.
+    # A read error (e.g. bytes that aren't UTF-8) is reported like a worker failure.
+    fed = threading.Event()
+    feed_error: list[str] = []
+
+    def feed():
+        try:
+            records = read_records(input_path)
+            for _ in range(checkpoint["records"]):
+                next(records, None)
+            for batch_no, batch in enumerate(batched(records, batch_size)):
+                in_flight.acquire()
+                tasks.put((batch_no, batch))
+            for _ in processes:
+                tasks.put(None)
+        except Exception:
+            feed_error.append(f"Reading {input_path}:\n{traceback.format_exc()}")
+            results.put(("failed", feed_error[0]))
+        else:
+            fed.set()
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    written = checkpoint["records"]
+    written_this_run = 0
+    next_batch = 0
+    pending: dict[int, list[dict]] = {}
+    finished = 0
+    started = time.perf_counter()
+
+    try:
+        while finished < len(processes):
+            try:
+                message = results.get(timeout=RESULT_POLL_SECONDS)
+            except queue.Empty:
+                # Nothing will ever arrive from a worker killed outright
+                # (OOM killer, segfault) or a feeder that stopped early
+                crashed = [p.exitcode for p in processes if p.exitcode not in (None, 0)]
+                if crashed:
+                    raise RuntimeError(f"Worker process died (exit code {crashed[0]})")
+                if not feeder.is_alive() and not fed.is_set():
+                    raise RuntimeError(f"Bulk scoring failed:\n{feed_error[0]}" if feed_error
+                                       else "Input feeder stopped without finishing")
+                continue
+
+            if message[0] == "failed":
+                raise RuntimeError(f"Bulk scoring failed:\n{message[1]}")
+            if message[0] == "done":
+                finished += 1
+                continue
+
+            _, batch_no, batch_results = message
+            pending[batch_no] = batch_results
+
+            # Write every batch that is now contiguous with what's on disk
+            while next_batch in pending:
+                for result in pending.pop(next_batch):
+                    out.write((json.dumps(result, ensure_ascii=False) + "\n").encode("utf-8"))
+                    written += 1
+                    written_this_run += 1
+                out.flush()
+                write_checkpoint(checkpoint_path, written, out.tell())
+                next_batch += 1
+                in_flight.release()
+
+            elapsed = time.perf_counter() - started
+            print(f"\r  {written} records ({written_this_run / elapsed:.1f}/s)", end="", file=sys.stderr)
+    finally:
+        out.close()
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        print(file=sys.stderr)
+
+    return written_this_run
+
+
+# =============================================================================
+# Testing
+# =============================================================================
+
+def test_resume_point():
+    """
+    Test that a checkpoint is only resumed against an output that still backs it.
+    """
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = Path(tmp) / "scores.jsonl"
+        checkpoint_path = Path(tmp) / "scores.jsonl.ckpt"
+
+        # No checkpoint: start from zero
+        assert resume_point(checkpoint_path, output_path) == {"records": 0, "offset": 0}
+
+        output_path.write_bytes(b'{"index": 0}\n{"index": 1}\n')
+        write_checkpoint(checkpoint_path, 2, output_path.stat().st_size)
+        assert resume_point(checkpoint_path, output_path)["records"] == 2
+
+        # Bytes past the checkpoint are a crash mid-batch, dropped on resume
+        with open(output_path, "ab") as f:
+            f.write(b'{"ind')
+        assert resume_point(checkpoint_path, output_path)["records"] == 2
+
+        # Truncated output
+        output_path.write_bytes(b'{"index": 0}\n')
+        try:
+            resume_point(checkpoint_path, output_path)
+        except ValueError as e:
+            assert "--restart" in str(e)
+        else:
+            raise AssertionError("Resumed against a truncated output")
+
+        # Missing output
+        output_path.unlink()
+        try:
+            resume_point(checkpoint_path, output_path)
+        except ValueError as e:
+            assert "missing" in str(e)
+        else:
+            raise AssertionError("Resumed against a missing output")
+
+        # --restart ignores the checkpoint
+        assert resume_point(checkpoint_path, output_path, restart=True) == {"records": 0, "offset": 0}
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+if __name__ == "__main__":
+    cpus = os.cpu_count() or 1
+
+    parser = argparse.ArgumentParser(description="Score a JSONL/CSV file of concepts offline")
+    parser.add_argument("input", type=Path, help="JSONL (\"concept\" field) or CSV (\"concept\" column)")
+    parser.add_argument("output", type=Path, help="JSONL results file (resumable)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes (default: 1)")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Torch/ORT threads per worker (default: cores / workers)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Concepts per forward pass (default: 32)")
+    parser.add_argument("--engine", default=STAGE1_ENGINE, help=f"Inference engine (default: {STAGE1_ENGINE})")
+    parser.add_argument("--quantize", action=argparse.BooleanOptionalAction, default=STAGE1_QUANTIZE,
+                        help="Use int8 inference (default: STAGE1_QUANTIZE)")
+    parser.add_argument("--model", type=Path, default=MODEL_PATH, help="Model directory")
+    parser.add_argument("--restart", action="store_true", help="Ignore any checkpoint and start over")
+    args = parser.parse_args()
+
+    workers = max(1, args.workers)
+    threads = args.threads or max(1, cpus // workers)
+
+    print(f"Scoring {args.input} → {args.output} ({workers} worker(s) × {threads} thread(s), "
+          f"batches of {args.batch_size}, {args.engine})")
+
+    start = time.perf_counter()
+    try:
+        count = run(
+            args.input, args.output,
+            workers=workers, threads=threads, batch_size=max(1, args.batch_size),
+            engine=args.engine, quantize=args.quantize, model_path=args.model,
+            restart=args.restart,
+        )
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+    elapsed = time.perf_counter() - start
+    print(f"Done: {count} records in {elapsed:.1f}s ({count / elapsed:.1f}/s)" if elapsed else f"Done: {count} records")
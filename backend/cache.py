@@ -0,0 +1,281 @@
+"""
+Result Caches
+
+Stage 1 is deterministic: the same concept text through the same model
+always produces the same confidence scores. Students resubmit the same
+concept and the sample concepts button sends the same nine texts over and
+over, so repeat forward passes are pure waste.
+
+Stage1Cache:
+- Key: SHA-256 of the normalised concept text plus the model revision
+- Memory tier: LRU, bounded to STAGE1_CACHE_SIZE entries
+- Persistent tier (optional): SQLite at STAGE1_CACHE_DB_PATH, survives restarts.
+  Its reads and writes run in a worker thread, never on the event loop;
+  only the memory tier is consulted in place.
+
+The model revision is a fingerprint of the checkpoint files, so swapping in
+a retrained model never serves stale scores.
+
+DiagnosisCache:
+- Key: SHA-256 of the normalised concept text, its severity_levels map,
+  the Haiku prompt version and the model name
+- Memory LRU, bounded to DIAGNOSIS_CACHE_SIZE entries, each expiring
+  DIAGNOSIS_CACHE_TTL seconds after it was stored
+- Only complete diagnoses are stored, never errors or partial streams
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+
+# =============================================================================
+# Keys
+# =============================================================================
+
+def normalize_concept(concept: str) -> str:
+    """
+    Normalise concept text for cache keys.
+    Unicode NFC, whitespace runs collapsed, ends trimmed. Case is kept:
+    the tokenizer is case-sensitive, so case changes can change scores.
+    """
+    text = unicodedata.normalize("NFC", concept)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def model_revision(model_path: Path) -> str:
+    """
+    Fingerprint a model checkpoint directory.
+
+    Hashes config.json in full plus the size and first 1 MB of each weight
+    file. Cheap enough for startup (no need to read 738 MB) while still
+    changing whenever the checkpoint is replaced.
+    """
+    digest = hashlib.sha256()
+
+    config_file = model_path / "config.json"
+    if config_file.exists():
+        digest.update(config_file.read_bytes())
+
+    for weights in sorted(model_path.glob("*.safetensors")) + sorted(model_path.glob("*.bin")):
+        digest.update(weights.name.encode("utf-8"))
+        digest.update(str(weights.stat().st_size).encode("utf-8"))
+        with open(weights, "rb") as f:
+            digest.update(f.read(1024 * 1024))
+
+    return digest.hexdigest()[:16]
+
+
+# =============================================================================
+# Stage 1 Cache
+# =============================================================================
+
+class Stage1Cache:
+    """Two-tier (memory LRU + optional SQLite) cache for confidence scores."""
+
+    def __init__(self, revision: str, max_entries: int = 1024, db_path: Optional[Path] = None):
+        self.revision = revision
+        self.max_entries = max(0, max_entries)
+        self.db_path = db_path
+
+        # Guards the memory tier and counters
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, dict[str, float]] = OrderedDict()
+
+        # Counters (exposed on /health)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.db_path:
+            self._init_db()
+
+    def key(self, concept: str) -> str:
+        """Cache key: hash of normalised text and model revision."""
+        text = normalize_concept(concept)
+        return hashlib.sha256(f"{self.revision}\n{text}".encode("utf-8")).hexdigest()
+
+    async def get(self, concept: str) -> Optional[dict[str, float]]:
+        """Return cached scores for concept, or None on a miss."""
+        key = self.key(concept)
+
+        with self._lock:
+            scores = self._entries.get(key)
+            if scores is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(scores)
+
+        if self.db_path:
+            scores = await asyncio.to_thread(self._db_get, key)
+            if scores is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._remember(key, scores)
+                return dict(scores)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def put(self, concept: str, scores: dict[str, float]):
+        """Store scores for concept in both tiers."""
+        key = self.key(concept)
+
+        with self._lock:
+            self._remember(key, dict(scores))
+
+        if self.db_path:
+            await asyncio.to_thread(self._db_put, key, scores)
+
+    def stats(self) -> dict:
+        """Cache counters for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "revision": self.revision,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "persistent": self.db_path is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            }
+
+    def _remember(self, key: str, scores: dict[str, float]):
+        """Insert into the memory tier, evicting least recently used. Caller holds lock."""
+        if self.max_entries == 0:
+            return
+        self._entries[key] = scores
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # -------------------------------------------------------------------------
+    # SQLite tier
+    # -------------------------------------------------------------------------
+
+    def _init_db(self):
+        """Create the persistent cache table if needed."""
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        conn = sqlite3.connect(str(self.db_path))
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stage1_cache (
+                key TEXT PRIMARY KEY,
+                scores TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        """)
+        conn.commit()
+        conn.close()
+
+    def _db_get(self, key: str) -> Optional[dict[str, float]]:
+        """Look up scores in the persistent tier."""
+        try:
+            conn = sqlite3.connect(str(self.db_path))
+            row = conn.execute("SELECT scores FROM stage1_cache WHERE key = ?", (key,)).fetchone()
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"Stage 1 cache read failed: {e}")
+            return None
+
+        return json.loads(row[0]) if row else None
+
+    def _db_put(self, key: str, scores: dict[str, float]):
+        """Write scores to the persistent tier."""
+        try:
+            conn = sqlite3.connect(str(self.db_path))
+            conn.execute(
+                "INSERT OR REPLACE INTO stage1_cache (key, scores, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(scores), datetime.now().isoformat())
+            )
+            conn.commit()
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"Stage 1 cache write failed: {e}")
+
+
+# =============================================================================
+# Diagnosis Cache
+# =============================================================================
+
+class DiagnosisCache:
+    """TTL + LRU cache for complete Stage 3 diagnoses."""
+
+    def __init__(self, prompt_version: str, model: str, max_entries: int = 512, ttl_seconds: float = 86400):
+        self.prompt_version = prompt_version
+        self.model = model
+        self.max_entries = max(0, max_entries)
+        self.ttl = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+        # Counters (exposed on /health)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def key(self, concept: str, severity_levels: dict[str, str]) -> str:
+        """Cache key: hash of normalised text, severity pattern, prompt version and model."""
+        severity = json.dumps(severity_levels, sort_keys=True)
+        text = normalize_concept(concept)
+        return hashlib.sha256(
+            f"{self.model}\n{self.prompt_version}\n{severity}\n{text}".encode("utf-8")
+        ).hexdigest()
+
+    def get(self, concept: str, severity_levels: dict[str, str]) -> Optional[str]:
+        """Return the cached diagnosis, or None on a miss or expired entry."""
+        key = self.key(concept, severity_levels)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, diagnosis = entry
+                if time.monotonic() - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return diagnosis
+                del self._entries[key]
+                self.expired += 1
+            self.misses += 1
+            return None
+
+    def put(self, concept: str, severity_levels: dict[str, str], diagnosis: str):
+        """Store a complete diagnosis, evicting least recently used entries."""
+        if self.max_entries == 0 or self.ttl <= 0:
+            return
+        key = self.key(concept, severity_levels)
+
+        with self._lock:
+            self._entries[key] = (time.monotonic(), diagnosis)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Cache counters for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "prompt_version": self.prompt_version,
+                "model": self.model,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
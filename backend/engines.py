@@ -0,0 +1,402 @@
+"""
+Stage 1 Inference Engines
+
+score_concept needs confidence scores for a batch of concepts. How they are
+computed is up to the engine selected with STAGE1_ENGINE (see config.py):
+
+- torch: eager PyTorch (default). Optional int8 dynamic quantization.
+- onnx:  ONNX Runtime with full graph optimizations. The graph is exported
+         from the local checkpoint on first start and reused afterwards.
+         On CPU this is usually much faster than eager torch for a
+         12-layer DeBERTa. Optional int8 via ORT's dynamic quantizer.
+
+Every engine shares the same contract: predict(concepts) returns one
+{dimension: confidence} dict per concept, in input order, with the sigmoid
+and DIMENSION_ORDER mapping applied here once. Each engine also records
+its own forward-pass latency, reported on /health.
+
+Length bucketing: padding a 40-token concept to the length of a 400-token
+paragraph wastes most of the attention compute (quadratic in sequence
+length). Batches are split into buckets by token length
+(STAGE1_LENGTH_BUCKETS), each bucket is padded only to its own longest
+sequence, and results are put back in input order.
+
+Thread safety: predict() is called from several Stage 1 worker threads on
+one engine. Tokenisation is serialised (the shared fast tokenizer is not
+reentrant); _run() must be safe to call concurrently.
+
+Adding an engine: subclass InferenceEngine, implement load() and
+_run() (padded int64 arrays → logits), and register it in ENGINES.
+One-off work that must not race between processes (e.g. an export)
+belongs in prepare().
+"""
+
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+
+
+DIMENSION_ORDER = ["CLAIM", "EVIDENCE", "SCOPE", "ASSUMPTIONS", "GAPS"]
+
+MAX_LENGTH = 512
+
+
+def bucket_by_length(lengths: Sequence[int], boundaries: Sequence[int]) -> list[list[int]]:
+    """
+    Group sequence indices by token length.
+
+    A sequence goes in the first bucket whose boundary is >= its length;
+    longer sequences share a final bucket. With no boundaries everything
+    is one bucket (plain pad-to-longest). Empty buckets are dropped.
+
+    >>> bucket_by_length([40, 400, 60, 130], [64, 128, 256])
+    [[0, 2], [3], [1]]
+    """
+    buckets: list[list[int]] = [[] for _ in range(len(boundaries) + 1)]
+    for index, length in enumerate(lengths):
+        buckets[bisect_left(boundaries, length)].append(index)
+    return [bucket for bucket in buckets if bucket]
+
+
+# =============================================================================
+# Base Engine
+# =============================================================================
+
+class InferenceEngine:
+    """Common interface and latency accounting for Stage 1 engines."""
+
+    name = "base"
+
+    def __init__(
+        self,
+        model_path: Path,
+        quantize: bool = False,
+        revision: str = "",
+        length_buckets: Sequence[int] = (),
+        threads: int = 0,
+        interop_threads: int = 0,
+    ):
+        self.model_path = model_path
+        self.quantize = quantize
+        self.revision = revision
+        self.length_buckets = sorted(length_buckets)
+        self.threads = threads  # intra-op threads; 0 = library default
+        self.interop_threads = interop_threads
+        self.precision = "fp32"
+        self.device = "cpu"
+        self.tokenizer = None
+
+        # HF fast tokenizers mutate their truncation/padding state on every
+        # call and raise "Already borrowed" when called from two threads at
+        # once. Tokenising is cheap next to the forward pass, so calls are
+        # serialised and only _run() executes concurrently.
+        self._tokenizer_lock = threading.Lock()
+
+        # Latency accounting (predict runs on Stage 1 worker threads)
+        self._lock = threading.Lock()
+        self._recent_ms: deque[float] = deque(maxlen=256)
+        self.batches = 0
+        self.items = 0
+        self.total_ms = 0.0
+        self.real_tokens = 0
+        self.padded_tokens = 0
+
+    def prepare(self):
+        """
+        One-off preparation that must not run concurrently (e.g. exporting
+        a graph). Safe to call before starting worker processes; load()
+        calls it too.
+        """
+        pass
+
+    def load(self):
+        """Load tokenizer and model. Called once at startup."""
+        raise NotImplementedError
+
+    def _run(self, batch: dict[str, np.ndarray]) -> np.ndarray:
+        """Run one forward pass on a padded batch. Returns logits of shape (n, 5)."""
+        raise NotImplementedError
+
+    def _forward(self, concepts: list[str]) -> np.ndarray:
+        """Tokenise, run each length bucket separately, restore input order."""
+        with self._tokenizer_lock:
+            encoded = self.tokenizer(concepts, truncation=True, max_length=MAX_LENGTH)
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+
+        logits = np.empty((len(concepts), len(DIMENSION_ORDER)), dtype=np.float32)
+        padded = 0
+
+        for indices in bucket_by_length(lengths, self.length_buckets):
+            width = max(lengths[i] for i in indices)
+            logits[indices] = self._run(self._pad(encoded, indices, width))
+            padded += len(indices) * width
+
+        with self._lock:
+            self.real_tokens += sum(lengths)
+            self.padded_tokens += padded
+
+        return logits
+
+    def _pad(self, encoded, indices: list[int], width: int) -> dict[str, np.ndarray]:
+        """Right-pad the selected sequences to width as int64 arrays."""
+        batch = {}
+        for key in encoded.keys():
+            pad_value = self.tokenizer.pad_token_id if key == "input_ids" else 0
+            array = np.full((len(indices), width), pad_value, dtype=np.int64)
+            for row, i in enumerate(indices):
+                sequence = encoded[key][i]
+                array[row, :len(sequence)] = sequence
+            batch[key] = array
+        return batch
+
+    def predict(self, concepts: list[str]) -> list[dict[str, float]]:
+        """Score concepts. Returns one confidence dict per concept, in order."""
+        start = time.perf_counter()
+        logits = self._forward(concepts)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            self._recent_ms.append(elapsed_ms)
+            self.batches += 1
+            self.items += len(concepts)
+            self.total_ms += elapsed_ms
+
+        confidence = 1.0 / (1.0 + np.exp(-logits))
+        return [
+            {dim: float(conf) for dim, conf in zip(DIMENSION_ORDER, row)}
+            for row in confidence
+        ]
+
+    def warm_up(self) -> float:
+        """Run one throwaway pass so the first real request isn't slow. Returns ms."""
+        start = time.perf_counter()
+        self._forward(["Warm-up concept for the Stage 1 engine."])
+        return (time.perf_counter() - start) * 1000
+
+    def stats(self) -> dict:
+        """Engine identity and forward-pass latency."""
+        with self._lock:
+            recent = sorted(self._recent_ms)
+            return {
+                "engine": self.name,
+                "precision": self.precision,
+                "device": self.device,
+                "threads": self.threads,
+                "interop_threads": self.interop_threads,
+                "batches": self.batches,
+                "items": self.items,
+                "mean_batch_ms": round(self.total_ms / self.batches, 1) if self.batches else 0.0,
+                "mean_item_ms": round(self.total_ms / self.items, 1) if self.items else 0.0,
+                "p50_batch_ms": round(recent[len(recent) // 2], 1) if recent else 0.0,
+                "p95_batch_ms": round(recent[int(len(recent) * 0.95)], 1) if recent else 0.0,
+                "length_buckets": self.length_buckets,
+                "padding_efficiency": round(self.real_tokens / self.padded_tokens, 3) if self.padded_tokens else 1.0,
+            }
+
+
+# =============================================================================
+# Eager PyTorch
+# =============================================================================
+
+class TorchEngine(InferenceEngine):
+    """Eager PyTorch inference, GPU if available."""
+
+    name = "torch"
+
+    def load(self):
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        if self.interop_threads:
+            # Only settable once per process, before any inter-op work
+            try:
+                torch.set_num_interop_threads(self.interop_threads)
+            except RuntimeError:
+                print("Warning: torch inter-op threads already fixed, ignoring interop_threads")
+                self.interop_threads = torch.get_num_interop_threads()
+
+        self.tokenizer = AutoTokenizer.from_pretrained(str(self.model_path))
+        self.model = AutoModelForSequenceClassification.from_pretrained(str(self.model_path))
+        self.model.eval()
+
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.model.to(device)
+        self.device = device.type
+
+        # INT8 dynamic quantization (CPU kernels only)
+        if self.quantize:
+            if device.type == "cpu":
+                from backend.quantization import quantize_model
+                self.model = quantize_model(self.model, inplace=True)
+                self.precision = "int8"
+            else:
+                print("Warning: STAGE1_QUANTIZE ignored on GPU, running fp32")
+
+    def _run(self, batch: dict[str, np.ndarray]) -> np.ndarray:
+        import torch
+
+        inputs = {k: torch.from_numpy(v).to(self.model.device) for k, v in batch.items()}
+
+        with torch.no_grad():
+            return self.model(**inputs).logits.float().cpu().numpy()
+
+
+# =============================================================================
+# ONNX Runtime
+# =============================================================================
+
+class OnnxEngine(InferenceEngine):
+    """ONNX Runtime inference on a graph exported from the local checkpoint."""
+
+    name = "onnx"
+
+    def __init__(self, model_path: Path, **kwargs):
+        super().__init__(model_path, **kwargs)
+        self.onnx_dir = model_path / "onnx"
+
+    def prepare(self):
+        """Export (and optionally quantize) the graph if this revision has none yet."""
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError:
+            raise RuntimeError(
+                "STAGE1_ENGINE=onnx requires onnxruntime. Install it with: pip install onnxruntime onnx"
+            )
+        from transformers import AutoTokenizer
+
+        if self.tokenizer is None:
+            self.tokenizer = AutoTokenizer.from_pretrained(str(self.model_path))
+
+        graph_path = self._graph_path()
+        if not graph_path.exists():
+            self._export(graph_path)
+
+    def load(self):
+        import onnxruntime as ort
+
+        self.prepare()
+        graph_path = self._graph_path()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        if self.interop_threads:
+            options.inter_op_num_threads = self.interop_threads
+
+        providers = ["CPUExecutionProvider"]
+        if "CUDAExecutionProvider" in ort.get_available_providers() and not self.quantize:
+            providers.insert(0, "CUDAExecutionProvider")
+
+        self.session = ort.InferenceSession(str(graph_path), options, providers=providers)
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.device = "cuda" if self.session.get_providers()[0] == "CUDAExecutionProvider" else "cpu"
+        self.precision = "int8" if self.quantize else "fp32"
+        print(f"ONNX graph: {graph_path}")
+
+    def _graph_path(self) -> Path:
+        """Exported graphs are named by checkpoint revision so a new model re-exports."""
+        suffix = "-int8" if self.quantize else ""
+        stem = f"model-{self.revision}" if self.revision else "model"
+        return self.onnx_dir / f"{stem}{suffix}.onnx"
+
+    def _export(self, graph_path: Path):
+        """Export the checkpoint to ONNX (and quantize it if requested)."""
+        import torch
+        from transformers import AutoModelForSequenceClassification
+
+        self.onnx_dir.mkdir(parents=True, exist_ok=True)
+        fp32_path = graph_path.with_name(graph_path.name.replace("-int8", ""))
+
+        if not fp32_path.exists():
+            print(f"Exporting ONNX graph to {fp32_path} (first start only)...")
+            model = AutoModelForSequenceClassification.from_pretrained(str(self.model_path)).eval()
+            sample = self.tokenizer(["Export sample concept.", "Second"], return_tensors="pt", padding=True)
+
+            export_kwargs = {}
+            if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+                # The TorchScript exporter handles DeBERTa's dynamic axes without onnxscript
+                export_kwargs["dynamo"] = False
+
+            torch.onnx.export(
+                model,
+                (sample["input_ids"], sample["attention_mask"]),
+                str(fp32_path),
+                input_names=["input_ids", "attention_mask"],
+                output_names=["logits"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "logits": {0: "batch"},
+                },
+                opset_version=17,
+                **export_kwargs
+            )
+            del model
+
+        if self.quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            print(f"Quantizing ONNX graph to {graph_path}...")
+            quantize_dynamic(str(fp32_path), str(graph_path), weight_type=QuantType.QInt8)
+
+    def _run(self, batch: dict[str, np.ndarray]) -> np.ndarray:
+        feed = {name: batch[name] for name in self.input_names}
+        return self.session.run(["logits"], feed)[0]
+
+
+# =============================================================================
+# Factory
+# =============================================================================
+
+ENGINES = {
+    "torch": TorchEngine,
+    "onnx": OnnxEngine,
+}
+
+
+def create_engine(
+    name: str,
+    model_path: Path,
+    quantize: bool = False,
+    revision: str = "",
+    length_buckets: Sequence[int] = (),
+    threads: int = 0,
+    interop_threads: int = 0,
+) -> InferenceEngine:
+    """Construct the named engine without loading it."""
+    if name not in ENGINES:
+        raise RuntimeError(f"Unknown STAGE1_ENGINE '{name}' (choose from: {', '.join(ENGINES)})")
+
+    return ENGINES[name](
+        model_path,
+        quantize=quantize,
+        revision=revision,
+        length_buckets=length_buckets,
+        threads=threads,
+        interop_threads=interop_threads
+    )
+
+
+def load_engine(
+    name: str,
+    model_path: Path,
+    quantize: bool = False,
+    revision: str = "",
+    length_buckets: Sequence[int] = (),
+    threads: int = 0,
+    interop_threads: int = 0,
+) -> InferenceEngine:
+    """Construct, load and warm up the named engine."""
+    engine = create_engine(name, model_path, quantize, revision, length_buckets, threads, interop_threads)
+    engine.load()
+    warm_ms = engine.warm_up()
+    print(f"Stage 1 engine: {engine.name} ({engine.precision}, {engine.device}), warm-up {warm_ms:.0f} ms")
+    return engine
@@ -0,0 +1,208 @@
+"""
+Hedged Stage 3 Streams
+
+Most diagnoses start streaming within a second or two, but now and then
+OpenRouter routes a request to a slow provider and the first token takes
+many times longer. Waiting out that tail is what dominates p99
+time-to-first-token (TTFT) on /analyse/stream.
+
+With hedging enabled, a stream that has not produced its first content
+delta after the STAGE3_HEDGE_PERCENTILE of recent TTFTs (but at least
+STAGE3_HEDGE_MIN_DELAY seconds) gets a second, identical request. Whichever
+streams first wins; the other is cancelled and its connection closed.
+
+Hedges cost a second upstream call, so at most STAGE3_HEDGE_MAX_RATE of
+recent streams may fire one, and none fire until enough TTFTs have been
+seen to estimate the percentile. TTFTs are recorded with hedging disabled
+too, so /health shows what the delay would be before it is switched on.
+Every race records the time from the first request's start, so hedging
+doesn't lower the percentile it is driven by.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+
+# =============================================================================
+# Primed Streams
+# =============================================================================
+
+class PrimedStream:
+    """
+    An opened OpenAI chat stream whose chunks up to (and including) the
+    first content delta have already been read. Iterating it replays those
+    chunks, then continues with the rest of the stream.
+    """
+
+    def __init__(self, stream: Any, chunks: AsyncIterator[Any], buffered: list[Any]):
+        self.stream = stream
+        self._chunks = chunks
+        self._buffered = buffered
+
+        # Set by Hedger.race() (per-request metrics)
+        self.hedged = False
+        self.hedge_won = False
+
+    @classmethod
+    async def open(cls, fn: Callable[[], Awaitable[Any]]) -> "PrimedStream":
+        """Open a stream with fn() and read until its first content delta."""
+        stream = await fn()
+        try:
+            chunks = stream.__aiter__()
+            buffered = []
+            async for chunk in chunks:
+                buffered.append(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    break
+            return cls(stream, chunks, buffered)
+        except BaseException:
+            await stream.close()
+            raise
+
+    async def __aenter__(self) -> "PrimedStream":
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def __aiter__(self):
+        while self._buffered:
+            yield self._buffered.pop(0)
+        async for chunk in self._chunks:
+            yield chunk
+
+    async def close(self):
+        """Close the underlying stream and return its connection to the pool."""
+        await self.stream.close()
+
+
+# =============================================================================
+# Hedger
+# =============================================================================
+
+class Hedger:
+    """Races a second request against a slow first one, within a hedge-rate cap."""
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        percentile: float = 95.0,
+        min_delay: float = 1.0,
+        max_rate: float = 0.1,
+        window: int = 200,
+        min_samples: int = 20,
+    ):
+        self.enabled = enabled
+        self.percentile = min(100.0, max(0.0, percentile))
+        self.min_delay = min_delay
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+
+        self._ttfts: deque[float] = deque(maxlen=max(1, window))
+        self._recent: deque[bool] = deque(maxlen=100)  # True = hedge fired
+
+        # Counters (exposed on /health)
+        self.races = 0
+        self.fired = 0
+        self.won = 0
+        self.capped = 0
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None until enough TTFTs were seen."""
+        if len(self._ttfts) < self.min_samples:
+            return None
+        return max(self.min_delay, self._quantile(self.percentile))
+
+    async def race(self, fn: Callable[[], Awaitable[PrimedStream]]) -> PrimedStream:
+        """
+        Run fn() and return its primed stream, hedging with a second fn()
+        if the first is slower than delay(). Raises the last error if every
+        attempt in the race failed.
+        """
+        self.races += 1
+        started = {}
+
+        def launch() -> asyncio.Task:
+            task = asyncio.create_task(fn())
+            started[task] = time.monotonic()
+            return task
+
+        primary = launch()
+        tasks = [primary]
+        winner = None
+        try:
+            delay = self.delay() if self.enabled else None
+            if delay is not None:
+                await asyncio.wait(tasks, timeout=delay)
+                if not primary.done():
+                    if sum(self._recent) < self.max_rate * self._recent.maxlen:
+                        self._recent.append(True)
+                        self.fired += 1
+                        tasks.append(launch())
+                    else:
+                        self._recent.append(False)
+                        self.capped += 1
+                else:
+                    self._recent.append(False)
+
+            winner = await self._first_success(tasks)
+        finally:
+            await self._cancel_losers(tasks, winner)
+
+        # Measured from the primary's start even when the hedge wins: that is
+        # a lower bound on the primary's own TTFT. Timing the hedge from its
+        # later start would record only the fast half of every hedged race,
+        # pulling the percentile (and the next hedge) ever earlier.
+        self._ttfts.append(time.monotonic() - started[primary])
+        result = winner.result()
+        result.hedged = len(tasks) > 1
+        result.hedge_won = winner is not primary
+        if result.hedge_won:
+            self.won += 1
+        return result
+
+    def stats(self) -> dict:
+        """TTFT percentiles and hedge counters for monitoring."""
+        delay = self.delay()
+        return {
+            "enabled": self.enabled,
+            "delay_seconds": round(delay, 3) if delay is not None else None,
+            "ttft_p50_seconds": round(self._quantile(50), 3) if self._ttfts else None,
+            "ttft_p95_seconds": round(self._quantile(95), 3) if self._ttfts else None,
+            "samples": len(self._ttfts),
+            "races": self.races,
+            "fired": self.fired,
+            "won": self.won,
+            "capped": self.capped,
+            "max_rate": self.max_rate,
+        }
+
+    def _quantile(self, percentile: float) -> float:
+        ordered = sorted(self._ttfts)
+        return ordered[round(percentile / 100 * (len(ordered) - 1))]
+
+    @staticmethod
+    async def _first_success(tasks: list[asyncio.Task]) -> asyncio.Task:
+        """The first task to finish without error; re-raises if all failed."""
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task
+                error = task.exception()
+        raise error
+
+    @staticmethod
+    async def _cancel_losers(tasks: list[asyncio.Task], winner: Optional[asyncio.Task]):
+        """Cancel every request but the winner and close streams that opened too late."""
+        losers = [task for task in tasks if task is not winner]
+        for task in losers:
+            task.cancel()
+        results = await asyncio.gather(*losers, return_exceptions=True)
+        for result in results:
+            if isinstance(result, PrimedStream):
+                await result.close()
@@ -0,0 +1,158 @@
+"""
+Live Scoring
+
+Students revise a concept sentence by sentence and want to watch the
+●/◐/○ indicators move as they type. Polling /analyse for every keystroke
+would bury the model, so the /analyse/live WebSocket scores edits instead:
+
+- Each edit carries the full text. It is debounced server-side: scoring
+  starts once no newer edit has arrived for LIVE_DEBOUNCE_MS.
+- A newer edit supersedes whatever is pending for the connection. A job
+  still queued for Stage 1 is cancelled, so its item never reaches the
+  model; one already in a forward pass finishes, but its result is
+  dropped.
+- Each connection has at most one scoring job at a time and at most
+  LIVE_MAX_SCORES_PER_MINUTE of them. Over budget, the latest text waits
+  for the budget instead of being dropped.
+- Only Stage 1 scores and Stage 2 severity levels are sent back. Stage 3
+  runs only when the client asks for a diagnosis.
+
+Unchanged text costs nothing either way: the score cache answers it. A
+job that fails is answered with an error message rather than dropped.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+
+class LiveScoring:
+    """Settings and counters shared by every live-scoring connection."""
+
+    def __init__(self, debounce_ms: float = 300.0, max_per_minute: int = 60):
+        self.debounce = max(0.0, debounce_ms) / 1000.0
+        self.max_per_minute = max(1, max_per_minute)
+
+        # Counters (exposed on /health)
+        self.connections = 0
+        self.opened = 0
+        self.edits = 0
+        self.scored = 0
+        self.superseded = 0
+        self.deferred = 0
+        self.diagnoses = 0
+        self.failed = 0
+
+    def session(self, send: Callable[[dict], Awaitable[None]]) -> "LiveSession":
+        """A new connection's session; send delivers one JSON message to the client."""
+        return LiveSession(self, send)
+
+    def stats(self) -> dict:
+        """Connection and scoring counters for monitoring."""
+        return {
+            "connections": self.connections,
+            "opened": self.opened,
+            "debounce_ms": round(self.debounce * 1000, 1),
+            "max_scores_per_minute": self.max_per_minute,
+            "edits": self.edits,
+            "scored": self.scored,
+            "superseded": self.superseded,
+            "deferred": self.deferred,
+            "diagnoses": self.diagnoses,
+            "failed": self.failed,
+        }
+
+
+class LiveSession:
+    """One connection's debounced scoring and on-demand diagnosis."""
+
+    def __init__(self, live: LiveScoring, send: Callable[[dict], Awaitable[None]]):
+        self.live = live
+        self._send = send
+        self._send_lock = asyncio.Lock()
+        self._scoring: Optional[asyncio.Task] = None
+        self._in_model = False   # the current scoring job is past debounce and budget
+        self._diagnosis: Optional[asyncio.Task] = None
+        self._starts: deque[float] = deque()  # scoring job start times, last minute
+
+        live.connections += 1
+        live.opened += 1
+
+    def edit(self, seq: Any, score: Callable[[], Awaitable[dict]]):
+        """The text changed: score() it once edits settle, superseding anything pending."""
+        self.live.edits += 1
+        self.supersede()
+        self._scoring = asyncio.create_task(self._score(seq, score))
+
+    def supersede(self):
+        """Cancel pending scoring (e.g. the text became invalid)."""
+        if self._scoring is not None and not self._scoring.done():
+            if self._in_model:
+                self.live.superseded += 1
+            self._scoring.cancel()
+        self._scoring = None
+        self._in_model = False
+
+    def diagnose(self, messages: Callable[[], AsyncIterator[dict]]):
+        """Stream the messages of an explicitly requested diagnosis, superseding an earlier one."""
+        self.live.diagnoses += 1
+        if self._diagnosis is not None and not self._diagnosis.done():
+            self._diagnosis.cancel()
+        self._diagnosis = asyncio.create_task(self._relay(messages))
+
+    async def close(self):
+        """The connection closed: cancel pending work."""
+        tasks = [t for t in (self._scoring, self._diagnosis) if t is not None and not t.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.live.connections -= 1
+
+    async def send(self, message: dict):
+        """Send one message; never interleaved with another, never cut off by a cancel."""
+        await asyncio.shield(self._send_one(message))
+
+    async def _send_one(self, message: dict):
+        async with self._send_lock:
+            try:
+                await self._send(message)
+            except Exception:
+                pass  # the connection is gone; the receive loop closes the session
+
+    async def _score(self, seq: Any, score: Callable[[], Awaitable[dict]]):
+        await asyncio.sleep(self.live.debounce)
+
+        # Per-connection budget: wait for the oldest start to leave the minute
+        now = time.monotonic()
+        while self._starts and now - self._starts[0] >= 60.0:
+            self._starts.popleft()
+        if len(self._starts) >= self.live.max_per_minute:
+            self.live.deferred += 1
+            await asyncio.sleep(60.0 - (now - self._starts[0]))
+            self._starts.popleft()
+        self._starts.append(time.monotonic())
+
+        self._in_model = True
+        try:
+            message = await score()
+        except Exception as e:
+            # Scoring failed (e.g. the scheduler stopped): tell the client rather than go quiet
+            self.live.failed += 1
+            await self.send({"type": "error", "seq": seq, "detail": str(e) or type(e).__name__})
+            return
+        finally:
+            self._in_model = False
+        self.live.scored += 1
+        await self.send({"seq": seq, **message})
+
+    async def _relay(self, messages: Callable[[], AsyncIterator[dict]]):
+        frames = messages()
+        try:
+            async for message in frames:
+                await self.send(message)
+        except Exception as e:
+            self.live.failed += 1
+            await self.send({"type": "error", "detail": str(e) or type(e).__name__})
+        finally:
+            await frames.aclose()
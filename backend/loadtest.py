@@ -0,0 +1,295 @@
+"""
+End-to-End Load Test
+
+Drives a running server at a target request rate and reports throughput
+and latency percentiles per endpoint and per pipeline stage:
+
+    python -m backend.loadtest --rps 20 --duration 60
+    python -m backend.loadtest --url http://127.0.0.1:8000 --rps 50 --mix analyse=1,stream=3,direct=0
+
+Run against the local mock for a network-free, cost-free test:
+
+    python -m backend.mock_openrouter --port 8001 &
+    OPENROUTER_BASE_URL=http://127.0.0.1:8001/api/v1 OPENROUTER_API_KEY=mock \\
+        uvicorn backend.main:app --port 8000 &
+    python -m backend.loadtest --rps 20 --duration 60
+
+Requests arrive open-loop (Poisson arrivals at --rps by default, or evenly
+spaced with --uniform): a slow server doesn't slow the arrivals down, so
+queueing shows up in the latencies instead of hiding in a lower rate. Each
+request picks an endpoint by the --mix weights:
+
+- analyse: POST /analyse with a diagnosis (one latency: the whole pipeline)
+- stream:  POST /analyse/stream, timed per stage: scores (Stage 1 + 2,
+           the scores frame), first token (Stage 3 time-to-first-token)
+           and complete ([DONE])
+- direct:  POST /analyse/direct (Stage 3 only)
+
+By default each request gets a distinct concept variant so the Stage 1 and
+diagnosis caches don't hide the pipeline's cost; --repeat sends the corpus
+as is. Targets open access mode (ENABLE_AUTH=0).
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Optional
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+ENDPOINTS = {
+    "analyse": "/analyse",
+    "stream": "/analyse/stream",
+    "direct": "/analyse/direct",
+}
+
+
+class Results:
+    """Latencies, statuses and diagnosis sources collected during a run."""
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)  # "endpoint stage" -> seconds
+        self.statuses: dict[str, Counter] = defaultdict(Counter)
+        self.sources: dict[str, Counter] = defaultdict(Counter)
+        self.dropped = 0
+
+    def record(self, endpoint: str, stage: str, seconds: float):
+        self.latencies[f"{endpoint} {stage}"].append(seconds)
+
+
+# =============================================================================
+# Requests
+# =============================================================================
+
+async def run_analyse(client: httpx.AsyncClient, concept: str, results: Results):
+    """POST /analyse with a diagnosis."""
+    start = time.perf_counter()
+    response = await client.post(ENDPOINTS["analyse"], json={"concept": concept})
+    results.statuses["analyse"][response.status_code] += 1
+    if response.status_code == 200:
+        results.record("analyse", "complete", time.perf_counter() - start)
+        results.sources["analyse"][response.json().get("diagnosis_source") or "none"] += 1
+
+
+async def run_stream(client: httpx.AsyncClient, concept: str, results: Results):
+    """POST /analyse/stream, timing the scores frame, first token and [DONE]."""
+    start = time.perf_counter()
+    first_token = None
+    failed = False
+
+    async with client.stream("POST", ENDPOINTS["stream"], json={"concept": concept}) as response:
+        if response.status_code != 200:
+            await response.aread()
+            results.statuses["stream"][response.status_code] += 1
+            return
+
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            data = line[6:]
+            if data == "[DONE]":
+                break
+            try:
+                frame = json.loads(data)
+            except json.JSONDecodeError:
+                continue
+
+            if frame.get("type") == "scores":
+                results.record("stream", "scores", time.perf_counter() - start)
+            elif "source" in frame:
+                results.sources["stream"][frame["source"]] += 1
+            elif frame.get("text") and first_token is None:
+                first_token = time.perf_counter() - start
+                results.record("stream", "first token", first_token)
+            elif frame.get("error"):
+                failed = True
+
+    if failed:
+        results.statuses["stream"]["stream error"] += 1
+    else:
+        results.statuses["stream"][200] += 1
+        results.record("stream", "complete", time.perf_counter() - start)
+
+
+async def run_direct(client: httpx.AsyncClient, concept: str, results: Results):
+    """POST /analyse/direct."""
+    start = time.perf_counter()
+    response = await client.post(ENDPOINTS["direct"], json={"concept": concept})
+    results.statuses["direct"][response.status_code] += 1
+    if response.status_code == 200:
+        results.record("direct", "complete", time.perf_counter() - start)
+
+
+RUNNERS = {"analyse": run_analyse, "stream": run_stream, "direct": run_direct}
+
+
+# =============================================================================
+# Load Generator
+# =============================================================================
+
+async def generate_load(
+    url: str,
+    concepts: list[str],
+    rps: float,
+    duration: float,
+    mix: dict[str, float],
+    poisson: bool = True,
+    repeat: bool = False,
+    max_in_flight: int = 1000,
+    timeout: float = 120.0,
+) -> tuple[Results, float]:
+    """Send requests open-loop for duration seconds; return results and wall time."""
+    results = Results()
+    endpoints = [name for name, weight in mix.items() if weight > 0]
+    weights = [mix[name] for name in endpoints]
+    in_flight: set[asyncio.Task] = set()
+
+    async def one(endpoint: str, concept: str):
+        try:
+            await RUNNERS[endpoint](client, concept, results)
+        except httpx.HTTPError as e:
+            results.statuses[endpoint][type(e).__name__] += 1
+
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        next_at = start
+        sent = 0
+
+        while next_at - start < duration:
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+            if len(in_flight) >= max_in_flight:
+                results.dropped += 1
+            else:
+                concept = concepts[sent % len(concepts)]
+                if not repeat:
+                    concept = f"{concept} (Load test variant {sent}.)"
+                endpoint = random.choices(endpoints, weights)[0]
+                task = asyncio.create_task(one(endpoint, concept))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            sent += 1
+
+            next_at += random.expovariate(rps) if poisson else 1.0 / rps
+
+        if in_flight:
+            await asyncio.wait(in_flight)
+        return results, time.perf_counter() - start
+
+
+# =============================================================================
+# Report
+# =============================================================================
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile of a sorted list."""
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def summarise(results: Results, wall_s: float) -> dict:
+    """Throughput and latency percentiles (ms) per endpoint and stage."""
+    stages = {}
+    for name in sorted(results.latencies):
+        values = sorted(results.latencies[name])
+        stages[name] = {
+            "count": len(values),
+            "throughput_rps": round(len(values) / wall_s, 2),
+            **{f"p{p}_ms": round(percentile(values, p) * 1000, 1) for p in (50, 90, 95, 99)},
+            "max_ms": round(values[-1] * 1000, 1),
+        }
+    return {
+        "wall_seconds": round(wall_s, 2),
+        "stages": stages,
+        "statuses": {k: {str(s): n for s, n in v.items()} for k, v in results.statuses.items()},
+        "diagnosis_sources": {k: dict(v) for k, v in results.sources.items()},
+        "dropped": results.dropped,
+    }
+
+
+def print_summary(summary: dict, rps: float):
+    """Print a human-readable load test report."""
+    print("\n" + "=" * 78)
+    print(f"LOAD TEST: target {rps:g} req/s for {summary['wall_seconds']} s")
+    print("=" * 78)
+    print(f"  {'endpoint / stage':<24}{'count':>7}{'req/s':>8}{'p50 ms':>9}{'p90 ms':>9}"
+          f"{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for name, s in summary["stages"].items():
+        print(f"  {name:<24}{s['count']:>7}{s['throughput_rps']:>8}{s['p50_ms']:>9}{s['p90_ms']:>9}"
+              f"{s['p95_ms']:>9}{s['p99_ms']:>9}{s['max_ms']:>9}")
+
+    print("\n  Responses:")
+    for endpoint, statuses in summary["statuses"].items():
+        print(f"    {endpoint:<10}" + ", ".join(f"{s}: {n}" for s, n in sorted(statuses.items())))
+    for endpoint, sources in summary["diagnosis_sources"].items():
+        print(f"    {endpoint:<10}diagnosis source " + ", ".join(f"{s}: {n}" for s, n in sorted(sources.items())))
+    if summary["dropped"]:
+        print(f"\n  Dropped {summary['dropped']} request(s): --max-in-flight reached")
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+def parse_mix(value: str) -> dict[str, float]:
+    """Parse endpoint weights like "analyse=1,stream=2,direct=1"."""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r} (choose from {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("at least one endpoint needs a positive weight")
+    return mix
+
+
+def load_concepts(corpus: Optional[Path]) -> list[str]:
+    """Concepts from a JSONL corpus, or the built-in samples."""
+    from backend.samples import load_corpus, sample_concepts
+    return load_corpus(corpus) if corpus else sample_concepts()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test a running Coherence Diagnostic server")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Server URL (default: http://127.0.0.1:8000)")
+    parser.add_argument("--rps", type=float, default=10.0, help="Target requests per second (default: 10)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to send requests for (default: 30)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("analyse=1,stream=2,direct=1"),
+                        help="Endpoint weights (default: analyse=1,stream=2,direct=1)")
+    parser.add_argument("--uniform", action="store_true", help="Evenly spaced arrivals instead of Poisson")
+    parser.add_argument("--repeat", action="store_true", help="Send corpus concepts unchanged (caches will hit)")
+    parser.add_argument("--corpus", type=Path, help="JSONL file with a \"concept\" field per line")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="Requests open at once before dropping (default: 1000)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds (default: 120)")
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible arrivals and mix")
+    parser.add_argument("--output", type=Path, help="Also write the summary as JSON")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    concepts = load_concepts(args.corpus)
+    print(f"Sending ~{args.rps:g} req/s to {args.url} for {args.duration:g} s "
+          f"({', '.join(f'{k}={v:g}' for k, v in args.mix.items())}, {len(concepts)} concepts)")
+
+    results, wall_s = asyncio.run(generate_load(
+        args.url, concepts, args.rps, args.duration, args.mix,
+        poisson=not args.uniform, repeat=args.repeat,
+        max_in_flight=args.max_in_flight, timeout=args.timeout,
+    ))
+
+    summary = summarise(results, wall_s)
+    print_summary(summary, args.rps)
+
+    if args.output:
+        args.output.write_text(json.dumps(summary, indent=2))
+        print(f"\nSummary written to {args.output}")
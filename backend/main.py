@@ -10,6 +10,21 @@ Architecture: AI handles language. Code handles judgment.
 
 Module Structure:
 - main.py: Core analysis pipeline (this file)
+- batching.py: Micro-batching scheduler and worker pool for Stage 1 inference
+- cache.py: Content-addressed cache for Stage 1 scores
+- engines.py: Pluggable Stage 1 inference engines (torch, ONNX Runtime)
+- quantization.py: INT8 inference mode for Stage 1
+- tuning.py: Autotuned Stage 1 thread counts and batch size
+- singleflight.py: Coalesces identical in-flight Stage 1 and Stage 3 work
+- upstream.py: Retry policy, deadlines and circuit breaker for Stage 3 calls
+- hedging.py: Hedged Stage 3 streams to cut tail time-to-first-token
+- multiplex.py: Interleaves several SSE streams into one (side-by-side mode)
+- accounting.py: Per-call Stage 3 token, cost and latency accounting
+- warmup.py: Opens the Stage 3 connection while Stage 1 runs
+- resumable.py: Buffered SSE streams that resume after a dropped connection
+- coalescing.py: Joins streamed Stage 3 deltas into fewer SSE frames
+- live.py: Debounced live scoring over WebSocket while a concept is typed
+- serialization.py: Fast JSON encoding for responses and SSE frames (orjson if installed)
 - auth.py: Email verification, user management (loaded if ENABLE_AUTH=1)
 - admin.py: Admin panel (loaded if ENABLE_AUTH=1)
 
@@ -18,32 +33,74 @@ Feature toggle via config.py / config.env:
 - ENABLE_AUTH=1: Gated access — email verification + admin panel
 """
 
+import functools
 import json
 import asyncio
+import re
+import time
 import random
 from pathlib import Path
 from contextlib import asynccontextmanager
-from typing import Optional
+from typing import Annotated, Awaitable, Optional
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, FileResponse
-from pydantic import BaseModel, Field
-import torch
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+import httpx
 import openai
 
 import sys
 sys.path.insert(0, str(Path(__file__).parent.parent))
 from config import (
     ENABLE_AUTH,
-    OPENROUTER_API_KEY, MODEL_PATH,
+    OPENROUTER_API_KEY, OPENROUTER_BASE_URL, MODEL_PATH,
+    OPENROUTER_MAX_CONNECTIONS, OPENROUTER_MAX_KEEPALIVE, OPENROUTER_KEEPALIVE_EXPIRY,
+    OPENROUTER_CONNECT_TIMEOUT, OPENROUTER_READ_TIMEOUT, OPENROUTER_POOL_TIMEOUT, STAGE3_WARMUP,
+    STAGE1_MAX_BATCH_SIZE, STAGE1_MAX_WAIT_MS,
+    STAGE1_WORKERS, STAGE1_QUEUE_SIZE, STAGE1_RETRY_AFTER,
+    STAGE1_CACHE_SIZE, STAGE1_CACHE_PERSIST, STAGE1_CACHE_DB_PATH,
+    STAGE1_QUANTIZE, STAGE1_ENGINE, STAGE1_LENGTH_BUCKETS,
+    STAGE1_THREADS, STAGE1_INTEROP_THREADS, STAGE1_USE_PROFILE, STAGE1_PROFILE_PATH,
+    BATCH_MAX_CONCEPTS, BATCH_DIAGNOSIS_CONCURRENCY,
+    DIAGNOSIS_CACHE_SIZE, DIAGNOSIS_CACHE_TTL,
+    STREAM_RESUME_TTL, STREAM_RESUME_MAX, STREAM_HEARTBEAT_INTERVAL,
+    STREAM_COALESCE_MS, STREAM_COALESCE_BYTES, STREAM_CANCEL_GRACE,
+    LIVE_DEBOUNCE_MS, LIVE_MAX_SCORES_PER_MINUTE,
+    STAGE3_MAX_ATTEMPTS, STAGE3_BACKOFF_BASE, STAGE3_BACKOFF_MAX, STAGE3_DEADLINE,
+    STAGE3_BREAKER_FAILURE_RATE, STAGE3_BREAKER_WINDOW, STAGE3_BREAKER_MIN_CALLS, STAGE3_BREAKER_COOLDOWN,
+    STAGE3_FALLBACK, STAGE3_LATENCY_BUDGET,
+    STAGE3_HEDGE, STAGE3_HEDGE_PERCENTILE, STAGE3_HEDGE_MIN_DELAY, STAGE3_HEDGE_MAX_RATE,
+    STAGE3_PROMPT_CACHE,
+    STAGE3_USAGE_DB_PATH, STAGE3_USAGE_FLUSH_INTERVAL,
+    STAGE3_PRICE_INPUT, STAGE3_PRICE_OUTPUT, STAGE3_PRICE_CACHED,
     validate_config, print_config_summary
 )
 
 # Add src directory to path for stage2_rules import
 sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
-from stage2_rules import evaluate_concept, Severity
+from stage2_rules import (
+    compose_diagnosis, evaluate_concept, evaluate_concepts, Severity,
+    evaluate_claim_evidence, evaluate_scope, evaluate_assumptions, evaluate_gaps
+)
+
+from backend.accounting import Stage3Call, UsageLedger
+from backend.batching import MicroBatcher, SchedulerBusy
+from backend.cache import DiagnosisCache, Stage1Cache, model_revision, normalize_concept
+from backend.coalescing import DeltaCoalescer
+from backend.engines import DIMENSION_ORDER, load_engine
+from backend.hedging import Hedger, PrimedStream
+from backend.live import LiveScoring
+from backend.multiplex import Multiplexer
+from backend.resumable import ResumableStreams, StreamNotFound
+from backend.samples import SAMPLE_CONCEPTS, sample_concepts
+from backend.serialization import (
+    DONE_FRAME, JSON_BACKEND, FastJSONResponse, dumps, dumps_text, sse_frame
+)
+from backend.singleflight import SingleFlight
+from backend.tuning import load_profile
+from backend.upstream import CircuitBreaker, CircuitOpen, RetryNotice, Upstream
+from backend.warmup import ConnectionWarmer, DrainingTransport, Warmup
 
 
 # =============================================================================
@@ -74,8 +131,27 @@ Rules:
 - Name what's weak or vague and why, specifically
 - Use the student's own words where possible"""
 
-# Haiku system prompt (from spec.md)
-HAIKU_SYSTEM_PROMPT = """You are a design coherence analyst. A student has submitted
+# OpenRouter model for Stage 3 and direct comparison
+HAIKU_MODEL = "anthropic/claude-haiku-4.5"
+
+
+def rule_status_legend() -> str:
+    """Every non-SOLID Stage 2 rule status with its finding, one per line."""
+    levels = [Severity.SOLID, Severity.WORTH_EXAMINING, Severity.ATTENTION_NEEDED]
+    results = [evaluate_claim_evidence(claim, evidence) for claim in levels for evidence in levels]
+    results += [rule(level) for rule in (evaluate_scope, evaluate_assumptions, evaluate_gaps) for level in levels]
+
+    findings = {}
+    for result in results:
+        if result["severity"] != Severity.SOLID:
+            findings.setdefault(result["status"], result["finding"])
+    return "\n".join(f"- {status}: {finding}" for status, finding in findings.items())
+
+
+# Haiku system prompt (from spec.md). The user message lists only what
+# Stage 2 flagged, as status codes; their meanings are static, so they live
+# here, in the static system prompt.
+HAIKU_SYSTEM_PROMPT = f"""You are a design coherence analyst. A student has submitted
 a design concept. Their concept has been scored on five
 dimensions by a classification model, and the scores have
 been evaluated by deterministic rules.
@@ -101,16 +177,76 @@ Rules:
 - Name what's weak or vague and why, specifically
 - Use the student's own words where possible
 - If asking questions, make them genuine (not rhetorical)
-- Do not contradict the scores or severity levels"""
+- Do not contradict the scores or severity levels
+
+The message lists the concept, then only the dimensions that are not
+SOLID with their severity, then the Stage 2 rule statuses that fired.
+Rule statuses mean:
+{rule_status_legend()}"""
+
+# Bump whenever HAIKU_SYSTEM_PROMPT or build_haiku_prompt changes, so cached
+# diagnoses written for the old prompt are never replayed
+HAIKU_PROMPT_VERSION = "2"
 
 
 # =============================================================================
 # Global State
 # =============================================================================
 
-model = None
-tokenizer = None
+engine = None
 client = None
+stage1_batcher = None
+stage1_cache = None
+stage1_settings = None
+diagnosis_cache = None
+usage_ledger = None
+warmer = None
+
+# Identical concurrent requests share one Stage 1 pass and one Stage 3 call
+stage1_flights = SingleFlight()
+stage3_flights = SingleFlight()
+
+# Retries, deadlines and the circuit breaker for every Stage 3 call
+upstream = Upstream(
+    CircuitBreaker(
+        failure_rate=STAGE3_BREAKER_FAILURE_RATE,
+        window=STAGE3_BREAKER_WINDOW,
+        min_calls=STAGE3_BREAKER_MIN_CALLS,
+        cooldown=STAGE3_BREAKER_COOLDOWN
+    ),
+    max_attempts=STAGE3_MAX_ATTEMPTS,
+    backoff_base=STAGE3_BACKOFF_BASE,
+    backoff_max=STAGE3_BACKOFF_MAX,
+    deadline=STAGE3_DEADLINE
+)
+
+# Hedged streams: a second request when the first token is late
+hedger = Hedger(
+    enabled=STAGE3_HEDGE,
+    percentile=STAGE3_HEDGE_PERCENTILE,
+    min_delay=STAGE3_HEDGE_MIN_DELAY,
+    max_rate=STAGE3_HEDGE_MAX_RATE
+)
+
+# Why local fallback diagnoses were served (exposed on /health)
+stage3_fallbacks = {"over_budget": 0, "breaker_open": 0, "error": 0, "unavailable": 0}
+
+# Buffered /analyse/stream responses, resumable with Last-Event-ID
+resumable_streams = ResumableStreams(
+    ttl=STREAM_RESUME_TTL,
+    heartbeat_interval=STREAM_HEARTBEAT_INTERVAL,
+    max_streams=STREAM_RESUME_MAX,
+    cancel_grace=STREAM_CANCEL_GRACE
+)
+
+# Requests abandoned by their client before streaming started (exposed on /health)
+client_disconnects = {"during_stage1": 0}
+
+# Streamed Stage 3 deltas are sent in time- and size-windowed batches
+delta_coalescer = DeltaCoalescer(window_ms=STREAM_COALESCE_MS, max_bytes=STREAM_COALESCE_BYTES)
+
+# Debounced Stage 1 + 2 scoring over /analyse/live
+live_scoring = LiveScoring(debounce_ms=LIVE_DEBOUNCE_MS, max_per_minute=LIVE_MAX_SCORES_PER_MINUTE)
 
 
 # =============================================================================
@@ -120,7 +256,7 @@ client = None
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Load model on startup, cleanup on shutdown."""
-    global model, tokenizer, client
+    global engine, client, stage1_batcher, stage1_cache, stage1_settings, diagnosis_cache, usage_ledger, warmer
 
     # Validate configuration
     print_config_summary()
@@ -137,23 +273,94 @@ async def lifespan(app: FastAPI):
     if not MODEL_PATH.exists():
         raise RuntimeError(f"Model path does not exist: {MODEL_PATH}")
 
-    # Load model and tokenizer
-    model = AutoModelForSequenceClassification.from_pretrained(str(MODEL_PATH))
-    tokenizer = AutoTokenizer.from_pretrained(str(MODEL_PATH))
+    # Thread counts and batch size: a tuned profile for this machine wins over config
+    stage1_settings = {
+        "source": "config",
+        "threads": STAGE1_THREADS,
+        "interop_threads": STAGE1_INTEROP_THREADS,
+        "max_batch_size": STAGE1_MAX_BATCH_SIZE,
+    }
+    profile = load_profile(STAGE1_PROFILE_PATH, STAGE1_ENGINE, STAGE1_QUANTIZE, STAGE1_WORKERS) if STAGE1_USE_PROFILE else None
+    if profile:
+        stage1_settings.update(profile["settings"], source="profile", tuned_at=profile["created_at"])
+        print(f"Stage 1 profile applied: {profile['settings']}")
+
+    # Load the configured inference engine (torch or onnx)
+    revision = model_revision(MODEL_PATH)
+    engine = load_engine(
+        STAGE1_ENGINE,
+        MODEL_PATH,
+        quantize=STAGE1_QUANTIZE,
+        revision=revision,
+        length_buckets=STAGE1_LENGTH_BUCKETS,
+        threads=stage1_settings["threads"],
+        interop_threads=stage1_settings["interop_threads"]
+    )
 
-    # Set model to eval mode
-    model.eval()
+    # Score cache, keyed to this exact checkpoint, engine and precision
+    stage1_cache = Stage1Cache(
+        revision=f"{revision}-{engine.name}-{engine.precision}",
+        max_entries=STAGE1_CACHE_SIZE,
+        db_path=STAGE1_CACHE_DB_PATH if STAGE1_CACHE_PERSIST else None
+    )
+    print(f"Stage 1 cache ready (model revision {stage1_cache.revision})")
+
+    # Start Stage 1 micro-batching scheduler
+    stage1_batcher = MicroBatcher(
+        run_stage1_batch,
+        max_batch_size=stage1_settings["max_batch_size"],
+        max_wait_ms=STAGE1_MAX_WAIT_MS,
+        workers=STAGE1_WORKERS,
+        max_queue_size=STAGE1_QUEUE_SIZE
+    )
+    await stage1_batcher.start()
+
+    # Stage 3 cache, keyed to this prompt version and model
+    diagnosis_cache = DiagnosisCache(
+        prompt_version=HAIKU_PROMPT_VERSION,
+        model=HAIKU_MODEL,
+        max_entries=DIAGNOSIS_CACHE_SIZE,
+        ttl_seconds=DIAGNOSIS_CACHE_TTL
+    )
 
-    # Use GPU if available
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model.to(device)
-    print(f"Model loaded on {device}")
+    # Stage 3 usage accounting, flushed to SQLite in the background
+    usage_ledger = UsageLedger(
+        STAGE3_USAGE_DB_PATH,
+        price_input=STAGE3_PRICE_INPUT,
+        price_output=STAGE3_PRICE_OUTPUT,
+        price_cached=STAGE3_PRICE_CACHED,
+        flush_interval=STAGE3_USAGE_FLUSH_INTERVAL
+    )
+    usage_ledger.start_flusher()
 
-    # Initialise OpenRouter client
+    # Initialise OpenRouter client (async, one shared keep-alive pool)
     if OPENROUTER_API_KEY:
-        client = openai.OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=OPENROUTER_API_KEY
+        transport = DrainingTransport(
+            limits=httpx.Limits(
+                max_connections=OPENROUTER_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENROUTER_MAX_KEEPALIVE,
+                keepalive_expiry=OPENROUTER_KEEPALIVE_EXPIRY
+            )
+        )
+        http_client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(
+                OPENROUTER_READ_TIMEOUT,
+                connect=OPENROUTER_CONNECT_TIMEOUT,
+                pool=OPENROUTER_POOL_TIMEOUT
+            )
+        )
+        client = openai.AsyncOpenAI(
+            base_url=OPENROUTER_BASE_URL,
+            api_key=OPENROUTER_API_KEY,
+            max_retries=0,  # retries are handled by upstream, not the SDK
+            http_client=http_client
+        )
+        warmer = ConnectionWarmer(
+            http_client,
+            transport,
+            f"{OPENROUTER_BASE_URL.rstrip('/')}/models",
+            enabled=STAGE3_WARMUP
         )
         print("OpenRouter client initialised")
     else:
@@ -163,6 +370,13 @@ async def lifespan(app: FastAPI):
 
     # Cleanup
     print("Shutting down...")
+    await stage1_batcher.stop()
+    await resumable_streams.close()
+    await usage_ledger.close()
+    if warmer:
+        await warmer.close()
+    if client:
+        await client.close()
 
 
 # =============================================================================
@@ -173,7 +387,8 @@ app = FastAPI(
     title="Coherence Diagnostic",
     description="Design concept coherence analysis using Koher architecture",
     version="2.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # CORS for frontend
@@ -219,6 +434,19 @@ class AnalyseResponse(BaseModel):
     scores: list[ScoreResponse]
     evaluation: dict
     diagnosis: Optional[str] = None
+    diagnosis_source: Optional[str] = Field(None, description="llm, cache or fallback")
+    remaining_analyses: Optional[int] = None
+
+
+class BatchAnalyseRequest(BaseModel):
+    concepts: list[Annotated[str, Field(min_length=10, max_length=2000)]] = Field(
+        ..., min_length=1, max_length=BATCH_MAX_CONCEPTS, description="Design concepts to analyse"
+    )
+    include_diagnosis: bool = Field(False, description="Whether to include a Haiku diagnosis per concept")
+
+
+class BatchAnalyseResponse(BaseModel):
+    results: list[AnalyseResponse]
     remaining_analyses: Optional[int] = None
 
 
@@ -229,7 +457,7 @@ class DirectAIRequest(BaseModel):
 class DirectAIResponse(BaseModel):
     concept: str
     response: str
-    model: str = "anthropic/claude-haiku-4.5"
+    model: str = HAIKU_MODEL
     remaining_analyses: Optional[int] = None
 
 
@@ -261,51 +489,125 @@ def require_auth_if_enabled(request: Request) -> Optional[dict]:
     return require_auth(request)
 
 
-def increment_usage_if_enabled(user: Optional[dict]) -> Optional[int]:
+def increment_usage_if_enabled(user: Optional[dict], count: int = 1) -> Optional[int]:
     """
-    Increment usage count if auth is enabled.
+    Increment usage count by count analyses if auth is enabled.
     Returns remaining count or None if auth disabled.
     """
     if not ENABLE_AUTH or user is None:
         return None
 
     from backend.auth import increment_usage
-    return increment_usage(user["email"])
+    return increment_usage(user["email"], count)
 
 
 # =============================================================================
 # Stage 1: DeBERTa Inference
 # =============================================================================
 
-DIMENSION_ORDER = ["CLAIM", "EVIDENCE", "SCOPE", "ASSUMPTIONS", "GAPS"]
+def run_stage1_batch(concepts: list[str]) -> list[dict[str, float]]:
+    """
+    Run DeBERTa inference on several concepts, one padded forward pass
+    per length bucket. Returns confidence scores (0.0-1.0) for each dimension, one dict per
+    concept, in input order.
+    """
+    return engine.predict(concepts)
 
 
-def run_stage1(concept: str) -> dict[str, float]:
+async def score_concept(concept: str) -> dict[str, float]:
     """
-    Run DeBERTa inference on concept text.
-    Returns confidence scores (0.0-1.0) for each dimension.
+    Run Stage 1 through the micro-batching scheduler.
+    Concurrent callers share a forward pass; each gets its own scores.
+    Cache hits return immediately without queueing, and concurrent
+    requests for the same (normalised) concept share one queued item.
+    Raises 503 with Retry-After when the inference queue is full.
     """
-    global model, tokenizer
+    cached = await stage1_cache.get(concept)
+    if cached is not None:
+        return cached
+
+    async def compute():
+        scores = await stage1_batcher.submit(concept)
+        await stage1_cache.put(concept, scores)
+        return scores
 
-    device = next(model.parameters()).device
+    try:
+        scores = await stage1_flights.do(stage1_cache.key(concept), compute)
+    except SchedulerBusy:
+        raise stage1_busy_error()
 
-    # Tokenise
-    inputs = tokenizer(
-        concept,
-        return_tensors="pt",
-        truncation=True,
-        max_length=512,
-        padding=True
+    return dict(scores)
+
+
+async def score_concepts(concepts: list[str]) -> list[dict[str, float]]:
+    """
+    Run Stage 1 for many concepts at once (e.g. a whole cohort).
+    Cached and duplicate concepts are scored once; the rest go to the
+    worker pool as ready-made batches. Returns scores in input order.
+    """
+    unique = list(dict.fromkeys(concepts))
+    cached = await asyncio.gather(*(stage1_cache.get(concept) for concept in unique))
+    scores: dict[str, dict[str, float]] = {
+        concept: hit for concept, hit in zip(unique, cached) if hit is not None
+    }
+
+    misses = [concept for concept in unique if concept not in scores]
+    if misses:
+        try:
+            computed = await stage1_batcher.submit_many(misses)
+        except SchedulerBusy:
+            raise stage1_busy_error()
+
+        await asyncio.gather(*(
+            stage1_cache.put(concept, concept_scores) for concept, concept_scores in zip(misses, computed)
+        ))
+        scores.update(zip(misses, computed))
+
+    return [dict(scores[concept]) for concept in concepts]
+
+
+def stage1_busy_error() -> HTTPException:
+    """503 telling the client when to retry a request rejected by Stage 1 backpressure."""
+    return HTTPException(
+        status_code=503,
+        detail="Server is busy. Please try again shortly.",
+        headers={"Retry-After": str(STAGE1_RETRY_AFTER)}
     )
-    inputs = {k: v.to(device) for k, v in inputs.items()}
 
-    # Inference
-    with torch.no_grad():
-        outputs = model(**inputs)
-        confidence = torch.sigmoid(outputs.logits).cpu().numpy()[0]
 
-    # Map to dimension names
-    return {dim: float(conf) for dim, conf in zip(DIMENSION_ORDER, confidence)}
+def begin_warmup() -> Optional[Warmup]:
+    """Warm the Stage 3 connection while Stage 1 runs (None when Stage 3 is unavailable)."""
+    return warmer.begin() if warmer else None
+
+
+async def wait_for_disconnect(req: Request):
+    """Return once the client has closed the connection (the request body is already read)."""
+    while True:
+        message = await req.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def unless_disconnected(req: Request, work: Awaitable):
+    """
+    Await work, cancelling it if the client disconnects first (e.g. the tab
+    is closed while Stage 1 is queued). Its Stage 1 item is then dropped
+    unless another request shares it. Raises 499, which nobody reads.
+    """
+    task = asyncio.ensure_future(work)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(req))
+    try:
+        await asyncio.wait({task, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnected.cancel()
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            client_disconnects["during_stage1"] += 1
+
+    if task.cancelled():
+        raise HTTPException(status_code=499, detail="Client closed the connection")
+    return task.result()
 
 
 # =============================================================================
@@ -313,7 +615,31 @@ def run_stage1(concept: str) -> dict[str, float]:
 # =============================================================================
 
 def build_haiku_prompt(concept: str, evaluation: dict) -> str:
-    """Build the user prompt for Haiku."""
+    """
+    Build the compact user prompt for Haiku: the concept, the non-SOLID
+    dimensions and the rule statuses that fired (explained in the system prompt).
+    """
+    flagged = [
+        f"{dim}: {sev}"
+        for dim, sev in evaluation["severity_levels"].items()
+        if sev != Severity.SOLID
+    ]
+    statuses = [
+        evaluation[rule]["status"]
+        for rule in ("claim_evidence", "scope", "assumptions", "gaps")
+        if evaluation[rule]["severity"] != Severity.SOLID
+    ]
+
+    return f"""Concept: {concept}
+
+Flagged:
+{chr(10).join(flagged) or "none"}
+
+Rules: {", ".join(statuses) or "none"}"""
+
+
+def build_verbose_haiku_prompt(concept: str, evaluation: dict) -> str:
+    """The previous prompt format (full Stage 2 JSON), kept to estimate the compact one's savings offline."""
     severity = evaluation["severity_levels"]
 
     severity_text = "\n".join([
@@ -338,120 +664,489 @@ Stage 2 evaluation:
 {stage2_json}"""
 
 
-MAX_RETRIES = 3
-RETRY_DELAY = 2
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English text)."""
+    return (len(text) + 3) // 4
 
 
-async def stream_diagnosis(concept: str, evaluation: dict):
-    """Stream diagnosis from Haiku via OpenRouter with retry logic."""
+# Shortest prompt prefix claude-haiku-4.5 will cache. HAIKU_SYSTEM_PROMPT is
+# well below it, so cache_control is sent but has no effect until the
+# static prefix grows past this
+PROMPT_CACHE_MIN_TOKENS = 4096
+
+
+def system_message(prompt: str) -> dict:
+    """
+    System message, marked for provider-side prompt caching when enabled.
+    Providers only cache prompts above a model-specific minimum length
+    (PROMPT_CACHE_MIN_TOKENS for Haiku); shorter ones are sent uncached.
+    """
+    if not STAGE3_PROMPT_CACHE:
+        return {"role": "system", "content": prompt}
+    return {
+        "role": "system",
+        "content": [{"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}}]
+    }
+
+
+# Usage ledger call kinds that send the Haiku diagnosis prompt
+DIAGNOSIS_KINDS = ("diagnosis", "diagnosis_stream")
+
+# Stage 1 confidence patterns (strong, weak, mixed) for the offline baseline
+BASELINE_SCORES = [
+    {"CLAIM": 0.95, "EVIDENCE": 0.90, "SCOPE": 0.88, "ASSUMPTIONS": 0.85, "GAPS": 0.10},
+    {"CLAIM": 0.25, "EVIDENCE": 0.30, "SCOPE": 0.20, "ASSUMPTIONS": 0.15, "GAPS": 0.70},
+    {"CLAIM": 0.65, "EVIDENCE": 0.45, "SCOPE": 0.90, "ASSUMPTIONS": 0.55, "GAPS": 0.35},
+]
+
+
+@functools.cache
+def prompt_baseline() -> dict:
+    """
+    Estimated user-prompt tokens of the compact and verbose formats, averaged
+    over the sample concepts and BASELINE_SCORES. Computed once, not per call.
+    """
+    pairs = [
+        (build_haiku_prompt(concept, evaluation), build_verbose_haiku_prompt(concept, evaluation))
+        for concept in sample_concepts()
+        for evaluation in map(evaluate_concept, BASELINE_SCORES)
+    ]
+    return {
+        "compact_user_tokens_estimated": round(sum(estimate_tokens(c) for c, _ in pairs) / len(pairs), 1),
+        "verbose_user_tokens_estimated": round(sum(estimate_tokens(v) for _, v in pairs) / len(pairs), 1),
+    }
+
+
+def prompt_report() -> dict:
+    """
+    Prompt sizes for monitoring. Tokens sent are the provider's own counts
+    from the usage ledger; the verbose format is never built per call, so
+    savings compare them with the offline baseline's size difference.
+    """
+    kinds = usage_ledger.stats()["kinds"] if usage_ledger else {}
+    diagnoses = [kinds[kind] for kind in DIAGNOSIS_KINDS if kind in kinds]
+    calls = sum(d["calls"] - d["errors"] - d["cancelled"] for d in diagnoses)
+    prompt_tokens = sum(d["prompt_tokens"] for d in diagnoses)
+
+    system_tokens = estimate_tokens(HAIKU_SYSTEM_PROMPT)
+    baseline = prompt_baseline()
+    verbose_extra = baseline["verbose_user_tokens_estimated"] - baseline["compact_user_tokens_estimated"]
+    mean_prompt_tokens = prompt_tokens / calls if calls else None
+
+    return {
+        "format": "compact",
+        "cache_control": STAGE3_PROMPT_CACHE,
+        "system_tokens_estimated": system_tokens,
+        "cache_min_tokens": PROMPT_CACHE_MIN_TOKENS,
+        # The system prompt is too short for the provider to cache
+        "cacheable": system_tokens >= PROMPT_CACHE_MIN_TOKENS,
+        "calls": calls,
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": sum(d["cached_tokens"] for d in diagnoses),
+        "mean_prompt_tokens": round(mean_prompt_tokens, 1) if calls else None,
+        **baseline,
+        "prompt_tokens_saved_estimated": (
+            round(verbose_extra / (mean_prompt_tokens + verbose_extra), 3) if calls else None
+        ),
+    }
+
+
+def account_of(user: Optional[dict]) -> Optional[str]:
+    """Who Stage 3 usage is attributed to (None: anonymous, in open access mode)."""
+    return user["email"] if user else None
+
+
+def record_failed_call(call: Stage3Call, error: Exception):
+    """Record a Stage 3 call that failed, unless the breaker stopped it before anything was sent."""
+    if isinstance(error, CircuitOpen) and not call.retries:
+        return
+    usage_ledger.finish(call, error=True)
+
+
+def replay_diagnosis(diagnosis: str):
+    """SSE frames for a cached diagnosis, a line at a time, as stream_diagnosis sends them."""
+    for piece in re.split(r"(?<=\n)", diagnosis):
+        if piece:
+            yield sse_frame({'text': piece})
+    yield DONE_FRAME
+
+
+# Shown instead of a diagnosis while the circuit breaker is open
+STAGE3_UNAVAILABLE = "Diagnosis temporarily unavailable, please try again shortly."
+
+# Error frames that never change, encoded once (the breaker one is sent to
+# every request while Stage 3 is down)
+STAGE3_UNAVAILABLE_FRAME = sse_frame({"error": STAGE3_UNAVAILABLE})
+DIRECT_AI_UNAVAILABLE_FRAME = sse_frame({"error": "Direct AI unavailable - API key not configured"})
+
+
+def use_fallback(error: Optional[Exception]) -> bool:
+    """
+    Whether to serve the local Stage 2 diagnosis instead of failing.
+    error is why Haiku didn't answer (None: no client configured).
+    """
+    if not STAGE3_FALLBACK:
+        return False
+
+    if error is None:
+        stage3_fallbacks["unavailable"] += 1
+    elif isinstance(error, CircuitOpen):
+        stage3_fallbacks["breaker_open"] += 1
+    elif isinstance(error, asyncio.TimeoutError):
+        stage3_fallbacks["over_budget"] += 1
+    else:
+        stage3_fallbacks["error"] += 1
+    return True
+
+
+def source_frame(source: str, **metrics) -> str:
+    """SSE frame telling the client where the diagnosis comes from."""
+    return sse_frame({'source': source, **metrics})
+
+
+def sse_response(frames) -> StreamingResponse:
+    """Stream SSE frames to the client."""
+    return StreamingResponse(
+        frames,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        }
+    )
+
+
+def diagnosis_message(frame: str) -> dict:
+    """A stream_diagnosis SSE frame as a /analyse/live WebSocket message."""
+    payload = frame.removeprefix("data: ").strip()
+    if payload == "[DONE]":
+        return {"type": "diagnosis_done"}
+    try:
+        return {"type": "diagnosis", **json.loads(payload)}
+    except ValueError:
+        return {"type": "diagnosis", "error": payload}
+
+
+def fallback_frames(concept: str, evaluation: dict):
+    """SSE frames for a locally composed diagnosis."""
+    yield source_frame("fallback")
+    yield sse_frame({'text': compose_diagnosis(concept, evaluation)})
+    yield DONE_FRAME
+
+
+async def stream_diagnosis(concept: str, evaluation: dict, user: Optional[str] = None):
+    """
+    Stream diagnosis as SSE frames. Concurrent requests for the same concept
+    and severity pattern subscribe to one shared upstream stream (whose usage
+    is attributed to the user who started it).
+    """
+    key = diagnosis_cache.key(concept, evaluation["severity_levels"])
+    async for frame in stage3_flights.stream(key, lambda: stream_diagnosis_upstream(concept, evaluation, user)):
+        yield frame
+
+
+async def stream_diagnosis_upstream(concept: str, evaluation: dict, user: Optional[str] = None):
+    """
+    Stream diagnosis from Haiku via OpenRouter under the shared retry policy.
+    If the first token doesn't arrive within STAGE3_LATENCY_BUDGET (retries
+    included), or Haiku is unavailable, the local diagnosis is streamed instead.
+    """
     global client
 
     if not client:
+        if use_fallback(None):
+            for frame in fallback_frames(concept, evaluation):
+                yield frame
+            return
         yield "data: [Diagnosis unavailable - API key not configured]\n\n"
         return
 
+    severity = evaluation["severity_levels"]
+    cached = diagnosis_cache.get(concept, severity)
+    if cached is not None:
+        yield source_frame("cache")
+        for frame in replay_diagnosis(cached):
+            yield frame
+        return
+
     user_prompt = build_haiku_prompt(concept, evaluation)
 
-    for attempt in range(MAX_RETRIES):
-        try:
-            stream = client.chat.completions.create(
-                model="anthropic/claude-haiku-4.5",
-                max_tokens=500,
-                messages=[
-                    {"role": "system", "content": HAIKU_SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt}
-                ],
-                stream=True
-            )
-            for chunk in stream:
-                if chunk.choices and chunk.choices[0].delta.content:
-                    yield f"data: {json.dumps({'text': chunk.choices[0].delta.content})}\n\n"
+    def open_stream():
+        return PrimedStream.open(lambda: client.chat.completions.create(
+            model=HAIKU_MODEL,
+            max_tokens=500,
+            messages=[
+                system_message(HAIKU_SYSTEM_PROMPT),
+                {"role": "user", "content": user_prompt}
+            ],
+            stream=True,
+            stream_options={"include_usage": True}
+        ))
+
+    # Time left before falling back; None waits as long as upstream allows
+    budget_ends = time.monotonic() + STAGE3_LATENCY_BUDGET if STAGE3_FALLBACK else None
+
+    def budget_left() -> Optional[float]:
+        return None if budget_ends is None else max(0.0, budget_ends - time.monotonic())
+
+    # Each attempt opens the stream and reads up to the first token,
+    # hedged with a second request if that takes unusually long
+    call = usage_ledger.start("diagnosis_stream", HAIKU_MODEL, user, max_tokens=500)
+    stream = None
+    attempts = upstream.attempts(lambda: hedger.race(open_stream))
+    try:
+        while stream is None:
+            outcome = await asyncio.wait_for(attempts.__anext__(), budget_left())
+            if isinstance(outcome, RetryNotice):
+                call.retried()
+                yield sse_frame({'info': f'API busy, retrying ({outcome.attempt}/{outcome.max_attempts})...'})
+            else:
+                stream = outcome
+    except asyncio.CancelledError:
+        await attempts.aclose()
+        usage_ledger.finish(call, cancelled=True)
+        raise
+    except Exception as e:
+        await attempts.aclose()
+        record_failed_call(call, e)
+        if use_fallback(e):
+            for frame in fallback_frames(concept, evaluation):
+                yield frame
+        else:
+            yield STAGE3_UNAVAILABLE_FRAME if isinstance(e, CircuitOpen) else sse_frame({'error': str(e)})
+        return
 
-            yield "data: [DONE]\n\n"
-            return
+    call.hedged = stream.hedged
+    parts = []
+    completed = cancelled = False
+
+    async def deltas():
+        async for chunk in stream:
+            if chunk.usage:
+                call.add_usage(chunk.usage)
+            if chunk.choices and chunk.choices[0].finish_reason:
+                call.finish_reason = chunk.choices[0].finish_reason
+            if chunk.choices and chunk.choices[0].delta.content:
+                call.first_token()
+                parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+
+    # Closing the stream returns the connection to the pool, even
+    # if the client disconnects mid-diagnosis
+    try:
+        async with stream:
+            texts = delta_coalescer.coalesce(deltas())
+            try:
+                sent_source = False
+                async for text in texts:
+                    if not sent_source:
+                        sent_source = True
+                        yield source_frame("llm", hedged=stream.hedged, hedge_won=stream.hedge_won)
+                    yield sse_frame({'text': text})
+            finally:
+                await texts.aclose()
+        completed = True
+    except (asyncio.CancelledError, GeneratorExit):
+        # Every client waiting for this stream went away
+        cancelled = True
+        raise
+    except Exception as e:
+        upstream.record_stream_error(e)
+        yield sse_frame({'error': str(e)})
+        return
+    finally:
+        usage_ledger.finish(call, error=not (completed or cancelled), cancelled=cancelled)
 
-        except openai.APIStatusError as e:
-            if e.status_code == 529 or "overloaded" in str(e).lower():
-                if attempt < MAX_RETRIES - 1:
-                    yield f"data: {json.dumps({'info': f'API busy, retrying ({attempt + 1}/{MAX_RETRIES})...'})}\n\n"
-                    await asyncio.sleep(RETRY_DELAY * (attempt + 1))
-                    continue
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
-            return
+    if parts:
+        diagnosis_cache.put(concept, severity, "".join(parts))
+    yield DONE_FRAME
 
-        except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
-            return
+
+async def get_full_diagnosis(concept: str, evaluation: dict, user: Optional[str] = None) -> tuple[str, Optional[str]]:
+    """
+    Get complete diagnosis and its source (llm, cache or fallback), sharing
+    one upstream call among identical concurrent requests.
+    """
+    key = diagnosis_cache.key(concept, evaluation["severity_levels"])
+    return await stage3_flights.do(f"full:{key}", lambda: fetch_full_diagnosis(concept, evaluation, user))
 
 
-async def get_full_diagnosis(concept: str, evaluation: dict) -> str:
-    """Get complete diagnosis (non-streaming) via OpenRouter with retry logic."""
+async def fetch_full_diagnosis(concept: str, evaluation: dict, user: Optional[str] = None) -> tuple[str, Optional[str]]:
+    """
+    Get complete diagnosis (non-streaming) via OpenRouter under the shared
+    retry policy, falling back to the local diagnosis if Haiku misses
+    STAGE3_LATENCY_BUDGET or is unavailable.
+    """
     global client
 
     if not client:
-        return "[Diagnosis unavailable - API key not configured]"
+        if use_fallback(None):
+            return compose_diagnosis(concept, evaluation), "fallback"
+        return "[Diagnosis unavailable - API key not configured]", None
+
+    severity = evaluation["severity_levels"]
+    cached = diagnosis_cache.get(concept, severity)
+    if cached is not None:
+        return cached, "cache"
 
     user_prompt = build_haiku_prompt(concept, evaluation)
 
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = client.chat.completions.create(
-                model="anthropic/claude-haiku-4.5",
+    call = usage_ledger.start("diagnosis", HAIKU_MODEL, user, max_tokens=500)
+    try:
+        response = await asyncio.wait_for(
+            upstream.call(lambda: client.chat.completions.create(
+                model=HAIKU_MODEL,
                 max_tokens=500,
                 messages=[
-                    {"role": "system", "content": HAIKU_SYSTEM_PROMPT},
+                    system_message(HAIKU_SYSTEM_PROMPT),
                     {"role": "user", "content": user_prompt}
                 ]
-            )
-            return response.choices[0].message.content
-
-        except openai.APIStatusError as e:
-            if e.status_code == 529 or "overloaded" in str(e).lower():
-                if attempt < MAX_RETRIES - 1:
-                    await asyncio.sleep(RETRY_DELAY * (attempt + 1))
-                    continue
-            return f"[Error: {str(e)}]"
-
-        except Exception as e:
-            return f"[Error: {str(e)}]"
-
-    return "[Error: Max retries exceeded]"
+            ), on_retry=call.retried),
+            STAGE3_LATENCY_BUDGET if STAGE3_FALLBACK else None
+        )
+    except asyncio.CancelledError:
+        usage_ledger.finish(call, cancelled=True)
+        raise
+    except Exception as e:
+        record_failed_call(call, e)
+        if use_fallback(e):
+            return compose_diagnosis(concept, evaluation), "fallback"
+        if isinstance(e, CircuitOpen):
+            return f"[{STAGE3_UNAVAILABLE}]", None
+        return f"[Error: {str(e)}]", None
+
+    call.add_usage(response.usage)
+    call.finish_reason = response.choices[0].finish_reason
+    usage_ledger.finish(call)
+    diagnosis = response.choices[0].message.content
+    if diagnosis:
+        diagnosis_cache.put(concept, severity, diagnosis)
+    return diagnosis, "llm"
 
 
 # =============================================================================
 # Direct AI (for comparison)
 # =============================================================================
 
-async def get_direct_ai_response(concept: str) -> str:
+async def get_direct_ai_response(concept: str, user: Optional[str] = None) -> str:
+    """Get direct AI analysis, sharing one upstream call among identical concurrent requests."""
+    return await stage3_flights.do(f"direct:{normalize_concept(concept)}", lambda: fetch_direct_ai_response(concept, user))
+
+
+async def fetch_direct_ai_response(concept: str, user: Optional[str] = None) -> str:
     """Get direct AI analysis without 3-stage pipeline."""
     global client
 
     if not client:
         return "[Direct AI unavailable - API key not configured]"
 
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = client.chat.completions.create(
-                model="anthropic/claude-haiku-4.5",
-                max_tokens=800,
-                messages=[
-                    {"role": "system", "content": DIRECT_AI_SYSTEM_PROMPT},
-                    {"role": "user", "content": f"Design concept:\n\n{concept}"}
-                ]
-            )
-            return response.choices[0].message.content
+    call = usage_ledger.start("direct", HAIKU_MODEL, user, max_tokens=800)
+    try:
+        response = await upstream.call(lambda: client.chat.completions.create(
+            model=HAIKU_MODEL,
+            max_tokens=800,
+            messages=[
+                system_message(DIRECT_AI_SYSTEM_PROMPT),
+                {"role": "user", "content": f"Design concept:\n\n{concept}"}
+            ]
+        ), on_retry=call.retried)
+    except asyncio.CancelledError:
+        usage_ledger.finish(call, cancelled=True)
+        raise
+    except CircuitOpen as e:
+        record_failed_call(call, e)
+        return f"[{STAGE3_UNAVAILABLE}]"
+    except Exception as e:
+        record_failed_call(call, e)
+        return f"[Error: {str(e)}]"
+
+    call.add_usage(response.usage)
+    call.finish_reason = response.choices[0].finish_reason
+    usage_ledger.finish(call)
+    return response.choices[0].message.content
+
+
+async def stream_direct_ai(concept: str, user: Optional[str] = None):
+    """
+    Stream direct AI analysis as SSE frames. Concurrent requests for the
+    same concept subscribe to one shared upstream stream.
+    """
+    key = f"direct:{normalize_concept(concept)}"
+    async for frame in stage3_flights.stream(key, lambda: stream_direct_ai_upstream(concept, user)):
+        yield frame
 
-        except openai.APIStatusError as e:
-            if e.status_code == 529 or "overloaded" in str(e).lower():
-                if attempt < MAX_RETRIES - 1:
-                    await asyncio.sleep(RETRY_DELAY * (attempt + 1))
-                    continue
-            return f"[Error: {str(e)}]"
 
-        except Exception as e:
-            return f"[Error: {str(e)}]"
+async def stream_direct_ai_upstream(concept: str, user: Optional[str] = None):
+    """Stream direct AI analysis from OpenRouter under the shared retry policy."""
+    global client
 
-    return "[Error: Max retries exceeded]"
+    if not client:
+        yield DIRECT_AI_UNAVAILABLE_FRAME
+        return
+
+    def open_stream():
+        return PrimedStream.open(lambda: client.chat.completions.create(
+            model=HAIKU_MODEL,
+            max_tokens=800,
+            messages=[
+                system_message(DIRECT_AI_SYSTEM_PROMPT),
+                {"role": "user", "content": f"Design concept:\n\n{concept}"}
+            ],
+            stream=True,
+            stream_options={"include_usage": True}
+        ))
+
+    call = usage_ledger.start("direct_stream", HAIKU_MODEL, user, max_tokens=800)
+    stream = None
+    try:
+        async for outcome in upstream.attempts(lambda: hedger.race(open_stream)):
+            if isinstance(outcome, RetryNotice):
+                call.retried()
+                yield sse_frame({'info': f'API busy, retrying ({outcome.attempt}/{outcome.max_attempts})...'})
+            else:
+                stream = outcome
+    except asyncio.CancelledError:
+        usage_ledger.finish(call, cancelled=True)
+        raise
+    except Exception as e:
+        record_failed_call(call, e)
+        yield STAGE3_UNAVAILABLE_FRAME if isinstance(e, CircuitOpen) else sse_frame({'error': str(e)})
+        return
+
+    call.hedged = stream.hedged
+    completed = cancelled = False
+
+    async def deltas():
+        async for chunk in stream:
+            if chunk.usage:
+                call.add_usage(chunk.usage)
+            if chunk.choices and chunk.choices[0].finish_reason:
+                call.finish_reason = chunk.choices[0].finish_reason
+            if chunk.choices and chunk.choices[0].delta.content:
+                call.first_token()
+                yield chunk.choices[0].delta.content
+
+    try:
+        async with stream:
+            texts = delta_coalescer.coalesce(deltas())
+            try:
+                async for text in texts:
+                    yield sse_frame({'text': text})
+            finally:
+                await texts.aclose()
+        completed = True
+    except (asyncio.CancelledError, GeneratorExit):
+        # Every client waiting for this stream went away
+        cancelled = True
+        raise
+    except Exception as e:
+        upstream.record_stream_error(e)
+        yield sse_frame({'error': str(e)})
+        return
+    finally:
+        usage_ledger.finish(call, error=not (completed or cancelled), cancelled=cancelled)
+
+    yield DONE_FRAME
 
 
 # =============================================================================
@@ -519,8 +1214,28 @@ async def health_check():
     """Health check endpoint."""
     return {
         "status": "healthy",
-        "model_loaded": model is not None,
+        "model_loaded": engine is not None,
+        "stage1_engine": engine.stats() if engine else None,
+        "stage1_settings": stage1_settings,
+        "stage1_batching": stage1_batcher.stats() if stage1_batcher else None,
+        "stage1_cache": stage1_cache.stats() if stage1_cache else None,
+        "diagnosis_cache": diagnosis_cache.stats() if diagnosis_cache else None,
+        "single_flight": {
+            "stage1": stage1_flights.stats(),
+            "stage3": stage3_flights.stats(),
+        },
         "haiku_available": client is not None,
+        "stage3_upstream": upstream.stats(),
+        "stage3_hedging": hedger.stats(),
+        "stage3_prompt": prompt_report(),
+        "stage3_usage": usage_ledger.stats() if usage_ledger else None,
+        "stage3_warmup": warmer.stats() if warmer else None,
+        "resumable_streams": resumable_streams.stats(),
+        "client_disconnects": client_disconnects,
+        "stream_coalescing": delta_coalescer.stats(),
+        "live_scoring": live_scoring.stats(),
+        "json_backend": JSON_BACKEND,
+        "stage3_fallback": {"enabled": STAGE3_FALLBACK, "latency_budget_seconds": STAGE3_LATENCY_BUDGET, **stage3_fallbacks},
         "auth_enabled": ENABLE_AUTH,
         "admin_enabled": ENABLE_AUTH
     }
@@ -540,8 +1255,14 @@ async def analyse_concept(request: AnalyseRequest, req: Request):
             detail="Analysis limit reached. You have used all your analyses."
         )
 
-    # Stage 1: DeBERTa inference
-    confidence_scores = run_stage1(request.concept)
+    # Stage 1: DeBERTa inference (batched with concurrent requests),
+    # warming the Stage 3 connection meanwhile
+    warmup = begin_warmup() if request.include_diagnosis else None
+    try:
+        confidence_scores = await score_concept(request.concept)
+    finally:
+        if warmup:
+            warmup.finish()
 
     # Stage 2: Deterministic rules
     evaluation = evaluate_concept(confidence_scores)
@@ -553,9 +1274,9 @@ async def analyse_concept(request: AnalyseRequest, req: Request):
     ]
 
     # Stage 3: Haiku diagnosis (optional)
-    diagnosis = None
+    diagnosis, diagnosis_source = None, None
     if request.include_diagnosis:
-        diagnosis = await get_full_diagnosis(request.concept, evaluation)
+        diagnosis, diagnosis_source = await get_full_diagnosis(request.concept, evaluation, account_of(user))
 
     # Increment usage if auth enabled
     remaining = increment_usage_if_enabled(user)
@@ -565,6 +1286,7 @@ async def analyse_concept(request: AnalyseRequest, req: Request):
         scores=scores,
         evaluation=evaluation,
         diagnosis=diagnosis,
+        diagnosis_source=diagnosis_source,
         remaining_analyses=remaining
     )
 
@@ -574,8 +1296,20 @@ async def analyse_concept_stream(request: AnalyseRequest, req: Request):
     """
     Analyse a design concept with streaming diagnosis.
     Returns scores immediately, then streams diagnosis via SSE.
+    Frames carry SSE ids; a retry with Last-Event-ID resumes the same
+    analysis from its server-side buffer instead of running it again.
     """
     user = require_auth_if_enabled(req)
+    owner = user["id"] if user else None
+
+    # Reconnect: replay missed frames and follow the analysis (not counted again)
+    last_event_id = req.headers.get("last-event-id")
+    if last_event_id:
+        try:
+            stream, after = resumable_streams.resume(last_event_id, owner)
+        except StreamNotFound as e:
+            raise HTTPException(status_code=410, detail=str(e))
+        return sse_response(resumable_streams.frames(stream, after))
 
     if user and user.get("limit_reached"):
         raise HTTPException(
@@ -583,8 +1317,13 @@ async def analyse_concept_stream(request: AnalyseRequest, req: Request):
             detail="Analysis limit reached. You have used all your analyses."
         )
 
-    # Stage 1: DeBERTa inference
-    confidence_scores = run_stage1(request.concept)
+    # Stage 1: DeBERTa inference (batched with concurrent requests),
+    # warming the Stage 3 connection meanwhile
+    warmup = begin_warmup()
+    try:
+        confidence_scores = await unless_disconnected(req, score_concept(request.concept))
+    finally:
+        timing = warmup.finish() if warmup else None
 
     # Stage 2: Deterministic rules
     evaluation = evaluate_concept(confidence_scores)
@@ -603,22 +1342,234 @@ async def analyse_concept_stream(request: AnalyseRequest, req: Request):
         "concept": request.concept,
         "scores": [s.model_dump() for s in scores],
         "evaluation": evaluation,
-        "remaining_analyses": remaining
+        "remaining_analyses": remaining,
+        "warmup": timing
     }
 
     async def generate():
-        yield f"data: {json.dumps({'type': 'scores', 'data': initial_data})}\n\n"
-        async for chunk in stream_diagnosis(request.concept, evaluation):
+        yield sse_frame({'type': 'scores', 'data': initial_data})
+        async for chunk in stream_diagnosis(request.concept, evaluation, account_of(user)):
             yield chunk
 
-    return StreamingResponse(
-        generate(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
+    # The analysis runs into a buffer, so it survives the connection dropping
+    stream = resumable_streams.start(generate(), owner)
+    return sse_response(resumable_streams.frames(stream))
+
+
+@app.post("/analyse/compare")
+async def analyse_compare(request: AnalyseRequest, req: Request):
+    """
+    Run the Koher pipeline and direct AI side by side over one SSE stream.
+    The direct call starts alongside Stage 1; frames from both are
+    interleaved as they arrive, tagged with event "koher" or "direct".
+    Counts as one analysis.
+    """
+    user = require_auth_if_enabled(req)
+
+    if user and user.get("limit_reached"):
+        raise HTTPException(
+            status_code=403,
+            detail="Analysis limit reached. You have used all your analyses."
+        )
+
+    # Direct AI starts now, while Stage 1 runs (and warms the Koher connection)
+    mux = Multiplexer()
+    mux.add("direct", stream_direct_ai(request.concept, account_of(user)))
+    warmup = begin_warmup()
+
+    try:
+        # Stage 1: DeBERTa inference (batched with concurrent requests)
+        confidence_scores = await unless_disconnected(req, score_concept(request.concept))
+    except BaseException:
+        mux.close()
+        raise
+    finally:
+        timing = warmup.finish() if warmup else None
+
+    # Stage 2: Deterministic rules
+    evaluation = evaluate_concept(confidence_scores)
+
+    scores = [
+        format_score(dim, confidence_scores[dim], evaluation["severity_levels"][dim])
+        for dim in DIMENSION_ORDER
+    ]
+
+    # Increment usage once for both panes
+    remaining = increment_usage_if_enabled(user)
+
+    initial_data = {
+        "concept": request.concept,
+        "scores": [s.model_dump() for s in scores],
+        "evaluation": evaluation,
+        "remaining_analyses": remaining,
+        "warmup": timing
+    }
+
+    async def koher():
+        yield sse_frame({'type': 'scores', 'data': initial_data})
+        async for chunk in stream_diagnosis(request.concept, evaluation, account_of(user)):
+            yield chunk
+
+    mux.add("koher", koher())
+
+    return sse_response(mux.frames())
+
+
+@app.websocket("/analyse/live")
+async def analyse_live(websocket: WebSocket):
+    """
+    Score a concept live while it is typed.
+
+    Client messages:
+      {"type": "edit", "seq": 7, "concept": "..."}   full text after an edit
+      {"type": "diagnose"}                            Stage 3 for the latest text
+
+    Edits are debounced and superseded server-side; once they settle the
+    server sends {"type": "scores", "seq", "scores", "severity_levels"}
+    (Stage 1 and 2 only, not counted as an analysis). A diagnose request
+    streams "diagnosis" messages like /analyse/stream's frames and
+    counts as one analysis.
+    """
+    try:
+        require_auth_if_enabled(websocket)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+
+    await websocket.accept()
+    session = live_scoring.session(lambda message: websocket.send_text(dumps_text(message)))
+    concept = None
+    seq = None
+
+    async def scores(text: str) -> dict:
+        try:
+            confidence_scores = await score_concept(text)
+        except HTTPException as e:
+            return {"type": "busy", "detail": e.detail}
+        evaluation = evaluate_concept(confidence_scores)
+        return {
+            "type": "scores",
+            "scores": {dim: round(confidence_scores[dim], 3) for dim in DIMENSION_ORDER},
+            "severity_levels": evaluation["severity_levels"],
         }
-    )
+
+    async def diagnosis(text: str, text_seq):
+        # Re-read the user: the usage count may have changed since connecting
+        user = get_user_for_request(websocket)
+        if ENABLE_AUTH and not user:
+            yield {"type": "error", "detail": "Authentication required"}
+            return
+        if user and user.get("limit_reached"):
+            yield {"type": "error", "detail": "Analysis limit reached. You have used all your analyses."}
+            return
+
+        try:
+            confidence_scores = await score_concept(text)
+        except HTTPException as e:
+            yield {"type": "busy", "detail": e.detail}
+            return
+        evaluation = evaluate_concept(confidence_scores)
+        remaining = increment_usage_if_enabled(user)
+
+        yield {"type": "diagnosis_start", "seq": text_seq, "remaining_analyses": remaining}
+        async for frame in stream_diagnosis(text, evaluation, account_of(user)):
+            yield diagnosis_message(frame)
+
+    try:
+        while True:
+            received = await websocket.receive()
+            if received["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(received.get("code", 1000))
+            try:
+                message = json.loads(received["text"])
+                kind = message.get("type")
+            except (ValueError, AttributeError, KeyError, TypeError):
+                # Not JSON, not an object, or a binary frame
+                await session.send({"type": "error", "detail": "Messages must be JSON objects"})
+                continue
+
+            if kind == "edit":
+                seq = message.get("seq")
+                try:
+                    concept = AnalyseRequest(concept=message.get("concept", "")).concept
+                except ValidationError as e:
+                    concept = None
+                    session.supersede()
+                    await session.send({"type": "invalid", "seq": seq, "detail": e.errors()[0]["msg"]})
+                    continue
+                session.edit(seq, lambda text=concept: scores(text))
+
+            elif kind == "diagnose":
+                if concept is None:
+                    await session.send({"type": "error", "detail": "Nothing to diagnose yet"})
+                    continue
+                session.diagnose(lambda text=concept, text_seq=seq: diagnosis(text, text_seq))
+
+            else:
+                await session.send({"type": "error", "detail": f"Unknown message type: {kind!r}"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await session.close()
+
+
+@app.post("/analyse/batch", response_model=BatchAnalyseResponse)
+async def analyse_batch(request: BatchAnalyseRequest, req: Request):
+    """
+    Analyse a cohort of design concepts in one request.
+    Stage 1 runs batched, Stage 2 evaluates shared severity patterns once,
+    and optional Stage 3 diagnoses fan out with a concurrency cap.
+    Results are returned in input order; each concept counts as one analysis.
+    """
+    user = require_auth_if_enabled(req)
+    count = len(request.concepts)
+
+    if user and user["remaining_analyses"] < count:
+        raise HTTPException(
+            status_code=403,
+            detail=f"Analysis limit reached. This batch needs {count} analyses; "
+                   f"you have {max(0, user['remaining_analyses'])} remaining."
+        )
+
+    # Stage 1: DeBERTa inference (batched)
+    all_scores = await score_concepts(request.concepts)
+
+    # Stage 2: Deterministic rules (shared severity patterns evaluated once)
+    evaluations = evaluate_concepts(all_scores)
+
+    # Stage 3: Haiku diagnoses (optional, bounded concurrency)
+    diagnoses = [(None, None)] * count
+    if request.include_diagnosis:
+        limit = asyncio.Semaphore(BATCH_DIAGNOSIS_CONCURRENCY)
+
+        async def diagnose(concept: str, evaluation: dict) -> tuple[str, Optional[str]]:
+            async with limit:
+                return await get_full_diagnosis(concept, evaluation, account_of(user))
+
+        diagnoses = await asyncio.gather(*[
+            diagnose(concept, evaluation)
+            for concept, evaluation in zip(request.concepts, evaluations)
+        ])
+
+    # Increment usage once per concept if auth enabled
+    remaining = increment_usage_if_enabled(user, count)
+
+    results = [
+        AnalyseResponse(
+            concept=concept,
+            scores=[
+                format_score(dim, confidence_scores[dim], evaluation["severity_levels"][dim])
+                for dim in DIMENSION_ORDER
+            ],
+            evaluation=evaluation,
+            diagnosis=diagnosis,
+            diagnosis_source=diagnosis_source
+        )
+        for concept, confidence_scores, evaluation, (diagnosis, diagnosis_source)
+        in zip(request.concepts, all_scores, evaluations, diagnoses)
+    ]
+
+    return BatchAnalyseResponse(results=results, remaining_analyses=remaining)
 
 
 @app.post("/analyse/direct", response_model=DirectAIResponse)
@@ -635,7 +1586,7 @@ async def analyse_direct(request: DirectAIRequest, req: Request):
             detail="Analysis limit reached. You have used all your analyses."
         )
 
-    response = await get_direct_ai_response(request.concept)
+    response = await get_direct_ai_response(request.concept, account_of(user))
     remaining = user["remaining_analyses"] if user else None
 
     return DirectAIResponse(
@@ -645,13 +1596,15 @@ async def analyse_direct(request: DirectAIRequest, req: Request):
     )
 
 
-@app.get("/api")
-async def api_info():
-    """API info endpoint."""
+def describe_api() -> dict:
+    """API info: the endpoints available with the current configuration."""
     endpoints = {
         "POST /analyse": "Analyse concept (full response)",
         "POST /analyse/stream": "Analyse concept (streaming diagnosis)",
+        "POST /analyse/batch": "Analyse many concepts (cohort) in one request",
         "POST /analyse/direct": "Direct AI analysis (no pipeline)",
+        "POST /analyse/compare": "Pipeline and direct AI side by side (one multiplexed stream)",
+        "WS /analyse/live": "Live Stage 1 + 2 scoring while a concept is typed (WebSocket)",
         "GET /samples": "Get sample design concepts",
         "GET /health": "Health check",
     }
@@ -683,29 +1636,20 @@ async def api_info():
     }
 
 
+# Fixed for the life of the process, so encoded once
+API_INFO = dumps(describe_api())
+
+
+@app.get("/api")
+async def api_info():
+    """API info endpoint."""
+    return Response(API_INFO, media_type="application/json")
+
+
 # =============================================================================
 # Sample Concepts
 # =============================================================================
 
-SAMPLE_CONCEPTS = {
-    "strong": [
-        "Working parents with children aged 6-12 in dual-income households struggle to coordinate school pickup schedules. In interviews with 15 families, 12 mentioned last-minute changes causing stress. I'm designing a shared family calendar that syncs pickup responsibilities between parents and sends reminders 30 minutes before transitions. This assumes both parents have smartphones and reliable data connections.",
-        "First-generation university students often don't know which campus services exist or how to access them. A survey of 200 first-gen students showed 73% were unaware of free tutoring until their second year. I'm proposing a welcome guide delivered during orientation week that maps all support services with student testimonials. This assumes students will read materials given during an already overwhelming week.",
-        "Rural elderly patients (65+) in Gujarat miss medication doses because pill bottles are hard to open and labels are too small. Observations in 8 homes revealed all patients relied on family members to manage medications. I'm designing a voice-activated dispenser that announces medication times in Gujarati. This requires consistent electricity and assumes patients live alone but have family visit weekly."
-    ],
-    "weak": [
-        "I'm designing an app that helps people be more productive. Everyone struggles with productivity these days, and my app will solve this problem by using AI to help users manage their time better.",
-        "My project is about making education more accessible. There are many people who don't have access to good education, so I'm building a platform that will change this.",
-        "I want to create a sustainable solution for urban living. Cities are becoming more crowded and we need better ways to live. My design will address this through innovative technology."
-    ],
-    "middle": [
-        "Young professionals aged 25-35 report feeling overwhelmed by financial decisions. I'm designing a budgeting app that simplifies investment choices. The app will use machine learning to predict spending patterns. I believe this will help users feel more confident about money.",
-        "Hospital waiting rooms cause anxiety for patients. My project creates a calming digital environment using ambient sounds and lighting. This is based on research about environmental psychology in healthcare settings.",
-        "Small business owners struggle with social media marketing. I'm building a tool that automates content creation and scheduling. This targets businesses with fewer than 10 employees who don't have dedicated marketing staff."
-    ]
-}
-
-
 @app.get("/samples")
 async def get_sample_concepts():
     """
@@ -0,0 +1,299 @@
+"""
+Mock OpenRouter Server
+
+A local stand-in for OpenRouter's chat completions API, so the full
+pipeline can be load-tested on one machine with no network, no API key
+and no bill:
+
+    python -m backend.mock_openrouter --port 8001
+    python -m backend.mock_openrouter --ttft 0.8 --tokens-per-second 60 --overload-rate 0.05
+
+Point the server at it with:
+
+    OPENROUTER_BASE_URL=http://127.0.0.1:8001/api/v1 OPENROUTER_API_KEY=mock \\
+        uvicorn backend.main:app
+
+POST /api/v1/chat/completions answers both streaming (SSE chunks, then
+[DONE]) and non-streaming requests in the OpenAI format the SDK expects,
+with one of a few canned Haiku-style diagnoses. The same prompt always gets
+the same text. Latency is shaped by:
+
+- --ttft: seconds before the first token (±--jitter, as a fraction)
+- --slow-rate / --slow-ttft: share of requests with a much later first
+  token, like an occasional slow provider route
+- --tokens-per-second: pace of the streamed (or, non-streamed, generated)
+  output; canned texts are split into word-sized tokens
+
+--error-rate injects 500s and --overload-rate injects 529 "Overloaded"
+responses (with --retry-after, if set). GET /stats reports requests,
+streams, injected errors and how many streams the client abandoned.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+CANNED_RESPONSES = [
+    "Your concept names a problem worth solving, but the claim about what the design "
+    "will change is still implicit. What would be different for the people you describe "
+    "if it worked exactly as intended? The evidence you cite tells us the problem exists, "
+    "not that this solution addresses it. How might you check that link before building?",
+
+    "The evidence here is specific, which is a real strength. What it supports, though, "
+    "is narrower than the claim you make with it. Who exactly did you hear from, and would "
+    "the same pattern hold for the wider group you want to serve? Consider which part of "
+    "the claim you could stand behind today.",
+
+    "You have set clear boundaries for who this is for, and that makes the concept easier "
+    "to evaluate. Several assumptions carry a lot of weight, however, and none of them are "
+    "named. Which one, if it turned out to be false, would make the design unnecessary? "
+    "That may be the first thing to test.",
+
+    "There is a gap between the problem you describe and the solution you propose. The "
+    "reader has to supply the reasoning that connects them. What steps lead from the "
+    "students' situation to this particular feature? Writing those steps down may show "
+    "whether a simpler intervention would do the same job.",
+]
+
+
+class MockSettings:
+    """Latency and failure shaping for the mock (set from the command line)."""
+
+    def __init__(
+        self,
+        ttft: float = 0.8,
+        jitter: float = 0.25,
+        tokens_per_second: float = 60.0,
+        slow_rate: float = 0.0,
+        slow_ttft: float = 8.0,
+        error_rate: float = 0.0,
+        overload_rate: float = 0.0,
+        retry_after: float = 0.0,
+    ):
+        self.ttft = ttft
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.slow_rate = slow_rate
+        self.slow_ttft = slow_ttft
+        self.error_rate = error_rate
+        self.overload_rate = overload_rate
+        self.retry_after = retry_after
+
+    def first_token_delay(self) -> float:
+        """Seconds before the first token of one response."""
+        if random.random() < self.slow_rate:
+            return self.slow_ttft
+        return max(0.0, self.ttft * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+
+settings = MockSettings()
+cached_prompts: set[str] = set()
+stats = {"requests": 0, "streams": 0, "completed": 0, "abandoned": 0, "errors": 0, "overloaded": 0}
+
+app = FastAPI(title="Mock OpenRouter", docs_url=None, redoc_url=None)
+
+
+# =============================================================================
+# Responses
+# =============================================================================
+
+def message_text(message: dict) -> str:
+    """Text of a message whose content is a string or a list of content parts."""
+    content = message.get("content") or ""
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+
+def cache_marked(message: dict) -> bool:
+    """Whether a message carries a cache_control breakpoint."""
+    content = message.get("content")
+    return isinstance(content, list) and any(isinstance(p, dict) and "cache_control" in p for p in content)
+
+
+def pick_response(messages: list[dict]) -> str:
+    """The canned response for a prompt (stable for the same prompt)."""
+    prompt = "\n".join(message_text(m) for m in messages)
+    digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+    return CANNED_RESPONSES[digest[0] % len(CANNED_RESPONSES)]
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into word-sized tokens that concatenate back to it."""
+    return re.findall(r"\S+\s*", text)
+
+
+def usage(messages: list[dict], tokens: list[str]) -> dict:
+    """
+    Approximate usage block (about four characters per prompt token).
+    Cache-marked messages seen before count as cached, like a warm
+    provider-side prompt cache.
+    """
+    prompt_tokens = 0
+    cached_tokens = 0
+    for message in messages:
+        text = message_text(message)
+        prompt_tokens += len(text) // 4
+        if cache_marked(message):
+            if text in cached_prompts:
+                cached_tokens += len(text) // 4
+            cached_prompts.add(text)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(tokens),
+        "total_tokens": prompt_tokens + len(tokens),
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+    }
+
+
+def chunk(completion_id: str, model: str, delta: Optional[dict], finish_reason=None, **extra) -> str:
+    """One SSE frame in the OpenAI chat.completion.chunk format (no choices if delta is None)."""
+    body = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        **extra,
+    }
+    return f"data: {json.dumps(body)}\n\n"
+
+
+def injected_failure() -> Optional[JSONResponse]:
+    """A 500 or 529 response, at the configured rates."""
+    roll = random.random()
+    if roll < settings.error_rate:
+        stats["errors"] += 1
+        return JSONResponse(
+            status_code=500,
+            content={"error": {"message": "Internal server error (injected)", "code": 500}},
+        )
+    if roll < settings.error_rate + settings.overload_rate:
+        stats["overloaded"] += 1
+        headers = {"retry-after": f"{settings.retry_after:g}"} if settings.retry_after else {}
+        return JSONResponse(
+            status_code=529,
+            content={"error": {"message": "Overloaded", "code": 529}},
+            headers=headers,
+        )
+    return None
+
+
+# =============================================================================
+# Endpoints
+# =============================================================================
+
+@app.post("/api/v1/chat/completions")
+async def chat_completions(request: Request):
+    """OpenAI-compatible chat completions, streaming or not."""
+    stats["requests"] += 1
+    body = await request.json()
+    messages = body.get("messages", [])
+    model = body.get("model", "mock")
+    completion_id = f"gen-{uuid.uuid4().hex[:24]}"
+
+    failure = injected_failure()
+    if failure is not None:
+        return failure
+
+    tokens = tokenize(pick_response(messages))
+    limit = body.get("max_tokens")
+    if limit:
+        tokens = tokens[:limit]
+    delay = settings.first_token_delay()
+    interval = 1.0 / settings.tokens_per_second if settings.tokens_per_second > 0 else 0.0
+
+    if not body.get("stream"):
+        await asyncio.sleep(delay + interval * max(0, len(tokens) - 1))
+        stats["completed"] += 1
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": usage(messages, tokens),
+        }
+
+    include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+    async def generate():
+        stats["streams"] += 1
+        finished = False
+        try:
+            await asyncio.sleep(delay)
+            yield chunk(completion_id, model, {"role": "assistant", "content": ""})
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(interval)
+                yield chunk(completion_id, model, {"content": token})
+            yield chunk(completion_id, model, {}, finish_reason="stop")
+            if include_usage:
+                yield chunk(completion_id, model, None, usage=usage(messages, tokens))
+            yield "data: [DONE]\n\n"
+            finished = True
+        finally:
+            stats["completed" if finished else "abandoned"] += 1
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+async def get_stats():
+    """Request counters and current settings."""
+    return {**stats, "settings": vars(settings)}
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local mock of the OpenRouter chat completions API")
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8001, help="Port (default: 8001)")
+    parser.add_argument("--ttft", type=float, default=0.8, help="Seconds to first token (default: 0.8)")
+    parser.add_argument("--jitter", type=float, default=0.25, help="TTFT jitter as a fraction (default: 0.25)")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0, help="Output pace (default: 60)")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of requests with a slow first token")
+    parser.add_argument("--slow-ttft", type=float, default=8.0, help="First-token delay of slow requests (default: 8)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 500")
+    parser.add_argument("--overload-rate", type=float, default=0.0, help="Share of requests answered with 529")
+    parser.add_argument("--retry-after", type=float, default=0.0, help="Retry-After seconds sent with 529s")
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible runs")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    settings = MockSettings(
+        ttft=args.ttft,
+        jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second,
+        slow_rate=args.slow_rate,
+        slow_ttft=args.slow_ttft,
+        error_rate=args.error_rate,
+        overload_rate=args.overload_rate,
+        retry_after=args.retry_after,
+    )
+
+    print(f"Mock OpenRouter on http://{args.host}:{args.port}/api/v1 "
+          f"(TTFT {args.ttft:g} s, {args.tokens_per_second:g} tokens/s, "
+          f"{args.error_rate:.0%} errors, {args.overload_rate:.0%} overloaded)")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,63 @@
+"""
+Multiplexed SSE Streams
+
+Side-by-side comparison runs the Koher pipeline and the direct LLM call for
+the same concept at once. Rather than two requests, each finishing on its
+own schedule, both are sent to the browser over one SSE response:
+
+    event: direct
+    data: {"text": "The claim"}
+
+    event: koher
+    data: {"type": "scores", ...}
+
+Every frame carries its channel as the SSE event name, and frames are
+forwarded in the order they are produced, so both panes fill at the same
+time. A channel starts consuming as soon as it is added, before the
+response itself is streaming: the direct call can start while Stage 1 is
+still running.
+"""
+
+import asyncio
+from typing import AsyncIterator, Optional
+
+from backend.serialization import sse_frame
+
+
+class Multiplexer:
+    """Interleaves named SSE frame streams into one, tagging each frame with its channel."""
+
+    def __init__(self):
+        self._queue: asyncio.Queue[Optional[str]] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+
+    def add(self, channel: str, frames: AsyncIterator[str]):
+        """Start forwarding a channel's frames (pre-formatted "data: ...\\n\\n" strings)."""
+        self._tasks.append(asyncio.create_task(self._pump(channel, frames)))
+
+    async def frames(self) -> AsyncIterator[str]:
+        """Yield frames from every channel as they arrive, until all have finished."""
+        try:
+            remaining = len(self._tasks)
+            while remaining:
+                frame = await self._queue.get()
+                if frame is None:
+                    remaining -= 1
+                else:
+                    yield frame
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop every channel (e.g. the client went away)."""
+        for task in self._tasks:
+            task.cancel()
+
+    async def _pump(self, channel: str, frames: AsyncIterator[str]):
+        try:
+            async for frame in frames:
+                await self._queue.put(f"event: {channel}\n{frame}")
+        except Exception as e:
+            await self._queue.put(f"event: {channel}\n" + sse_frame({'error': str(e)}))
+        finally:
+            await self._queue.put(None)
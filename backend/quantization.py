@@ -0,0 +1,201 @@
+"""
+INT8 Quantized Inference for Stage 1
+
+The fp32 DeBERTa checkpoint (~738 MB) dominates both latency and memory on
+the CPU-only Docker image. Dynamic quantization stores every nn.Linear
+weight as int8 and quantizes activations on the fly. No calibration data
+and no retraining are needed, and it typically gives 2-3x faster CPU
+inference with about 4x smaller linear layers.
+
+Enable with STAGE1_QUANTIZE=1 (see config.py). CPU only: on CUDA the flag
+is ignored and the model runs in fp32.
+
+Quantization shifts confidences slightly. What matters is whether the shift
+ever flips a severity level in Stage 2, so this module also produces a
+parity report comparing fp32 and int8 severities on a reference corpus:
+
+    python -m backend.quantization
+    python -m backend.quantization --corpus concepts.jsonl --output parity.json
+
+The corpus is JSONL with a "concept" field per line, held out from
+training. It defaults to STAGE1_PARITY_CORPUS_PATH; a corpus smaller than
+--min-concepts (default 200) is refused, since a handful of concepts can't
+show whether int8 flips severities.
+"""
+
+import argparse
+import io
+import json
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+from stage2_rules import classify_confidence
+
+from backend.engines import DIMENSION_ORDER
+from backend.samples import load_corpus
+
+
+# =============================================================================
+# Quantization
+# =============================================================================
+
+def quantize_model(model: torch.nn.Module, inplace: bool = False) -> torch.nn.Module:
+    """
+    Return model with int8 dynamically-quantized linear layers.
+    With inplace=True the fp32 model is converted without a second copy,
+    which keeps peak memory down at startup.
+    """
+    return torch.ao.quantization.quantize_dynamic(
+        model,
+        {torch.nn.Linear},
+        dtype=torch.qint8,
+        inplace=inplace
+    )
+
+
+def model_size_mb(model: torch.nn.Module) -> float:
+    """Serialized size of the model's state dict in MB (includes packed int8 weights)."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / (1024 * 1024)
+
+
+# =============================================================================
+# Parity Report
+# =============================================================================
+
+def score_concepts(model, tokenizer, concepts: list[str]) -> tuple[list[dict[str, float]], float]:
+    """Score concepts one at a time. Returns (scores, mean latency in ms)."""
+    results = []
+    start = time.perf_counter()
+
+    with torch.no_grad():
+        for concept in concepts:
+            inputs = tokenizer(concept, return_tensors="pt", truncation=True, max_length=512)
+            confidence = torch.sigmoid(model(**inputs).logits).numpy()[0]
+            results.append({dim: float(conf) for dim, conf in zip(DIMENSION_ORDER, confidence)})
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return results, elapsed_ms / max(1, len(concepts))
+
+
+def parity_report(model_path: Path, concepts: list[str]) -> dict:
+    """
+    Compare fp32 and int8 Stage 1 outputs on concepts.
+    Severity agreement is measured through classify_confidence, i.e. exactly
+    the judgment Stage 2 would make.
+    """
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(str(model_path))
+    fp32_model = AutoModelForSequenceClassification.from_pretrained(str(model_path)).eval()
+    int8_model = quantize_model(fp32_model)
+
+    # Warm up both models so the first timed call isn't an outlier
+    score_concepts(fp32_model, tokenizer, concepts[:1])
+    score_concepts(int8_model, tokenizer, concepts[:1])
+
+    fp32_scores, fp32_ms = score_concepts(fp32_model, tokenizer, concepts)
+    int8_scores, int8_ms = score_concepts(int8_model, tokenizer, concepts)
+
+    disagreements = []
+    max_delta = 0.0
+    per_dimension = {dim: 0 for dim in DIMENSION_ORDER}
+
+    for i, (fp32, int8) in enumerate(zip(fp32_scores, int8_scores)):
+        for dim in DIMENSION_ORDER:
+            max_delta = max(max_delta, abs(fp32[dim] - int8[dim]))
+            fp32_severity = classify_confidence(dim, fp32[dim])
+            int8_severity = classify_confidence(dim, int8[dim])
+            if fp32_severity == int8_severity:
+                per_dimension[dim] += 1
+            else:
+                disagreements.append({
+                    "index": i,
+                    "dimension": dim,
+                    "fp32_confidence": round(fp32[dim], 4),
+                    "int8_confidence": round(int8[dim], 4),
+                    "fp32_severity": fp32_severity,
+                    "int8_severity": int8_severity,
+                })
+
+    total = len(concepts) * len(DIMENSION_ORDER)
+    fp32_mb = model_size_mb(fp32_model)
+    int8_mb = model_size_mb(int8_model)
+
+    return {
+        "concepts": len(concepts),
+        "severity_agreement": round((total - len(disagreements)) / total, 4) if total else 1.0,
+        "per_dimension_agreement": {
+            dim: round(count / len(concepts), 4) if concepts else 1.0
+            for dim, count in per_dimension.items()
+        },
+        "max_confidence_delta": round(max_delta, 4),
+        "latency_ms": {"fp32": round(fp32_ms, 1), "int8": round(int8_ms, 1)},
+        "speedup": round(fp32_ms / int8_ms, 2) if int8_ms else None,
+        "size_mb": {"fp32": round(fp32_mb, 1), "int8": round(int8_mb, 1)},
+        "compression": round(fp32_mb / int8_mb, 2) if int8_mb else None,
+        "disagreements": disagreements,
+    }
+
+
+def print_report(report: dict):
+    """Print a human-readable summary of a parity report."""
+    print("\n" + "=" * 60)
+    print("STAGE 1 INT8 PARITY REPORT")
+    print("=" * 60)
+    print(f"  Concepts:            {report['concepts']}")
+    print(f"  Severity agreement:  {report['severity_agreement']:.2%}")
+    for dim, rate in report["per_dimension_agreement"].items():
+        print(f"    {dim:12}       {rate:.2%}")
+    print(f"  Max |Δ confidence|:  {report['max_confidence_delta']}")
+    print(f"  Latency (ms):        fp32 {report['latency_ms']['fp32']}, int8 {report['latency_ms']['int8']} ({report['speedup']}x)")
+    print(f"  Size (MB):           fp32 {report['size_mb']['fp32']}, int8 {report['size_mb']['int8']} ({report['compression']}x)")
+
+    if report["disagreements"]:
+        print("\n  Severity flips:")
+        for d in report["disagreements"]:
+            print(f"    #{d['index']} {d['dimension']}: {d['fp32_severity']} ({d['fp32_confidence']}) "
+                  f"→ {d['int8_severity']} ({d['int8_confidence']})")
+    print("=" * 60 + "\n")
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+if __name__ == "__main__":
+    from config import MODEL_PATH, STAGE1_PARITY_CORPUS_PATH
+
+    parser = argparse.ArgumentParser(description="Compare fp32 and int8 Stage 1 severities")
+    parser.add_argument("--model", type=Path, default=MODEL_PATH, help="Model directory")
+    parser.add_argument("--corpus", type=Path, default=STAGE1_PARITY_CORPUS_PATH,
+                        help="Held-out JSONL file with a \"concept\" field per line "
+                             "(default: STAGE1_PARITY_CORPUS_PATH)")
+    parser.add_argument("--output", type=Path, help="Write the full report as JSON")
+    parser.add_argument("--min-concepts", type=int, default=200,
+                        help="Refuse corpora smaller than this (default: 200)")
+    parser.add_argument("--min-agreement", type=float, default=0.98,
+                        help="Exit non-zero if severity agreement falls below this")
+    args = parser.parse_args()
+
+    if not args.corpus.exists():
+        parser.error(f"corpus {args.corpus} not found; pass --corpus with a held-out JSONL file")
+    corpus = load_corpus(args.corpus)
+    if len(corpus) < args.min_concepts:
+        parser.error(f"corpus {args.corpus} has {len(corpus)} concepts, fewer than --min-concepts "
+                     f"{args.min_concepts}; too few to judge severity parity")
+
+    report = parity_report(args.model, corpus)
+    print_report(report)
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"Report written to {args.output}")
+
+    sys.exit(0 if report["severity_agreement"] >= args.min_agreement else 1)
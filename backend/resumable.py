@@ -0,0 +1,195 @@
+"""
+Resumable SSE Streams
+
+A streamed analysis runs in a background task that appends its frames to
+a server-side buffer; the HTTP response only reads from that buffer. If
+the client's connection drops, the analysis keeps going, and a reconnect
+with the Last-Event-ID header picks up after the last frame it received,
+with no second Stage 1 pass, Stage 3 call or usage charge.
+
+Every frame is sent with an SSE id of the form "<stream id>-<sequence>".
+While no frame is ready, a ": heartbeat" comment goes out every
+heartbeat_interval seconds so idle proxies and mobile networks keep the
+connection open. Finished streams stay resumable for ttl seconds; at most
+max_streams are buffered, oldest finished first out.
+
+A stream nobody reads is not kept running for ever: once its last reader
+has disconnected and nobody resumes it within cancel_grace seconds, the
+analysis is cancelled (closing its Haiku stream, so no more tokens are
+paid for) and the stream forgotten; a late resume gets StreamNotFound.
+"""
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator, Optional
+
+from backend.serialization import HEARTBEAT_FRAME, sse_frame
+
+
+class StreamNotFound(Exception):
+    """Raised when a Last-Event-ID names a stream that expired or never existed."""
+    pass
+
+
+class BufferedStream:
+    """The frames of one streamed analysis, as produced so far."""
+
+    def __init__(self, stream_id: str, owner: Optional[int]):
+        self.id = stream_id
+        self.owner = owner
+        self.frames: list[str] = []
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.readers = 0
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._cancel_timer: Optional[asyncio.TimerHandle] = None
+
+    def append(self, frame: str):
+        self.frames.append(frame)
+        self._notify()
+
+    def finish(self):
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def _notify(self):
+        # Wake everyone waiting on the current event, then start a fresh one
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class ResumableStreams:
+    """Buffers streamed analyses so dropped clients can resume them."""
+
+    def __init__(
+        self,
+        ttl: float = 60.0,
+        heartbeat_interval: float = 15.0,
+        max_streams: int = 1000,
+        cancel_grace: float = 5.0,
+    ):
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.max_streams = max(1, max_streams)
+        self.cancel_grace = max(0.0, cancel_grace)
+        self._streams: OrderedDict[str, BufferedStream] = OrderedDict()
+
+        # Counters (exposed on /health)
+        self.started = 0
+        self.resumed = 0
+        self.frames_replayed = 0
+        self.not_found = 0
+        self.heartbeats = 0
+        self.cancelled = 0
+
+    def start(self, frames: AsyncIterator[str], owner: Optional[int] = None) -> BufferedStream:
+        """Run frames into a new buffer in the background and return it."""
+        self._expire()
+        stream = BufferedStream(uuid.uuid4().hex[:16], owner)
+        stream._task = asyncio.create_task(self._pump(stream, frames))
+        self._streams[stream.id] = stream
+        self.started += 1
+        return stream
+
+    def resume(self, last_event_id: str, owner: Optional[int] = None) -> tuple[BufferedStream, int]:
+        """
+        The stream and sequence number a Last-Event-ID refers to. Raises
+        StreamNotFound if it expired, never existed or belongs to someone else.
+        """
+        self._expire()
+        stream_id, _, sequence = last_event_id.strip().rpartition("-")
+        stream = self._streams.get(stream_id)
+        if stream is None or stream.owner != owner or not sequence.isdigit():
+            self.not_found += 1
+            raise StreamNotFound(f"Stream {stream_id or last_event_id!r} is no longer available")
+
+        after = min(int(sequence), len(stream.frames))
+        self.resumed += 1
+        self.frames_replayed += len(stream.frames) - after
+        return stream, after
+
+    async def frames(self, stream: BufferedStream, after: int = 0) -> AsyncIterator[str]:
+        """SSE text for the stream's frames after sequence number after, with ids and heartbeats."""
+        sequence = after
+        stream.readers += 1
+        if stream._cancel_timer is not None:
+            stream._cancel_timer.cancel()
+            stream._cancel_timer = None
+        try:
+            while True:
+                changed = stream._changed
+                while sequence < len(stream.frames):
+                    frame = stream.frames[sequence]
+                    sequence += 1
+                    yield f"id: {stream.id}-{sequence}\n{frame}"
+                if stream.done:
+                    return
+                try:
+                    await asyncio.wait_for(changed.wait(), self.heartbeat_interval)
+                except asyncio.TimeoutError:
+                    self.heartbeats += 1
+                    yield HEARTBEAT_FRAME
+        finally:
+            stream.readers -= 1
+            if not stream.readers and not stream.done:
+                # The client went away mid-analysis: cancel it unless it comes back
+                stream._cancel_timer = asyncio.get_running_loop().call_later(
+                    self.cancel_grace, self._abandon, stream
+                )
+
+    async def close(self):
+        """Cancel streams still running (shutdown)."""
+        tasks = [s._task for s in self._streams.values() if s._task and not s._task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        """Buffer occupancy and resume counters for monitoring."""
+        self._expire()
+        return {
+            "buffered": len(self._streams),
+            "running": sum(1 for s in self._streams.values() if not s.done),
+            "ttl_seconds": self.ttl,
+            "heartbeat_seconds": self.heartbeat_interval,
+            "started": self.started,
+            "resumed": self.resumed,
+            "frames_replayed": self.frames_replayed,
+            "not_found": self.not_found,
+            "heartbeats": self.heartbeats,
+            "cancel_grace_seconds": self.cancel_grace,
+            "cancelled": self.cancelled,
+        }
+
+    async def _pump(self, stream: BufferedStream, frames: AsyncIterator[str]):
+        try:
+            async for frame in frames:
+                stream.append(frame)
+        except Exception as e:
+            stream.append(sse_frame({'error': str(e)}))
+        finally:
+            stream.finish()
+
+    def _abandon(self, stream: BufferedStream):
+        """Cancel a running stream nobody resumed within cancel_grace."""
+        stream._cancel_timer = None
+        if stream.readers or stream.done:
+            return
+        self.cancelled += 1
+        self._streams.pop(stream.id, None)
+        stream._task.cancel()
+
+    def _expire(self):
+        """Drop finished streams past their TTL, then the oldest finished ones over max_streams."""
+        now = time.monotonic()
+        for stream_id in [sid for sid, s in self._streams.items() if s.done and now - s.finished_at > self.ttl]:
+            del self._streams[stream_id]
+
+        excess = len(self._streams) - self.max_streams + 1
+        if excess > 0:
+            for stream_id in [sid for sid, s in self._streams.items() if s.done][:excess]:
+                del self._streams[stream_id]
@@ -0,0 +1,50 @@
+"""
+Sample Concepts
+
+The built-in example concepts served on /samples, and corpus loading for
+the offline tools (parity report, autotuner, load generator). Kept apart
+from main.py so those tools don't import the FastAPI app and its config
+side effects just to read a few strings.
+
+Nine samples are enough to exercise the pipeline (warm-up, tuning, load
+tests) but far too few to judge accuracy; the int8 parity report requires
+a real corpus.
+"""
+
+import json
+from pathlib import Path
+
+
+SAMPLE_CONCEPTS = {
+    "strong": [
+        "Working parents with children aged 6-12 in dual-income households struggle to coordinate school pickup schedules. In interviews with 15 families, 12 mentioned last-minute changes causing stress. I'm designing a shared family calendar that syncs pickup responsibilities between parents and sends reminders 30 minutes before transitions. This assumes both parents have smartphones and reliable data connections.",
+        "First-generation university students often don't know which campus services exist or how to access them. A survey of 200 first-gen students showed 73% were unaware of free tutoring until their second year. I'm proposing a welcome guide delivered during orientation week that maps all support services with student testimonials. This assumes students will read materials given during an already overwhelming week.",
+        "Rural elderly patients (65+) in Gujarat miss medication doses because pill bottles are hard to open and labels are too small. Observations in 8 homes revealed all patients relied on family members to manage medications. I'm designing a voice-activated dispenser that announces medication times in Gujarati. This requires consistent electricity and assumes patients live alone but have family visit weekly."
+    ],
+    "weak": [
+        "I'm designing an app that helps people be more productive. Everyone struggles with productivity these days, and my app will solve this problem by using AI to help users manage their time better.",
+        "My project is about making education more accessible. There are many people who don't have access to good education, so I'm building a platform that will change this.",
+        "I want to create a sustainable solution for urban living. Cities are becoming more crowded and we need better ways to live. My design will address this through innovative technology."
+    ],
+    "middle": [
+        "Young professionals aged 25-35 report feeling overwhelmed by financial decisions. I'm designing a budgeting app that simplifies investment choices. The app will use machine learning to predict spending patterns. I believe this will help users feel more confident about money.",
+        "Hospital waiting rooms cause anxiety for patients. My project creates a calming digital environment using ambient sounds and lighting. This is based on research about environmental psychology in healthcare settings.",
+        "Small business owners struggle with social media marketing. I'm building a tool that automates content creation and scheduling. This targets businesses with fewer than 10 employees who don't have dedicated marketing staff."
+    ]
+}
+
+
+def sample_concepts() -> list[str]:
+    """Every built-in sample concept, flattened."""
+    return [c for group in SAMPLE_CONCEPTS.values() for c in group]
+
+
+def load_corpus(path: Path) -> list[str]:
+    """Read concepts from a JSONL file with a "concept" field per line."""
+    concepts = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                concepts.append(json.loads(line)["concept"])
+    return concepts
@@ -0,0 +1,217 @@
+"""
+Fast JSON Serialization
+
+Every /analyse response carries the full Stage 2 evaluation, and every SSE
+frame of a streamed diagnosis is its own small JSON document. Encoding them
+with the stdlib json module is pure-Python work on the event loop, repeated
+for each of hundreds of concurrent streams.
+
+This module encodes JSON with orjson when it is installed (a Rust encoder,
+typically 5-10x faster than json.dumps) and falls back to the stdlib
+otherwise, with the same output settings Starlette's JSONResponse uses:
+UTF-8 rather than \\u escapes, no whitespace. Either way the result is
+valid JSON for any text, including emoji and non-Latin scripts.
+
+- FastJSONResponse: the app's default response class. Routes with a
+  response_model keep FastAPI's own Pydantic serializer where the installed
+  FastAPI has one; every other JSON response is rendered here.
+- sse_frame(payload): one "data: {...}" SSE frame.
+- DONE_FRAME, HEARTBEAT_FRAME: frames whose content never changes, built
+  once instead of per stream.
+
+How much CPU this saves per request depends on the payloads, so measure it:
+
+    python -m backend.serialization
+    python -m backend.serialization --iterations 20000
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional: pip install orjson
+    orjson = None
+
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(obj: Any) -> bytes:
+        """obj as compact UTF-8 JSON."""
+        return orjson.dumps(obj, option=_OPTIONS)
+
+    def dumps_text(obj: Any) -> str:
+        """obj as compact JSON text (an SSE frame, a WebSocket text message)."""
+        return orjson.dumps(obj, option=_OPTIONS).decode("utf-8")
+else:
+    _encode = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode
+
+    def dumps(obj: Any) -> bytes:
+        """obj as compact UTF-8 JSON."""
+        return _encode(obj).encode("utf-8")
+
+    def dumps_text(obj: Any) -> str:
+        """obj as compact JSON text (an SSE frame, a WebSocket text message)."""
+        return _encode(obj)
+
+
+def sse_frame(payload: Any) -> str:
+    """One SSE data frame carrying payload as JSON."""
+    return "data: " + dumps_text(payload) + "\n\n"
+
+
+# Static frames, encoded once
+DONE_FRAME = "data: [DONE]\n\n"
+HEARTBEAT_FRAME = ": heartbeat\n\n"
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with dumps()."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+# =============================================================================
+# Micro-benchmark
+# =============================================================================
+
+def sample_payloads() -> dict:
+    """
+    Representative payloads built by the real Stage 2 rules: an /analyse
+    response body, and the frames of one streamed diagnosis (scores frame,
+    source frame, coalesced text chunks, [DONE]).
+    """
+    sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+    from stage2_rules import compose_diagnosis, evaluate_concept
+
+    concept = (
+        "Rural elderly patients (65+) in Gujarat miss medication doses because pill bottles "
+        "are hard to open and labels are too small. Observations in 8 homes revealed all "
+        "patients relied on family members to manage medications. I'm designing a "
+        "voice-activated dispenser that announces medication times in Gujarati — "
+        "દવાનો સમય થઈ ગયો છે."
+    )
+    confidence = {"CLAIM": 0.912, "EVIDENCE": 0.318, "SCOPE": 0.874, "ASSUMPTIONS": 0.552, "GAPS": 0.207}
+    evaluation = evaluate_concept(confidence)
+    diagnosis = compose_diagnosis(concept, evaluation)
+    scores = [
+        {"dimension": dim, "confidence": value, "severity": evaluation["severity_levels"][dim],
+         "display": f"● {evaluation['severity_levels'][dim].title()}"}
+        for dim, value in confidence.items()
+    ]
+
+    # Roughly what the coalescer sends: ~100 ms of tokens per chunk
+    chunks = [diagnosis[i:i + 40] for i in range(0, len(diagnosis), 40)]
+    stream = (
+        [{"type": "scores", "data": {"concept": concept, "scores": scores, "evaluation": evaluation,
+                                     "remaining_analyses": 7, "warmup": None}},
+         {"source": "llm", "hedged": False, "hedge_won": False}]
+        + [{"text": chunk} for chunk in chunks]
+    )
+
+    return {
+        "analyse": {
+            "concept": concept,
+            "scores": scores,
+            "evaluation": evaluation,
+            "diagnosis": diagnosis,
+            "diagnosis_source": "llm",
+            "remaining_analyses": 7,
+        },
+        "stream": stream,
+    }
+
+
+def _stdlib_response(content: Any) -> bytes:
+    # What Starlette's JSONResponse.render does
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def _stdlib_stream(frames: list) -> list:
+    # How SSE frames were built before this module
+    return [f"data: {json.dumps(frame)}\n\n" for frame in frames] + ["data: [DONE]\n\n"]
+
+
+def _fast_stream(frames: list) -> list:
+    return [sse_frame(frame) for frame in frames] + [DONE_FRAME]
+
+
+def _time_us(fn: Callable[[], Any], iterations: int) -> float:
+    """Mean CPU time of fn() in microseconds."""
+    fn()
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def benchmark(iterations: int = 5000) -> dict:
+    """Per-request CPU time of the stdlib encoding and of this module's, for each sample payload."""
+    payloads = sample_payloads()
+    cases = {
+        "analyse": (lambda: _stdlib_response(payloads["analyse"]), lambda: dumps(payloads["analyse"])),
+        "stream": (lambda: _stdlib_stream(payloads["stream"]), lambda: _fast_stream(payloads["stream"])),
+    }
+
+    results = {}
+    for name, (stdlib, fast) in cases.items():
+        stdlib_us = _time_us(stdlib, iterations)
+        fast_us = _time_us(fast, iterations)
+        results[name] = {
+            "stdlib_us": round(stdlib_us, 2),
+            "fast_us": round(fast_us, 2),
+            "saved_us": round(stdlib_us - fast_us, 2),
+            "speedup": round(stdlib_us / fast_us, 2) if fast_us else None,
+        }
+
+    return {
+        "backend": JSON_BACKEND,
+        "iterations": iterations,
+        "stream_frames": len(payloads["stream"]) + 1,
+        "analyse_bytes": len(dumps(payloads["analyse"])),
+        "results": results,
+    }
+
+
+def print_report(report: dict):
+    """Print a human-readable summary of a benchmark report."""
+    print("\n" + "=" * 60)
+    print("JSON SERIALIZATION BENCHMARK")
+    print("=" * 60)
+    print(f"  Backend:             {report['backend']}" + ("" if orjson else " (pip install orjson for the fast path)"))
+    print(f"  Iterations:          {report['iterations']}")
+    print(f"  /analyse body:       {report['analyse_bytes']} bytes")
+    print(f"  Stream:              {report['stream_frames']} frames")
+    for name, r in report["results"].items():
+        print(f"  {name + ' (µs/request):':23}stdlib {r['stdlib_us']}, {report['backend']} {r['fast_us']} "
+              f"(saves {r['saved_us']} µs, {r['speedup']}x)")
+    print("=" * 60 + "\n")
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure per-request JSON encoding CPU time")
+    parser.add_argument("--iterations", type=int, default=5000, help="Timed encodings per payload (default: 5000)")
+    parser.add_argument("--output", type=Path, help="Write the report as JSON")
+    args = parser.parse_args()
+
+    report = benchmark(max(1, args.iterations))
+    print_report(report)
+
+    if args.output:
+        args.output.write_bytes(dumps(report))
+        print(f"Report written to {args.output}")
@@ -0,0 +1,158 @@
+"""
+Single-flight Coalescing
+
+When a teacher projects a sample concept and a whole class presses
+"analyse" at once, every request asks for exactly the same work: the same
+DeBERTa pass and the same Haiku diagnosis. Caches only help after the first
+result is in, and until then every request would compute it again.
+
+SingleFlight lets the first caller for a key start the work, and every
+concurrent caller with the same key waits on that same work instead:
+
+- do(key, fn): the awaited result (or exception) is shared by all callers.
+- stream(key, fn): one producer consumes the async generator and every
+  subscriber receives every frame. Late joiners first get the frames
+  already sent, then follow live.
+
+The shared work runs in its own task, so a caller that gives up (e.g. a
+client disconnecting) does not cancel it for the others. Once every caller
+has given up, though, nobody needs the result: the work is cancelled (an
+upstream stream is closed, a queued Stage 1 item abandoned) and its key
+dropped, so the next caller starts afresh. Keys are dropped as soon as the
+work finishes. Anything counted per request, such as usage
+in gated mode, stays outside and is still counted once per caller.
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+
+class _Broadcast:
+    """Frames produced so far for one shared stream, and who is waiting for more."""
+
+    def __init__(self):
+        self.frames: list[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+        self.subscribers = 0
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls and streams by key."""
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Task] = {}
+        self._callers: dict[asyncio.Task, int] = {}
+        self._streams: dict[str, _Broadcast] = {}
+
+        # Counters (exposed on /health)
+        self.started = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Return fn()'s result, sharing one call among concurrent callers with this key."""
+        task = self._calls.get(key)
+
+        if task is None:
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            self._callers[task] = 0
+            self.started += 1
+            task.add_done_callback(lambda t: self._finished(self._calls, key, t))
+        else:
+            self.coalesced += 1
+
+        self._callers[task] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if not task.done():
+                self._callers[task] -= 1
+                if not self._callers[task]:
+                    # Every caller gave up
+                    self._abandon(self._calls, key, task)
+                    task.cancel()
+
+    async def stream(self, key: str, fn: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Yield every frame of fn(), sharing one producer among concurrent subscribers."""
+        broadcast = self._streams.get(key)
+
+        if broadcast is None:
+            broadcast = _Broadcast()
+            broadcast.task = asyncio.create_task(self._pump(broadcast, fn()))
+            self._streams[key] = broadcast
+            self.started += 1
+            broadcast.task.add_done_callback(lambda t: self._finished(self._streams, key, broadcast))
+        else:
+            self.coalesced += 1
+
+        sent = 0
+        broadcast.subscribers += 1
+        try:
+            while True:
+                async with broadcast.changed:
+                    await broadcast.changed.wait_for(lambda: len(broadcast.frames) > sent or broadcast.done)
+                    frames = broadcast.frames[sent:]
+                    done = broadcast.done
+
+                for frame in frames:
+                    yield frame
+                sent += len(frames)
+
+                if done and sent == len(broadcast.frames):
+                    break
+        finally:
+            broadcast.subscribers -= 1
+            if not broadcast.subscribers and not broadcast.done:
+                # Every subscriber left mid-stream
+                self._abandon(self._streams, key, broadcast)
+                broadcast.task.cancel()
+
+        if broadcast.error is not None:
+            raise broadcast.error
+
+    def stats(self) -> dict:
+        """Coalescing counters for monitoring."""
+        return {
+            "in_flight": len(self._calls) + len(self._streams),
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+        }
+
+    async def _pump(self, broadcast: _Broadcast, frames: AsyncIterator[Any]):
+        """Drive the shared generator and publish each frame to all subscribers."""
+        try:
+            async for frame in frames:
+                async with broadcast.changed:
+                    broadcast.frames.append(frame)
+                    broadcast.changed.notify_all()
+        except Exception as e:
+            broadcast.error = e
+        except asyncio.CancelledError:
+            # Close the producer now (its upstream stream with it), not at GC
+            await frames.aclose()
+            raise
+        finally:
+            async with broadcast.changed:
+                broadcast.done = True
+                broadcast.changed.notify_all()
+
+    def _abandon(self, registry: dict, key: str, entry: Any):
+        """Forget a flight nobody is waiting for, so a new caller doesn't join it while it is cancelled."""
+        self.cancelled += 1
+        if registry.get(key) is entry:
+            del registry[key]
+
+    def _finished(self, registry: dict, key: str, entry: Any):
+        """Forget a finished flight, unless a newer one already took its key."""
+        self._callers.pop(entry, None)
+        if registry.get(key) is entry:
+            del registry[key]
+
+        # Mark a failed call's exception as retrieved even if every caller left
+        if isinstance(entry, asyncio.Task) and not entry.cancelled():
+            entry.exception()
@@ -0,0 +1,322 @@
+"""
+Stage 1 Autotuner
+
+torch (and ONNX Runtime) size their intra-op thread pools to every core on
+the machine. With several uvicorn processes or STAGE1_WORKERS threads
+sharing one box, each forward pass fights the others for the same cores
+and tail latency gets worse, not better. The right thread count and batch
+size depend on the hardware, so they are measured rather than guessed:
+
+    python -m backend.tuning
+    python -m backend.tuning --threads 1,2,4 --interop 1,2 --batch-sizes 1,4,8,16
+
+For each intra-op/inter-op thread pair the engine is loaded in a fresh
+process (torch only accepts inter-op settings once per process) and
+STAGE1_WORKERS threads score batches concurrently, as the server's worker
+pool does. Thread counts are capped so that
+threads x STAGE1_WORKERS x WEB_CONCURRENCY never exceeds the core count.
+
+The fastest combination within the --max-p95-ms latency budget is written
+to STAGE1_PROFILE_PATH. On startup the lifespan loader applies it if it
+was tuned for the same engine, precision, worker count and hardware; the
+applied settings are reported under stage1_settings on /health.
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# 2: profiles from before tokenisation was serialised across workers
+# measured runs that could fail with "Already borrowed"; they are ignored
+PROFILE_VERSION = 2
+
+
+# =============================================================================
+# Hardware
+# =============================================================================
+
+def hardware_signature() -> dict:
+    """What a profile was tuned on. A profile is only valid on matching hardware."""
+    return {
+        "cpus": os.cpu_count() or 1,
+        "machine": platform.machine(),
+    }
+
+
+def server_processes() -> int:
+    """uvicorn worker processes (uvicorn reads WEB_CONCURRENCY as its --workers default)."""
+    return max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+
+
+def thread_budget(workers: int, processes: int) -> int:
+    """Cores available to one forward pass without oversubscribing."""
+    return max(1, (os.cpu_count() or 1) // (workers * processes))
+
+
+def default_thread_grid(budget: int) -> list[int]:
+    """Powers of two up to the budget, plus the budget itself."""
+    grid = [1]
+    while grid[-1] * 2 <= budget:
+        grid.append(grid[-1] * 2)
+    if grid[-1] != budget:
+        grid.append(budget)
+    return grid
+
+
+# =============================================================================
+# Benchmark
+# =============================================================================
+
+def benchmark_threads(
+    engine_options: dict,
+    concepts: list[str],
+    batch_sizes: list[int],
+    concurrency: int,
+    repeats: int,
+) -> list[dict]:
+    """
+    Load one engine with the given thread settings and time every batch size.
+    Runs in its own process. concurrency threads call predict() at once,
+    each repeats times, so contention between workers is part of the result.
+    The engine serialises tokenisation itself, as in the server; if any
+    worker still fails, the setting is not safe and the benchmark raises
+    rather than recording a partial measurement.
+    """
+    from backend.engines import load_engine
+
+    engine = load_engine(**engine_options)
+    results = []
+
+    for batch_size in batch_sizes:
+        batch = [concepts[i % len(concepts)] for i in range(batch_size)]
+        engine.predict(batch)  # warm up this shape
+
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    engine.predict(batch)
+                    elapsed_ms = (time.perf_counter() - start) * 1000
+                    with lock:
+                        latencies.append(elapsed_ms)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        wall_start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall_s = time.perf_counter() - wall_start
+
+        if errors:
+            raise RuntimeError(
+                f"{len(errors)} of {concurrency} worker(s) failed at batch size {batch_size}: {errors[0]!r}"
+            ) from errors[0]
+
+        latencies.sort()
+        results.append({
+            "threads": engine_options["threads"],
+            "interop_threads": engine_options["interop_threads"],
+            "batch_size": batch_size,
+            "items_per_s": round(batch_size * len(latencies) / wall_s, 1),
+            "p50_ms": round(latencies[len(latencies) // 2], 1),
+            "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+        })
+
+    return results
+
+
+def choose(results: list[dict], max_p95_ms: Optional[float] = None) -> dict:
+    """
+    Highest throughput within the latency budget (lower p95 breaks ties).
+    If nothing meets the budget, the lowest-p95 result is chosen instead.
+    """
+    within = [r for r in results if max_p95_ms is None or r["p95_ms"] <= max_p95_ms]
+    if not within:
+        return min(results, key=lambda r: r["p95_ms"])
+    return max(within, key=lambda r: (r["items_per_s"], -r["p95_ms"]))
+
+
+def tune(
+    model_path: Path,
+    engine: str,
+    quantize: bool,
+    workers: int,
+    processes: int,
+    thread_grid: list[int],
+    interop_grid: list[int],
+    batch_sizes: list[int],
+    concepts: list[str],
+    repeats: int = 10,
+    max_p95_ms: Optional[float] = None,
+) -> dict:
+    """Benchmark the full grid and return a profile for the best combination."""
+    from backend.cache import model_revision
+    from backend.engines import create_engine
+    from config import STAGE1_LENGTH_BUCKETS
+
+    revision = model_revision(model_path)
+    create_engine(engine, model_path, quantize=quantize, revision=revision).prepare()
+
+    ctx = mp.get_context("spawn")
+    results = []
+
+    for threads in thread_grid:
+        for interop_threads in interop_grid:
+            print(f"Benchmarking {threads} intra-op / {interop_threads} inter-op thread(s)...")
+            engine_options = {
+                "name": engine,
+                "model_path": model_path,
+                "quantize": quantize,
+                "revision": revision,
+                "length_buckets": STAGE1_LENGTH_BUCKETS,
+                "threads": threads,
+                "interop_threads": interop_threads,
+            }
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                results.extend(pool.submit(
+                    benchmark_threads, engine_options, concepts, batch_sizes, workers, repeats
+                ).result())
+
+    best = choose(results, max_p95_ms)
+
+    return {
+        "version": PROFILE_VERSION,
+        "created_at": datetime.now().isoformat(),
+        "engine": engine,
+        "quantize": quantize,
+        "workers": workers,
+        "processes": processes,
+        "hardware": hardware_signature(),
+        "max_p95_ms": max_p95_ms,
+        "settings": {
+            "threads": best["threads"],
+            "interop_threads": best["interop_threads"],
+            "max_batch_size": best["batch_size"],
+        },
+        "measured": {k: best[k] for k in ("items_per_s", "p50_ms", "p95_ms")},
+        "results": results,
+    }
+
+
+# =============================================================================
+# Profiles
+# =============================================================================
+
+def save_profile(profile: dict, path: Path):
+    """Write a tuned profile as JSON."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(profile, indent=2))
+
+
+def load_profile(path: Path, engine: str, quantize: bool, workers: int) -> Optional[dict]:
+    """
+    Return the profile at path if it was tuned for this configuration and
+    hardware, otherwise None (with the reason printed).
+    """
+    if not path.exists():
+        return None
+
+    try:
+        profile = json.loads(path.read_text())
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Warning: ignoring unreadable Stage 1 profile {path}: {e}")
+        return None
+
+    expected = {
+        "version": PROFILE_VERSION,
+        "engine": engine,
+        "quantize": quantize,
+        "workers": workers,
+        "processes": server_processes(),
+        "hardware": hardware_signature(),
+    }
+    mismatched = [key for key, value in expected.items() if profile.get(key) != value]
+    if mismatched:
+        print(f"Warning: Stage 1 profile {path} was tuned for a different {', '.join(mismatched)}; "
+              f"ignoring it (re-run python -m backend.tuning)")
+        return None
+
+    return profile
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+def parse_ints(value: str) -> list[int]:
+    """Parse a comma-separated list of positive ints."""
+    return [int(v) for v in value.split(",") if v.strip() and int(v) > 0]
+
+
+if __name__ == "__main__":
+    from config import (
+        MODEL_PATH, STAGE1_ENGINE, STAGE1_QUANTIZE, STAGE1_WORKERS, STAGE1_PROFILE_PATH
+    )
+
+    parser = argparse.ArgumentParser(description="Tune Stage 1 thread counts and batch size for this machine")
+    parser.add_argument("--model", type=Path, default=MODEL_PATH, help="Model directory")
+    parser.add_argument("--engine", default=STAGE1_ENGINE, help=f"Inference engine (default: {STAGE1_ENGINE})")
+    parser.add_argument("--quantize", action=argparse.BooleanOptionalAction, default=STAGE1_QUANTIZE,
+                        help="Tune int8 inference (default: STAGE1_QUANTIZE; --no-quantize tunes fp32)")
+    parser.add_argument("--workers", type=int, default=STAGE1_WORKERS,
+                        help=f"Concurrent Stage 1 workers to simulate (default: STAGE1_WORKERS={STAGE1_WORKERS})")
+    parser.add_argument("--threads", type=parse_ints, help="Intra-op thread counts to try (default: powers of 2 up to the budget)")
+    parser.add_argument("--interop", type=parse_ints, default=[1, 2], help="Inter-op thread counts to try (default: 1,2)")
+    parser.add_argument("--batch-sizes", type=parse_ints, default=[1, 4, 8, 16, 32],
+                        help="Batch sizes to try (default: 1,4,8,16,32)")
+    parser.add_argument("--repeats", type=int, default=10, help="Timed batches per worker per setting (default: 10)")
+    parser.add_argument("--max-p95-ms", type=float, help="Latency budget per batch; fastest setting within it wins")
+    parser.add_argument("--corpus", type=Path, help="JSONL file with a \"concept\" field per line")
+    parser.add_argument("--output", type=Path, default=STAGE1_PROFILE_PATH, help="Profile path (default: STAGE1_PROFILE_PATH)")
+    parser.add_argument("--dry-run", action="store_true", help="Print results without writing the profile")
+    args = parser.parse_args()
+
+    workers = max(1, args.workers)
+    processes = server_processes()
+    budget = thread_budget(workers, processes)
+    thread_grid = [t for t in (args.threads or default_thread_grid(budget)) if t <= budget] or [budget]
+
+    from backend.samples import load_corpus, sample_concepts
+    corpus = load_corpus(args.corpus) if args.corpus else sample_concepts()
+
+    print(f"Tuning {args.engine} ({'int8' if args.quantize else 'fp32'}) on {os.cpu_count()} cores: "
+          f"{workers} worker(s) x {processes} process(es), up to {budget} thread(s) per pass")
+
+    profile = tune(
+        args.model, args.engine, args.quantize, workers, processes,
+        thread_grid, args.interop, args.batch_sizes, corpus,
+        repeats=max(1, args.repeats), max_p95_ms=args.max_p95_ms,
+    )
+
+    print("\n  threads  interop  batch   items/s   p50 ms   p95 ms")
+    for r in profile["results"]:
+        print(f"  {r['threads']:>7}  {r['interop_threads']:>7}  {r['batch_size']:>5}  "
+              f"{r['items_per_s']:>8}  {r['p50_ms']:>7}  {r['p95_ms']:>7}")
+
+    settings = profile["settings"]
+    print(f"\nBest: {settings['threads']} intra-op / {settings['interop_threads']} inter-op thread(s), "
+          f"batches of up to {settings['max_batch_size']} "
+          f"({profile['measured']['items_per_s']} items/s, p95 {profile['measured']['p95_ms']} ms)")
+
+    if not args.dry_run:
+        save_profile(profile, args.output)
+        print(f"Profile written to {args.output} (applied on next server start)")
@@ -0,0 +1,283 @@
+"""
+Stage 3 Upstream Calls
+
+Every OpenRouter call (streamed diagnosis, full diagnosis, direct AI) goes
+through one Upstream, which owns three policies:
+
+Retries: transient failures (429, 5xx, 529 "overloaded", timeouts and
+connection errors) are retried with exponential backoff and full jitter,
+up to STAGE3_MAX_ATTEMPTS. A Retry-After header from the provider is
+honoured as the minimum wait. Client errors (400, 401, ...) fail at once.
+
+Deadline: each call gets STAGE3_DEADLINE seconds in total, retries and
+backoff included, to produce a response (for streams: to start streaming).
+A retry that could not finish in time is not attempted.
+
+Circuit breaker: the outcome of recent calls is tracked in a rolling
+window. Once at least STAGE3_BREAKER_MIN_CALLS calls are in the window and
+the failure rate reaches STAGE3_BREAKER_FAILURE_RATE, the breaker opens and
+calls fail immediately with CircuitOpen instead of each one waiting out its
+own retries. After STAGE3_BREAKER_COOLDOWN seconds a single trial call is
+let through (half-open): success closes the breaker, failure re-opens it.
+Breaker state is reported on /health.
+"""
+
+import asyncio
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, Union
+
+import openai
+
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+class CircuitOpen(Exception):
+    """Raised when the breaker is open and the call is not attempted."""
+    pass
+
+
+@dataclass
+class RetryNotice:
+    """Yielded by Upstream.attempts() before each backoff sleep."""
+    attempt: int          # the attempt that just failed (1-based)
+    max_attempts: int
+    delay: float          # seconds until the next attempt
+    error: Exception
+
+
+# =============================================================================
+# Error Classification
+# =============================================================================
+
+def is_retryable(error: Exception) -> bool:
+    """Transient provider or network failures worth another attempt."""
+    if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or "overloaded" in str(error).lower()
+    return False
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the provider asked us to wait (Retry-After / retry-after-ms), if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000.0
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# =============================================================================
+# Circuit Breaker
+# =============================================================================
+
+class CircuitBreaker:
+    """Rolling-window failure-rate breaker: closed → open → half-open → closed."""
+
+    def __init__(self, failure_rate: float = 0.5, window: int = 20, min_calls: int = 5, cooldown: float = 30.0):
+        self.failure_rate = failure_rate
+        self.min_calls = max(1, min_calls)
+        self.cooldown = cooldown
+
+        self._outcomes: deque[bool] = deque(maxlen=max(1, window))  # True = failure
+        self.state = "closed"
+        self._opened_at = 0.0
+        self._trial_running = False
+
+        # Counters (exposed on /health)
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Raise CircuitOpen unless a call may go ahead now."""
+        if self.state == "open":
+            if time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = "half_open"
+            else:
+                self.rejected += 1
+                raise CircuitOpen(f"Stage 3 circuit open, retrying upstream in {self.retry_in():.0f}s")
+
+        if self.state == "half_open":
+            if self._trial_running:
+                self.rejected += 1
+                raise CircuitOpen("Stage 3 circuit half-open, trial call in progress")
+            self._trial_running = True
+
+    def record_success(self):
+        """Record a successful call."""
+        if self.state == "half_open":
+            self._outcomes.clear()
+            self.state = "closed"
+            self._trial_running = False
+        self._outcomes.append(False)
+
+    def record_failure(self):
+        """Record a transient failure; may open the breaker."""
+        if self.state == "half_open":
+            self._trial_running = False
+            self._open()
+            return
+
+        self._outcomes.append(True)
+        failures = sum(self._outcomes)
+        if (self.state == "closed" and len(self._outcomes) >= self.min_calls
+                and failures / len(self._outcomes) >= self.failure_rate):
+            self._open()
+
+    def release(self):
+        """A call ended with neither verdict (e.g. a client error): free the trial slot."""
+        if self.state == "half_open":
+            self._trial_running = False
+
+    def retry_in(self) -> float:
+        """Seconds until an open breaker lets a trial call through."""
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self._opened_at))
+
+    def stats(self) -> dict:
+        """Breaker state for monitoring."""
+        failures = sum(self._outcomes)
+        return {
+            "state": self.state,
+            "failure_rate": round(failures / len(self._outcomes), 3) if self._outcomes else 0.0,
+            "window_calls": len(self._outcomes),
+            "threshold": self.failure_rate,
+            "retry_in_seconds": round(self.retry_in(), 1),
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+    def _open(self):
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        self.times_opened += 1
+
+
+# =============================================================================
+# Upstream
+# =============================================================================
+
+class Upstream:
+    """Retry, deadline and circuit-breaker policy shared by all Stage 3 calls."""
+
+    def __init__(
+        self,
+        breaker: CircuitBreaker,
+        max_attempts: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        deadline: float = 30.0,
+    ):
+        self.breaker = breaker
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+
+        # Counters (exposed on /health)
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.deadline_exceeded = 0
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        """Full-jitter exponential backoff after the given attempt, at least Retry-After."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+        requested = retry_after(error)
+        return max(delay, requested) if requested is not None else delay
+
+    async def attempts(self, fn: Callable[[], Awaitable[Any]]) -> AsyncIterator[Union[RetryNotice, Any]]:
+        """
+        Run fn() under the retry policy. Yields a RetryNotice before each
+        backoff sleep (so streaming callers can tell the user) and finally
+        the result. Raises CircuitOpen, or the last error once retries or
+        the deadline are exhausted.
+        """
+        self.calls += 1
+        deadline = time.monotonic() + self.deadline
+
+        for attempt in range(1, self.max_attempts + 1):
+            self.breaker.allow()
+
+            remaining = deadline - time.monotonic()
+            try:
+                result = await asyncio.wait_for(fn(), timeout=remaining)
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker.release()
+                    self.failures += 1
+                    raise
+                self.breaker.record_failure()
+                if isinstance(e, asyncio.TimeoutError):
+                    self.deadline_exceeded += 1
+
+                delay = self.backoff(attempt, e)
+                out_of_time = time.monotonic() + delay >= deadline
+                if attempt == self.max_attempts or out_of_time or self.breaker.state == "open":
+                    self.failures += 1
+                    raise
+
+                self.retries += 1
+                yield RetryNotice(attempt, self.max_attempts, delay, e)
+                await asyncio.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            yield result
+            return
+
+    def record_stream_error(self, error: Exception):
+        """A stream that had already started failed part-way through."""
+        self.failures += 1
+        if is_retryable(error):
+            self.breaker.record_failure()
+
+    async def call(
+        self,
+        fn: Callable[[], Awaitable[Any]],
+        on_retry: Optional[Callable[[RetryNotice], None]] = None,
+    ) -> Any:
+        """Run fn() under the retry policy and return its result (on_retry sees each RetryNotice)."""
+        async for outcome in self.attempts(fn):
+            if not isinstance(outcome, RetryNotice):
+                return outcome
+            if on_retry is not None:
+                on_retry(outcome)
+
+    def stats(self) -> dict:
+        """Retry counters and breaker state for monitoring."""
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "deadline_exceeded": self.deadline_exceeded,
+            "max_attempts": self.max_attempts,
+            "deadline_seconds": self.deadline,
+            "breaker": self.breaker.stats(),
+        }
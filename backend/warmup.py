@@ -0,0 +1,225 @@
+"""
+Stage 3 Connection Warm-up
+
+A Stage 3 call that finds no idle keep-alive connection in the pool has to
+open one first: TCP connect and TLS handshake, often a few hundred ms to
+OpenRouter. On a quiet server (idle connections expire after
+OPENROUTER_KEEPALIVE_EXPIRY) that setup used to start only after Stage 1
+and Stage 2 had finished, so the two latencies added up.
+
+With warm-up enabled, a request that will need Stage 3 calls begin() as
+Stage 1 starts. If the pool doesn't already hold an idle connection for
+every request waiting on Stage 3, a cheap HEAD request opens one in the
+background, overlapping the handshake with DeBERTa inference. The real
+Stage 3 call then picks up the warm connection. The prompt depends on the
+Stage 2 severities, so nothing billable is sent speculatively.
+
+finish() returns the per-request timing (Stage 1 time, warm-up time and how
+much of it overlapped). Every upstream request is also traced, so /health
+shows how many Stage 3 calls still had to open a connection and what that
+cost.
+
+Streams only stay warm if their connection goes back to the pool. The
+OpenAI SDK closes a streamed response as soon as it reads "[DONE]", before
+the end of the chunked body, and httpcore drops a connection closed
+mid-body. DrainingTransport reads the rest of a body that has already
+sent "[DONE]" on close (bounded by drain_timeout), so finished streams
+return their connection; abandoned ones are closed at once as before.
+"""
+
+import asyncio
+import time
+from typing import Optional
+
+import httpx
+
+
+# =============================================================================
+# Transport
+# =============================================================================
+
+class DrainingResponseStream(httpx.AsyncByteStream):
+    """An SSE body that finishes reading itself on close once [DONE] was seen, so its connection can be reused."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, drain_timeout: float):
+        self._stream = stream
+        self._drain_timeout = drain_timeout
+        self._done_seen = False
+
+    async def __aiter__(self):
+        async for part in self._stream:
+            if b"[DONE]" in part:
+                self._done_seen = True
+            yield part
+
+    async def aclose(self):
+        try:
+            if self._done_seen:
+                await asyncio.wait_for(self._drain(), self._drain_timeout)
+        except (asyncio.TimeoutError, httpx.HTTPError):
+            pass  # the connection is closed instead of reused
+        finally:
+            await self._stream.aclose()
+
+    async def _drain(self):
+        async for _ in self._stream:
+            pass
+
+
+class DrainingTransport(httpx.AsyncHTTPTransport):
+    """httpx transport whose responses drain their remaining body on close."""
+
+    def __init__(self, *args, drain_timeout: float = 0.05, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.drain_timeout = drain_timeout
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await super().handle_async_request(request)
+        response.stream = DrainingResponseStream(response.stream, self.drain_timeout)
+        return response
+
+
+# =============================================================================
+# Warm-up
+# =============================================================================
+
+class Warmup:
+    """One request's warm-up, from the start of Stage 1 to the start of Stage 3."""
+
+    def __init__(self, warmer: "ConnectionWarmer", fired: bool):
+        self.warmer = warmer
+        self.fired = fired
+        self.started = time.monotonic()
+        self.warmup_ms: Optional[float] = None  # set when the HEAD request completes
+        self._finished: Optional[dict] = None
+
+    def finish(self) -> dict:
+        """Stage 3 is about to start: release the slot and report timing (idempotent)."""
+        if self._finished is None:
+            stage1_ms = (time.monotonic() - self.started) * 1000
+            if not self.fired:
+                overlap_ms = 0.0
+            elif self.warmup_ms is None:
+                overlap_ms = stage1_ms  # still connecting: all of Stage 1 overlapped
+            else:
+                overlap_ms = min(self.warmup_ms, stage1_ms)
+            self._finished = {
+                "warmup": "fired" if self.fired else "warm",
+                "stage1_ms": round(stage1_ms, 1),
+                "warmup_ms": round(self.warmup_ms, 1) if self.warmup_ms is not None else None,
+                "overlap_ms": round(overlap_ms, 1),
+            }
+            self.warmer._claimed(self, overlap_ms)
+        return self._finished
+
+
+class ConnectionWarmer:
+    """Keeps an idle upstream connection ready for each request heading to Stage 3."""
+
+    def __init__(self, http: httpx.AsyncClient, transport: httpx.AsyncHTTPTransport, url: str, enabled: bool = True):
+        self.http = http
+        self.transport = transport
+        self.url = url
+        self.enabled = enabled
+
+        self._waiting = 0    # requests between begin() and finish()
+        self._warming = 0    # HEAD requests in flight
+        self._tasks: set[asyncio.Task] = set()
+
+        # Counters (exposed on /health)
+        self.requests = 0
+        self.fired = 0
+        self.already_warm = 0
+        self.failed = 0
+        self.warmup_ms_total = 0.0
+        self.warmups_completed = 0
+        self.overlap_ms_total = 0.0
+        self.upstream_requests = 0
+        self.new_connections = 0
+        self.connect_ms_total = 0.0
+
+        http.event_hooks["request"].append(self._trace_request)
+
+    def begin(self) -> Optional[Warmup]:
+        """Start of Stage 1 for a request that will call Stage 3."""
+        if not self.enabled:
+            return None
+        self.requests += 1
+        self._waiting += 1
+
+        fire = self.idle_connections() + self._warming < self._waiting
+        warmup = Warmup(self, fire)
+        if fire:
+            self.fired += 1
+            self._warming += 1
+            task = asyncio.create_task(self._warm(warmup))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            self.already_warm += 1
+        return warmup
+
+    def idle_connections(self) -> int:
+        """Idle, unexpired keep-alive connections in the pool."""
+        # httpx doesn't expose its httpcore pool publicly; without it every
+        # waiting request is treated as needing a warm-up
+        pool = getattr(self.transport, "_pool", None)
+        if pool is None:
+            return 0
+        return sum(1 for c in pool.connections if c.is_idle() and not c.has_expired())
+
+    async def close(self):
+        """Cancel warm-ups still in flight."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        """Warm-up counters and upstream connection setups for monitoring."""
+        return {
+            "enabled": self.enabled,
+            "requests": self.requests,
+            "fired": self.fired,
+            "already_warm": self.already_warm,
+            "failed": self.failed,
+            "idle_connections": self.idle_connections(),
+            "mean_warmup_ms": round(self.warmup_ms_total / self.warmups_completed, 1) if self.warmups_completed else None,
+            "mean_overlap_ms": round(self.overlap_ms_total / self.fired, 1) if self.fired else None,
+            "upstream_requests": self.upstream_requests,
+            "new_connections": self.new_connections,
+            "mean_connect_ms": round(self.connect_ms_total / self.new_connections, 1) if self.new_connections else None,
+        }
+
+    async def _warm(self, warmup: Warmup):
+        try:
+            await self.http.head(self.url, extensions={"warmup": True})
+            warmup.warmup_ms = (time.monotonic() - warmup.started) * 1000
+            self.warmup_ms_total += warmup.warmup_ms
+            self.warmups_completed += 1
+        except httpx.HTTPError:
+            self.failed += 1
+        finally:
+            self._warming -= 1
+
+    def _claimed(self, warmup: Warmup, overlap_ms: float):
+        self._waiting -= 1
+        if warmup.fired:
+            self.overlap_ms_total += overlap_ms
+
+    async def _trace_request(self, request: httpx.Request):
+        """Time connection setup (TCP + TLS) of every upstream request but warm-ups."""
+        if request.extensions.get("warmup"):
+            return
+        self.upstream_requests += 1
+        connect_started = None
+
+        async def trace(event: str, info: dict):
+            nonlocal connect_started
+            if event == "connection.connect_tcp.started":
+                connect_started = time.monotonic()
+            elif event.endswith("send_request_headers.started") and connect_started is not None:
+                self.new_connections += 1
+                self.connect_ms_total += (time.monotonic() - connect_started) * 1000
+                connect_started = None
+
+        request.extensions["trace"] = trace
@@ -54,6 +54,80 @@ ENABLE_AUTH = get_bool_env("ENABLE_AUTH", default=False)
 
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY", "")
 
+# API base URL; point at a local mock (python -m backend.mock_openrouter)
+# to load-test without calling OpenRouter
+OPENROUTER_BASE_URL = os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+
+# Stage 3 runs on an async client over one shared keep-alive connection
+# pool. At most OPENROUTER_MAX_CONNECTIONS requests are open at once, of
+# which OPENROUTER_MAX_KEEPALIVE idle connections are kept warm for
+# OPENROUTER_KEEPALIVE_EXPIRY seconds. Timeouts are in seconds; the read
+# timeout is the longest gap allowed between streamed chunks.
+OPENROUTER_MAX_CONNECTIONS = int(os.environ.get("OPENROUTER_MAX_CONNECTIONS", "100"))
+OPENROUTER_MAX_KEEPALIVE = int(os.environ.get("OPENROUTER_MAX_KEEPALIVE", "20"))
+OPENROUTER_KEEPALIVE_EXPIRY = float(os.environ.get("OPENROUTER_KEEPALIVE_EXPIRY", "30"))
+OPENROUTER_CONNECT_TIMEOUT = float(os.environ.get("OPENROUTER_CONNECT_TIMEOUT", "5"))
+OPENROUTER_READ_TIMEOUT = float(os.environ.get("OPENROUTER_READ_TIMEOUT", "60"))
+OPENROUTER_POOL_TIMEOUT = float(os.environ.get("OPENROUTER_POOL_TIMEOUT", "10"))
+
+# Connection warm-up: while Stage 1 runs, open a keep-alive connection to
+# OpenRouter (with a HEAD request) if none is idle, so the Stage 3 call
+# doesn't wait for the TCP and TLS handshake after Stage 2
+STAGE3_WARMUP = get_bool_env("STAGE3_WARMUP", default=True)
+
+# Retries: transient failures (429, 5xx, 529, timeouts) are retried up to
+# STAGE3_MAX_ATTEMPTS times with exponential backoff and jitter, starting
+# at STAGE3_BACKOFF_BASE seconds and capped at STAGE3_BACKOFF_MAX (or the
+# provider's Retry-After, if longer). Each call, retries included, must
+# produce a response within STAGE3_DEADLINE seconds.
+STAGE3_MAX_ATTEMPTS = int(os.environ.get("STAGE3_MAX_ATTEMPTS", "3"))
+STAGE3_BACKOFF_BASE = float(os.environ.get("STAGE3_BACKOFF_BASE", "0.5"))
+STAGE3_BACKOFF_MAX = float(os.environ.get("STAGE3_BACKOFF_MAX", "8"))
+STAGE3_DEADLINE = float(os.environ.get("STAGE3_DEADLINE", "30"))
+
+# Circuit breaker: once STAGE3_BREAKER_FAILURE_RATE of the last
+# STAGE3_BREAKER_WINDOW calls failed (with at least STAGE3_BREAKER_MIN_CALLS
+# in the window), Stage 3 fails fast for STAGE3_BREAKER_COOLDOWN seconds,
+# then lets one trial call through.
+STAGE3_BREAKER_FAILURE_RATE = float(os.environ.get("STAGE3_BREAKER_FAILURE_RATE", "0.5"))
+STAGE3_BREAKER_WINDOW = int(os.environ.get("STAGE3_BREAKER_WINDOW", "20"))
+STAGE3_BREAKER_MIN_CALLS = int(os.environ.get("STAGE3_BREAKER_MIN_CALLS", "5"))
+STAGE3_BREAKER_COOLDOWN = float(os.environ.get("STAGE3_BREAKER_COOLDOWN", "30"))
+
+# Fallback diagnosis: if Haiku hasn't answered within STAGE3_LATENCY_BUDGET
+# seconds (for streams: hasn't sent its first token), the breaker is open or
+# the call fails, a diagnosis composed locally from the Stage 2 findings is
+# served instead, tagged with source "fallback". Set STAGE3_FALLBACK=0 to
+# return the error instead.
+STAGE3_FALLBACK = get_bool_env("STAGE3_FALLBACK", default=True)
+STAGE3_LATENCY_BUDGET = float(os.environ.get("STAGE3_LATENCY_BUDGET", "10"))
+
+# Hedged streams: when a diagnosis stream hasn't sent its first token after
+# the STAGE3_HEDGE_PERCENTILE of recent time-to-first-token (at least
+# STAGE3_HEDGE_MIN_DELAY seconds), a second identical request is sent and
+# the first to stream wins. At most STAGE3_HEDGE_MAX_RATE of recent streams
+# may hedge.
+STAGE3_HEDGE = get_bool_env("STAGE3_HEDGE", default=False)
+STAGE3_HEDGE_PERCENTILE = float(os.environ.get("STAGE3_HEDGE_PERCENTILE", "95"))
+STAGE3_HEDGE_MIN_DELAY = float(os.environ.get("STAGE3_HEDGE_MIN_DELAY", "1"))
+STAGE3_HEDGE_MAX_RATE = float(os.environ.get("STAGE3_HEDGE_MAX_RATE", "0.1"))
+
+# Mark the static system prompts for provider-side prompt caching
+# (cache_control), so repeat calls can reuse the cached prefix. Providers
+# ignore the mark on prompts below their minimum cacheable length, which
+# the current system prompts are
+STAGE3_PROMPT_CACHE = get_bool_env("STAGE3_PROMPT_CACHE", default=True)
+
+# Usage accounting: tokens, latency and retries of every Stage 3 call are
+# aggregated per day and user, flushed to STAGE3_USAGE_DB_PATH every
+# STAGE3_USAGE_FLUSH_INTERVAL seconds and shown in the admin API. Cost is
+# estimated at these prices (USD per million tokens; cached prompt tokens
+# at STAGE3_PRICE_CACHED).
+STAGE3_USAGE_FLUSH_INTERVAL = float(os.environ.get("STAGE3_USAGE_FLUSH_INTERVAL", "60"))
+STAGE3_PRICE_INPUT = float(os.environ.get("STAGE3_PRICE_INPUT", "1.0"))
+STAGE3_PRICE_OUTPUT = float(os.environ.get("STAGE3_PRICE_OUTPUT", "5.0"))
+STAGE3_PRICE_CACHED = float(os.environ.get("STAGE3_PRICE_CACHED", "0.1"))
+
 
 # =============================================================================
 # Auth Configuration (only used if ENABLE_AUTH=1)
@@ -89,12 +163,130 @@ SMTP_FROM_EMAIL = os.environ.get("SMTP_FROM_EMAIL", "noreply@example.com")
 SMTP_FROM_NAME = os.environ.get("SMTP_FROM_NAME", "Coherence Diagnostic")
 
 
+# =============================================================================
+# Stage 1 Inference
+# =============================================================================
+
+# Micro-batching: concurrent requests are gathered into one forward pass.
+# A batch is dispatched when it reaches STAGE1_MAX_BATCH_SIZE concepts or
+# STAGE1_MAX_WAIT_MS after the first concept arrived, whichever comes first.
+STAGE1_MAX_BATCH_SIZE = int(os.environ.get("STAGE1_MAX_BATCH_SIZE", "16"))
+STAGE1_MAX_WAIT_MS = float(os.environ.get("STAGE1_MAX_WAIT_MS", "10"))
+
+# Worker pool: forward passes run in STAGE1_WORKERS threads, off the event loop.
+# At most STAGE1_QUEUE_SIZE concepts may wait (cohort items from /analyse/batch
+# included); beyond that requests get a 503 with a Retry-After of
+# STAGE1_RETRY_AFTER seconds.
+STAGE1_WORKERS = int(os.environ.get("STAGE1_WORKERS", "1"))
+STAGE1_QUEUE_SIZE = int(os.environ.get("STAGE1_QUEUE_SIZE", "64"))
+STAGE1_RETRY_AFTER = int(os.environ.get("STAGE1_RETRY_AFTER", "5"))
+
+# Score cache: repeat concepts skip the forward pass entirely.
+# STAGE1_CACHE_SIZE entries are kept in memory (0 disables the cache).
+# With STAGE1_CACHE_PERSIST=1, scores are also stored in SQLite and
+# survive restarts.
+STAGE1_CACHE_SIZE = int(os.environ.get("STAGE1_CACHE_SIZE", "1024"))
+STAGE1_CACHE_PERSIST = get_bool_env("STAGE1_CACHE_PERSIST", default=False)
+
+# INT8 dynamic quantization of the DeBERTa linear layers (CPU only).
+# Faster and smaller than fp32. Check severity parity before enabling:
+#   python -m backend.quantization
+STAGE1_QUANTIZE = get_bool_env("STAGE1_QUANTIZE", default=False)
+
+# Inference engine: "torch" (eager PyTorch) or "onnx" (ONNX Runtime, graph
+# exported from the local checkpoint on first start; needs onnxruntime).
+STAGE1_ENGINE = os.environ.get("STAGE1_ENGINE", "torch").lower().strip()
+
+# Length buckets (token counts, comma-separated): within a batch, concepts
+# are grouped by length and each group is padded only to its own longest
+# sequence. Empty disables bucketing (pad everything to the longest).
+STAGE1_LENGTH_BUCKETS = [
+    int(b) for b in os.environ.get("STAGE1_LENGTH_BUCKETS", "64,128,256").split(",") if b.strip()
+]
+
+# Threads per forward pass (0 = library default, i.e. every core). With
+# several workers or processes, keep threads x workers within the core count.
+STAGE1_THREADS = int(os.environ.get("STAGE1_THREADS", "0"))
+STAGE1_INTEROP_THREADS = int(os.environ.get("STAGE1_INTEROP_THREADS", "0"))
+
+# Tuned profile: python -m backend.tuning measures thread counts and batch
+# sizes on this machine and writes STAGE1_PROFILE_PATH. When it matches the
+# engine, precision, workers and hardware it overrides STAGE1_THREADS,
+# STAGE1_INTEROP_THREADS and STAGE1_MAX_BATCH_SIZE. Set 0 to ignore it.
+STAGE1_USE_PROFILE = get_bool_env("STAGE1_USE_PROFILE", default=True)
+
+
+# =============================================================================
+# Batch Analysis
+# =============================================================================
+
+# POST /analyse/batch: most concepts accepted per request, and how many
+# Stage 3 diagnoses may be in flight at once for one batch. A cohort's
+# concepts must all fit in the Stage 1 queue, so BATCH_MAX_CONCEPTS is
+# capped at STAGE1_QUEUE_SIZE.
+BATCH_MAX_CONCEPTS = min(int(os.environ.get("BATCH_MAX_CONCEPTS", "64")), STAGE1_QUEUE_SIZE)
+BATCH_DIAGNOSIS_CONCURRENCY = int(os.environ.get("BATCH_DIAGNOSIS_CONCURRENCY", "8"))
+
+
+# =============================================================================
+# Diagnosis Cache
+# =============================================================================
+
+# Complete Stage 3 diagnoses are reused for the same concept and severity
+# pattern (and prompt version and model). DIAGNOSIS_CACHE_SIZE entries are
+# kept in memory (0 disables the cache), each for DIAGNOSIS_CACHE_TTL seconds.
+DIAGNOSIS_CACHE_SIZE = int(os.environ.get("DIAGNOSIS_CACHE_SIZE", "512"))
+DIAGNOSIS_CACHE_TTL = float(os.environ.get("DIAGNOSIS_CACHE_TTL", "86400"))
+
+
+# =============================================================================
+# Streaming
+# =============================================================================
+
+# /analyse/stream frames are buffered server-side and carry SSE ids, so a
+# client that reconnects with Last-Event-ID resumes without re-running the
+# analysis. Finished streams stay resumable for STREAM_RESUME_TTL seconds;
+# at most STREAM_RESUME_MAX are buffered. A stream with nothing to send
+# emits a heartbeat comment every STREAM_HEARTBEAT_INTERVAL seconds.
+STREAM_RESUME_TTL = float(os.environ.get("STREAM_RESUME_TTL", "60"))
+STREAM_RESUME_MAX = int(os.environ.get("STREAM_RESUME_MAX", "1000"))
+STREAM_HEARTBEAT_INTERVAL = float(os.environ.get("STREAM_HEARTBEAT_INTERVAL", "15"))
+
+# A streamed analysis whose client disconnected and hasn't resumed within
+# STREAM_CANCEL_GRACE seconds is cancelled: its Haiku stream is closed
+# (unless other requests share it) and the stream can no longer be resumed.
+STREAM_CANCEL_GRACE = float(os.environ.get("STREAM_CANCEL_GRACE", "5"))
+
+# Streamed Stage 3 deltas are joined into one SSE frame per
+# STREAM_COALESCE_MS window, or sooner once STREAM_COALESCE_BYTES of text
+# are waiting (0 bytes: no size limit). The first delta is always sent at
+# once. STREAM_COALESCE_MS=0 sends every delta as its own frame.
+STREAM_COALESCE_MS = float(os.environ.get("STREAM_COALESCE_MS", "100"))
+STREAM_COALESCE_BYTES = int(os.environ.get("STREAM_COALESCE_BYTES", "1024"))
+
+
+# =============================================================================
+# Live Scoring
+# =============================================================================
+
+# The /analyse/live WebSocket scores a concept while it is typed. Edits are
+# debounced: Stage 1 runs once no newer edit has arrived for
+# LIVE_DEBOUNCE_MS. Each connection runs at most one scoring job at a time
+# and at most LIVE_MAX_SCORES_PER_MINUTE of them.
+LIVE_DEBOUNCE_MS = float(os.environ.get("LIVE_DEBOUNCE_MS", "300"))
+LIVE_MAX_SCORES_PER_MINUTE = int(os.environ.get("LIVE_MAX_SCORES_PER_MINUTE", "60"))
+
+
 # =============================================================================
 # Paths
 # =============================================================================
 
 MODEL_PATH = Path(__file__).parent / "models" / "deberta-coherence"
 DB_PATH = Path(__file__).parent / "data" / "users.db"
+STAGE1_CACHE_DB_PATH = Path(__file__).parent / "data" / "stage1_cache.db"
+STAGE1_PROFILE_PATH = Path(__file__).parent / "data" / "stage1_profile.json"
+STAGE1_PARITY_CORPUS_PATH = Path(__file__).parent / "data" / "parity_corpus.jsonl"
+STAGE3_USAGE_DB_PATH = Path(__file__).parent / "data" / "stage3_usage.db"
 
 
 # =============================================================================
@@ -127,7 +319,29 @@ def print_config_summary():
     print("=" * 60)
     mode = "gated access (auth + admin)" if ENABLE_AUTH else "open access"
     print(f"  Mode:         {mode}")
-    print(f"  OpenRouter:   {'configured' if OPENROUTER_API_KEY else 'MISSING'}")
+    print(f"  OpenRouter:   {'configured' if OPENROUTER_API_KEY else 'MISSING'} ({OPENROUTER_BASE_URL})")
+    print(f"  Stage 3 pool: {OPENROUTER_MAX_CONNECTIONS} connections ({OPENROUTER_MAX_KEEPALIVE} keep-alive), "
+          f"{OPENROUTER_CONNECT_TIMEOUT:g} s connect / {OPENROUTER_READ_TIMEOUT:g} s read timeout"
+          + (", warmed during Stage 1" if STAGE3_WARMUP else ""))
+    print(f"  Stage 3:      {STAGE3_MAX_ATTEMPTS} attempts, {STAGE3_DEADLINE:g} s deadline, "
+          f"breaker at {STAGE3_BREAKER_FAILURE_RATE:.0%} failures")
+    print(f"  Fallback:     {f'local diagnosis after {STAGE3_LATENCY_BUDGET:g} s' if STAGE3_FALLBACK else 'disabled'}")
+    print(f"  Hedging:      {f'p{STAGE3_HEDGE_PERCENTILE:g} TTFT, up to {STAGE3_HEDGE_MAX_RATE:.0%} of streams' if STAGE3_HEDGE else 'disabled'}")
+    print(f"  Prompt cache: {'cache_control on system prompts' if STAGE3_PROMPT_CACHE else 'disabled'}")
+    print(f"  Usage:        flushed every {STAGE3_USAGE_FLUSH_INTERVAL:g} s, ${STAGE3_PRICE_INPUT:g} in / "
+          f"${STAGE3_PRICE_OUTPUT:g} out per M tokens")
+    print(f"  Stage 1:      batches of up to {STAGE1_MAX_BATCH_SIZE}, {STAGE1_MAX_WAIT_MS:g} ms window")
+    print(f"  Workers:      {STAGE1_WORKERS} thread(s), queue limit {STAGE1_QUEUE_SIZE}")
+    print(f"  Engine:       {STAGE1_ENGINE}, {'int8 (dynamic quantization)' if STAGE1_QUANTIZE else 'fp32'}")
+    print(f"  Threads:      {STAGE1_THREADS or 'default'} intra-op, {STAGE1_INTEROP_THREADS or 'default'} inter-op"
+          + (" (tuned profile applies if present)" if STAGE1_USE_PROFILE else ""))
+    cache_tier = "memory + SQLite" if STAGE1_CACHE_PERSIST else "memory"
+    print(f"  Score cache:  {STAGE1_CACHE_SIZE} entries ({cache_tier})" if STAGE1_CACHE_SIZE else "  Score cache:  disabled")
+    print(f"  Diag. cache:  {DIAGNOSIS_CACHE_SIZE} entries, {DIAGNOSIS_CACHE_TTL:g} s TTL" if DIAGNOSIS_CACHE_SIZE else "  Diag. cache:  disabled")
+    print(f"  Streams:      resumable for {STREAM_RESUME_TTL:g} s (up to {STREAM_RESUME_MAX}), "
+          f"heartbeat every {STREAM_HEARTBEAT_INTERVAL:g} s, cancelled {STREAM_CANCEL_GRACE:g} s after a disconnect")
+    print(f"  Coalescing:   {f'{STREAM_COALESCE_MS:g} ms / {STREAM_COALESCE_BYTES} byte frames' if STREAM_COALESCE_MS > 0 else 'disabled'}")
+    print(f"  Live scoring: {LIVE_DEBOUNCE_MS:g} ms debounce, up to {LIVE_MAX_SCORES_PER_MINUTE} scores/min per connection")
 
     if ENABLE_AUTH:
         print(f"  Session:      {'configured' if SESSION_SECRET else 'MISSING'}")
@@ -396,6 +396,49 @@ def evaluate_concept(stage1_output: Dict[str, Union[int, float]]) -> Dict[str, A
     return evaluation
 
 
+def evaluate_concepts(stage1_outputs: List[Dict[str, Union[int, float]]]) -> List[Dict[str, Any]]:
+    """
+    Batch version of evaluate_concept() for many concepts at once.
+
+    The rule evaluations depend only on the severity levels, and five
+    three-state dimensions give at most 243 combinations. A cohort of
+    hundreds of concepts therefore shares a handful of patterns: each
+    pattern is evaluated once and reused.
+
+    The shared rule dicts are not copied, so callers must treat results
+    as read-only (as the API does when serialising them).
+
+    Args:
+        stage1_outputs: List of Stage 1 outputs, as for evaluate_concept()
+
+    Returns:
+        List of evaluations in input order, identical to calling
+        evaluate_concept() on each output
+    """
+    by_pattern: Dict[tuple, Dict[str, Any]] = {}
+    results = []
+
+    for stage1_output in stage1_outputs:
+        severity = get_severity_map(stage1_output)
+        pattern = tuple(sorted(severity.items()))
+
+        if pattern not in by_pattern:
+            by_pattern[pattern] = evaluate_concept(stage1_output)
+        shared = by_pattern[pattern]
+
+        results.append({
+            "claim_evidence": shared["claim_evidence"],
+            "scope": shared["scope"],
+            "assumptions": shared["assumptions"],
+            "gaps": shared["gaps"],
+            "severity_levels": severity,
+            "confidence_scores": stage1_output,
+            "summary": shared["summary"]
+        })
+
+    return results
+
+
 # =============================================================================
 # Convenience Functions
 # =============================================================================
@@ -504,6 +547,103 @@ def format_severity_display(evaluation: Dict[str, Any]) -> str:
     return "\n".join(lines)
 
 
+# =============================================================================
+# Fallback Diagnosis
+# =============================================================================
+
+# Why each non-SOLID finding matters, in the same plain register as the findings
+FINDING_CONSEQUENCES = {
+    "CLAIM_WITHOUT_EVIDENCE": "Without it, a reader has no way to judge whether the claim holds.",
+    "EVIDENCE_WITHOUT_CLAIM": "Without a claim, it's unclear what the evidence is meant to show.",
+    "FOUNDATION_MISSING": "Without either, the rest of the concept has nothing to stand on.",
+    "CLAIM_EVIDENCE_UNCLEAR": "The writing is too imprecise for the tool to confirm what is claimed or what backs it up.",
+    "SCOPE_UNBOUNDED": "Without boundaries, it's impossible to tell who the design serves or where it stops applying.",
+    "SCOPE_UNCLEAR": "A context is mentioned, but too loosely to tell where it ends.",
+    "ASSUMPTIONS_HIDDEN": "Every design depends on things that must be true, and here none of them are named.",
+    "ASSUMPTIONS_UNCLEAR": "They are hinted at rather than stated, so they can't be examined.",
+    "REASONING_GAPS_PRESENT": "The reader is left to guess how one step leads to the next.",
+    "REASONING_GAPS_UNCLEAR": "Some steps are implied rather than shown, so the tool can't confirm the chain holds.",
+}
+
+# How each rule is named when listed briefly
+FINDING_NAMES = {
+    "claim_evidence": "the link between claim and evidence",
+    "scope": "the scope",
+    "assumptions": "the assumptions",
+    "gaps": "the reasoning from problem to solution",
+}
+
+
+def _opening_words(concept: str, max_words: int = 8) -> str:
+    """The concept's first few words, for quoting back to the student."""
+    first_sentence = concept.strip().replace('"', "'").split(". ")[0].rstrip(".")
+    words = first_sentence.split()
+    if len(words) > max_words:
+        return " ".join(words[:max_words]) + "…"
+    return " ".join(words)
+
+
+def compose_diagnosis(concept: str, evaluation: Dict[str, Any]) -> str:
+    """
+    Compose a plain-language diagnosis from an evaluation, without an LLM.
+
+    Used when Stage 3 is slow or unavailable. Follows the same rules as the
+    Haiku prompt: SOLID dimensions are skipped, nothing is prescribed, the
+    student's own words are quoted, and the result is 3-6 sentences. The
+    two most severe findings are explained, any others are named briefly,
+    and the most severe finding's first prompt closes as a question. With
+    every dimension SOLID there is nothing to discuss, so the result is two
+    neutral notes and a reflective question.
+
+    Args:
+        concept: The concept text the evaluation was computed for
+        evaluation: Result from evaluate_concept()
+
+    Returns:
+        Diagnosis text (a single paragraph)
+    """
+    severity = evaluation["severity_levels"]
+    rank = {Severity.ATTENTION_NEEDED: 0, Severity.WORTH_EXAMINING: 1}
+
+    # Findings for dimensions that aren't SOLID, most severe first
+    issues = [
+        (key, evaluation[key])
+        for key in ["claim_evidence", "scope", "assumptions", "gaps"]
+        if evaluation[key]["status"] in FINDING_CONSEQUENCES
+    ]
+    issues.sort(key=lambda item: rank.get(item[1]["severity"], 2))
+
+    quote = _opening_words(concept)
+
+    if not issues:
+        # Nothing to discuss: neutral notes and a question, naming no dimension
+        sentences = [
+            f'Nothing in "{quote}" was flagged as missing or vague.',
+            "That describes how the idea is written down, not whether it will work.",
+            "What would you test first to find out whether it holds up?",
+        ]
+        return " ".join(sentences)
+
+    sentences = []
+    for i, (_, item) in enumerate(issues[:2]):
+        finding = item["finding"]
+        if i == 0:
+            finding = f'In "{quote}", {finding[0].lower()}{finding[1:]}'
+        sentences.append(finding)
+        sentences.append(FINDING_CONSEQUENCES[item["status"]])
+
+    others = [FINDING_NAMES[key] for key, _ in issues[2:]]
+    if others:
+        listed = others[0] if len(others) == 1 else ", ".join(others[:-1]) + " and " + others[-1]
+        sentences.append(f"{listed[0].upper()}{listed[1:]} also {'need' if len(others) > 1 else 'needs'} a closer look.")
+
+    question = issues[0][1]["prompts"]
+    if question:
+        sentences.append(question[0])
+
+    return " ".join(sentences)
+
+
 # =============================================================================
 # Testing
 # =============================================================================
@@ -591,6 +731,73 @@ def test_all_states():
     return True
 
 
+def test_batch_evaluation():
+    """
+    Test that batch evaluation matches single evaluation.
+    """
+    test_cases = [
+        {"CLAIM": 0.95, "EVIDENCE": 0.90, "SCOPE": 0.88, "ASSUMPTIONS": 0.85, "GAPS": 0.10},
+        {"CLAIM": 0.25, "EVIDENCE": 0.30, "SCOPE": 0.20, "ASSUMPTIONS": 0.15, "GAPS": 0.70},
+        # Same severity pattern as the first case, different confidences
+        {"CLAIM": 0.91, "EVIDENCE": 0.83, "SCOPE": 0.99, "ASSUMPTIONS": 0.81, "GAPS": 0.05},
+        {"CLAIM": 0.65, "EVIDENCE": 0.45, "SCOPE": 0.90, "ASSUMPTIONS": 0.55, "GAPS": 0.35},
+    ]
+
+    batch = evaluate_concepts(test_cases)
+
+    assert len(batch) == len(test_cases)
+    for tc, result in zip(test_cases, batch):
+        assert result == evaluate_concept(tc)
+
+    print("✓ Batch evaluation test passed")
+
+
+def test_fallback_diagnosis():
+    """
+    Test that the fallback diagnosis follows the Stage 3 rules.
+    """
+    concept = "Our app helps students find study partners. Most of them study alone."
+    test_cases = [
+        {"CLAIM": 0.95, "EVIDENCE": 0.90, "SCOPE": 0.88, "ASSUMPTIONS": 0.85, "GAPS": 0.10},
+        {"CLAIM": 0.25, "EVIDENCE": 0.30, "SCOPE": 0.20, "ASSUMPTIONS": 0.15, "GAPS": 0.70},
+        {"CLAIM": 0.65, "EVIDENCE": 0.45, "SCOPE": 0.90, "ASSUMPTIONS": 0.55, "GAPS": 0.35},
+        {"CLAIM": 0.92, "EVIDENCE": 0.22, "SCOPE": 0.85, "ASSUMPTIONS": 0.85, "GAPS": 0.15},
+    ]
+
+    for tc in test_cases:
+        evaluation = evaluate_concept(tc)
+        diagnosis = compose_diagnosis(concept, evaluation)
+        sentence_count = diagnosis.count(". ") + diagnosis.count("? ") + 1
+
+        assert "you should" not in diagnosis.lower()
+        assert '"Our app helps students find study partners"' in diagnosis
+        assert 3 <= sentence_count <= 6, diagnosis
+
+    # SOLID dimensions are not discussed
+    diagnosis = compose_diagnosis(concept, evaluate_concept(test_cases[3]))
+    assert "scope" not in diagnosis.lower()
+    assert "haven't shown how you know" in diagnosis
+
+    print("✓ Fallback diagnosis test passed")
+
+
+def test_fallback_diagnosis_all_solid():
+    """
+    Test that an all-SOLID fallback diagnosis neither names nor praises any dimension.
+    """
+    concept = "Our app helps students find study partners. Most of them study alone."
+    evaluation = evaluate_concept({"CLAIM": 0.95, "EVIDENCE": 0.90, "SCOPE": 0.88, "ASSUMPTIONS": 0.95, "GAPS": 0.05})
+    assert all(level == Severity.SOLID for level in evaluation["severity_levels"].values())
+
+    diagnosis = compose_diagnosis(concept, evaluation)
+    for name in ["claim", "evidence", "scope", "assumption", "gap", "reasoning"]:
+        assert name not in diagnosis.lower(), diagnosis
+    assert diagnosis.count(". ") + diagnosis.count("? ") + 1 == 3, diagnosis
+    assert diagnosis.endswith("?")
+
+    print("✓ All-SOLID fallback diagnosis test passed")
+
+
 # =============================================================================
 # Main
 # =============================================================================
@@ -607,6 +814,9 @@ if __name__ == "__main__":
     test_confidence_thresholds()
     test_full_evaluation()
     test_all_states()
+    test_batch_evaluation()
+    test_fallback_diagnosis()
+    test_fallback_diagnosis_all_solid()
     print()
 
     # Example evaluation with confidence scores